@@ -0,0 +1,175 @@
+""" Check piece meshes and vertex relations built with array operations match the original cell by cell loops """
+import sys
+
+import numpy as np
+
+from src.utils.file_io import read_json
+from src.simulation.common import PieceGrid
+from src.simulation.mesh import MeshData, get_annotation_dict_from_piece_data
+from src.simulation.setup.extract_clothing_vertex_data import (extract_grid, convert_rows_of_vertices_into_triangles,
+                                                               get_all_vertex_relationships)
+
+from src.parameters import CM_PER_M
+
+CLOTHING_PATH = './assets/sewing_shirt.json'
+RESOLUTIONS = (1, 3)  # Grid resolutions (cm) the shirt is checked at
+RANDOM_MASK_FILLS = (0.3, 0.6, 0.9)  # Fraction of points inside random masks
+
+
+def get_loop_mesh(grid: PieceGrid, piece_data: dict) -> tuple:
+    """ Mesh and grid indices as built by the original loop over every grid point """
+    vertex_data = []
+    faces = []
+    next_vertex_data_ind = np.int32(0)
+    vertex_indices = np.zeros(grid.shape, dtype=np.int32)
+    x_range = grid.x_range.astype(np.float32)
+    y_range = grid.y_range.astype(np.float32)
+
+    (min_x, min_y), (max_x, max_y) = piece_data["bounding_box"]
+    width = max_x - min_x
+    height = max_y - min_y
+
+    for i, row in enumerate(grid.inside_mask):
+        for j, is_inside in enumerate(row):
+            if not is_inside:
+                continue
+            vertex = (x_range[j], y_range[i])
+            vertex_row = [vertex[0], vertex[1], 0., vertex[0] / width, vertex[1] / height, 0., 0., 1.]
+
+            next_vertex_data_ind += 1
+            vertex_data.append(vertex_row)
+            vertex_indices[i][j] = next_vertex_data_ind
+
+            if i > 0 and j > 0:
+                lower_left = vertex_indices[i - 1, j - 1]
+                lower_right = vertex_indices[i - 1, j]
+                upper_left = vertex_indices[i, j - 1]
+
+                if lower_left and upper_left:
+                    faces.append([next_vertex_data_ind - 1, upper_left - 1, lower_left - 1])
+
+                if lower_left and lower_right:
+                    faces.append([lower_right - 1, next_vertex_data_ind - 1, lower_left - 1])
+
+    texture_data = {
+        (0.5, 0.5, 0.5): {'count': len(faces), 'offset': 0}
+    }
+
+    turn_points = np.array(
+        [[x, y, 0] for x, y in piece_data["turn_points"]], dtype=np.float32
+    )
+
+    mesh = MeshData(
+        np.array(vertex_data, dtype=np.float32).reshape(-1, 8) / CM_PER_M,
+        np.array(faces, dtype=np.uint32),
+        texture_data,
+        annotations=get_annotation_dict_from_piece_data(piece_data),
+        turn_points=turn_points / CM_PER_M
+    )
+    if piece_data["body_points"]["alignment"]["flip"]:
+        mesh.flip_x()
+
+    return mesh, vertex_indices
+
+
+def get_loop_relations(grid: PieceGrid, grid_indices: np.ndarray) -> tuple:
+    """ Stress, shear and bend relations as built by the original loop over every grid point """
+    stress_relations = []
+    shear_relations = []
+    bend_relations = []
+
+    nr_rows, nr_cols = grid.shape
+
+    for i in range(nr_rows):
+        for j in range(nr_cols):
+            current_ind = grid_indices[i, j]
+            lower_left = grid_indices[i - 1, j - 1] if i > 0 and j > 0 else None
+            lower_middle = grid_indices[i - 1, j] if i > 0 else None
+            middle_left = grid_indices[i, j - 1] if j > 0 else None
+            upper_middle = grid_indices[i + 1, j] if i < nr_rows - 1 else None
+            middle_right = grid_indices[i, j + 1] if j < nr_cols - 1 else None
+
+            if current_ind:
+                if lower_middle:
+                    stress_relations.append([current_ind - 1, lower_middle - 1])
+
+                    if upper_middle:
+                        bend_relations.append([upper_middle - 1, current_ind - 1, lower_middle - 1])
+
+                if middle_left:
+                    stress_relations.append([current_ind - 1, middle_left - 1])
+
+                    if middle_right:
+                        bend_relations.append([middle_right - 1, current_ind - 1, middle_left - 1])
+
+                if lower_left:
+                    shear_relations.append([current_ind - 1, lower_left - 1])
+
+            if lower_middle and middle_left:
+                shear_relations.append([lower_middle - 1, middle_left - 1])
+
+    return (np.array(stress_relations, dtype=np.uint32), np.array(shear_relations, dtype=np.uint32),
+            np.array(bend_relations, dtype=np.uint32))
+
+
+def get_sorted_rows(relations: np.ndarray, width: int) -> np.ndarray:
+    """ Relations as rows in sorted order so arrays are compared up to ordering """
+    rows = relations.reshape(-1, width)
+    return rows[np.lexsort(rows.T[::-1])]
+
+
+def get_mismatches(grid: PieceGrid, piece_data: dict) -> list:
+    """ Names of arrays built from grid that differ from the loop output """
+    mesh, grid_indices = convert_rows_of_vertices_into_triangles(grid, piece_data)
+    relations = get_all_vertex_relationships(grid, grid_indices)
+    loop_mesh, loop_grid_indices = get_loop_mesh(grid, piece_data)
+    stress_relations, shear_relations, bend_relations = get_loop_relations(grid, loop_grid_indices)
+
+    comparisons = {
+        'grid indices': (grid_indices, loop_grid_indices),
+        'vertices': (mesh._vertex_data, loop_mesh._vertex_data),
+        'faces': (get_sorted_rows(mesh._index_data, 3), get_sorted_rows(loop_mesh._index_data, 3)),
+        'stress': (get_sorted_rows(relations.stress_relations, 2), get_sorted_rows(stress_relations, 2)),
+        'shear': (get_sorted_rows(relations.shear_relations, 2), get_sorted_rows(shear_relations, 2)),
+        'bend': (get_sorted_rows(relations.bend_relations, 3), get_sorted_rows(bend_relations, 3)),
+    }
+    return [name for name, (array, expected) in comparisons.items()
+            if array.dtype != expected.dtype or not np.array_equal(array, expected)]
+
+
+def get_irregular_masks(shape: tuple) -> dict:
+    """ Masks with holes, thin strips, isolated points and diagonal only contact over a grid of shape """
+    nr_rows, nr_cols = shape
+    rows, cols = np.indices(shape)
+    random_state = np.random.RandomState(0)
+
+    masks = {f'random {fill}': random_state.random_sample(shape) < fill for fill in RANDOM_MASK_FILLS}
+    masks['checkerboard'] = (rows + cols) % 2 == 0
+    masks['single row'] = rows == nr_rows // 2
+    masks['single column'] = cols == nr_cols // 2
+    masks['ring'] = np.abs(np.hypot(rows - nr_rows / 2, cols - nr_cols / 2) - min(shape) / 3) < 2
+    masks['full'] = np.ones(shape, dtype=bool)
+    masks['single point'] = (rows == 0) & (cols == nr_cols - 1)
+    return masks
+
+
+if __name__ == '__main__':
+    clothing_data = read_json(CLOTHING_PATH)
+    failed = False
+
+    for resolution in RESOLUTIONS:
+        for key, piece_data in clothing_data["pieces"].items():
+            piece_grid = extract_grid(piece_data, resolution)
+            mismatches = get_mismatches(piece_grid, piece_data)
+            print(f'{key + " at " + str(resolution) + "cm":20} '
+                  f'{"differs in " + ", ".join(mismatches) if mismatches else "matches"}')
+            failed |= bool(mismatches)
+
+    piece_data = next(iter(clothing_data["pieces"].values()))
+    piece_grid = extract_grid(piece_data, RESOLUTIONS[-1])
+    for name, mask in get_irregular_masks(piece_grid.shape).items():
+        mismatches = get_mismatches(piece_grid._replace(inside_mask=mask), piece_data)
+        print(f'{name:20} {"differs in " + ", ".join(mismatches) if mismatches else "matches"}')
+        failed |= bool(mismatches)
+
+    sys.exit(1 if failed else 0)
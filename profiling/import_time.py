@@ -0,0 +1,32 @@
+""" Time importing the headless simulation modules and check no plotting or optional backend library is loaded """
+import subprocess
+import sys
+
+HEADLESS_MODULES = [
+    'src.simulation.mesh',
+    'src.simulation.setup.extract_clothing_vertex_data',
+    'src.simulation.simulation',
+    'src.simulation.batch',
+    'src.simulation.service',
+]
+HEAVY_MODULES = ['plotly', 'matplotlib', 'torch', 'numba']  # Only needed to display or for optional backends
+
+
+def get_import_time(module: str) -> tuple:
+    """ Cumulative import time in seconds of module in a fresh interpreter and heavy modules it loaded """
+    code = f"import sys, {module}; print(','.join(m for m in {HEAVY_MODULES} if m in sys.modules))"
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            capture_output=True, text=True, check=True)
+    last_line = result.stderr.strip().splitlines()[-1]
+    cumulative_us = int(last_line.split('|')[1])
+    return cumulative_us / 1e6, [name for name in result.stdout.strip().split(',') if name]
+
+
+if __name__ == '__main__':
+    failed = False
+    for name in HEADLESS_MODULES:
+        seconds, loaded = get_import_time(name)
+        print(f'{name:55} {seconds:6.3f}s {"loaded " + ", ".join(loaded) if loaded else ""}')
+        failed |= bool(loaded)
+
+    sys.exit(1 if failed else 0)
@@ -5,9 +5,10 @@ import plotly.graph_objects as go
 
 from src.utils.read_obj import parse_obj
 from src.utils.file_io import read_json
-from src.simulation.setup.extract_clothing_vertex_data import extract_all_piece_vertices
+from src.simulation.setup.setup_cache import get_all_piece_vertices
 
-from src.simulation.mesh import MeshData, create_plotly_mesh, add_annotations_to_plotly_fig
+from src.simulation.mesh import MeshData
+from src.simulation.mesh.display import create_plotly_mesh, add_annotations_to_plotly_fig
 from src.simulation.piece_physics import DynamicPiece
 from src.simulation.sewing_constraints import SewingConstraints
 from src.display.show_sewing import add_sewing_points_to_plotly_fig
@@ -100,6 +101,6 @@ if __name__ == '__main__':
     avatar_mesh.scale_vertices(AVATAR_SCALING)
 
     clothing_data = read_json('./assets/sewing_shirt.json')
-    dynamic_pieces, sewing_constraints = extract_all_piece_vertices(clothing_data, avatar_mesh)
+    dynamic_pieces, sewing_constraints = get_all_piece_vertices(clothing_data, avatar_mesh)
 
     show_each_mesh_different_colors(avatar_mesh, dynamic_pieces, sewing_constraints)
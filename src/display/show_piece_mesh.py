@@ -1,7 +1,7 @@
 """ Show the mesh of a piece in matplotlib """
 from src.utils.file_io import read_json
 from src.simulation.setup.extract_clothing_vertex_data import extract_all_piece_vertices
-from src.simulation.mesh import create_mesh_line_collection
+from src.simulation.mesh.display import create_mesh_line_collection
 
 from src.display.common import plot_line_collection
 
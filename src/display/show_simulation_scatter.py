@@ -3,14 +3,19 @@ import plotly.graph_objects as go
 
 from src.utils.read_obj import parse_obj
 from src.utils.file_io import read_json
-from src.simulation.setup.extract_clothing_vertex_data import extract_all_piece_vertices
+from src.simulation.setup.setup_cache import get_all_piece_vertices
 from src.simulation.simulation import FabricSimulation
+from src.simulation.recording import MemmapFrameRecorder
 
 from src.parameters import AVATAR_SCALING, NR_STEPS
 
 
 def show_3d_scatter_simulation(simulation: FabricSimulation):
-    """ Create scatter plot animation from saved frames of a simulation """
+    """
+        Create scatter plot animation from saved frames of a simulation
+        Frames are read from the recorder one at a time, but the figure holds a plotly frame for every recorded frame,
+        so its memory grows with the number of frames, record with a larger stride to show long runs
+    """
 
     frames = [simulation.get_scatter_at_frame(i) for i in range(simulation.nr_frames)]
 
@@ -53,7 +58,7 @@ def show_3d_scatter_simulation(simulation: FabricSimulation):
                             {"frame": {"duration": 0},
                              "mode": "immediate"}
                         ],
-                        "label": str(k),
+                        "label": str(simulation.recorder.get_step(k)),
                         "method": "animate"
                     } for k in range(simulation.nr_frames)
                 ],
@@ -71,9 +76,14 @@ if __name__ == '__main__':
     avatar_mesh.scale_vertices(AVATAR_SCALING)
 
     clothing_data = read_json('./assets/sewing_shirt.json')
-    all_pieces, sewing = extract_all_piece_vertices(clothing_data, avatar_mesh)
+    all_pieces, sewing = get_all_piece_vertices(clothing_data, avatar_mesh)
 
-    simulation = FabricSimulation(avatar_mesh, all_pieces, sewing)
+    recorder = MemmapFrameRecorder.from_positions(
+        {k: piece.mesh.vertices_3d for k, piece in all_pieces.items()}, NR_STEPS
+    )
+    simulation = FabricSimulation(avatar_mesh, all_pieces, sewing, recorder=recorder)
     simulation.step(NR_STEPS)
+    recorder.flush()
 
     show_3d_scatter_simulation(simulation)
+    recorder.close()
@@ -14,10 +14,26 @@ BEND_WEIGHTING = 150  # Weight to apply to bend force
 BEND_THRESHOLD = 0.05  # Sin of angle where bending is applied
 CM_PER_M = 100  # Scale of coordinates in clothing to world coordinates
 FRICTION_CONSTANT = 0.0  # Constant of velocity resisting acceleration
+COMPUTE_BACKEND = 'numpy'  # Engine stepping the simulation, one of 'numpy', 'numba' or 'torch'
 VELOCITY_DAMPING_START = 1.0  # Amount to reduce velocity by in every step at the beginning
 VELOCITY_DAMPING_END = 0.25  # Amount to reduce velocity by in every step at the end
 RUN_COLLISION_DETECTION = True  # This is slow, so it can be turned off
+COLLISION_BACKEND = 'trimesh'  # 'trimesh' ray casts every step, 'sdf' looks up a pre-computed signed distance field
+SDF_RESOLUTION = 0.02  # Spacing of signed distance field grid in world coordinates
+SDF_CONTACT_OFFSET = 0.002  # Distance outside the interpolated surface vertices are pushed to
+NEAREST_CACHE_DISTANCE = 0.01  # Distance a triangle found near last step's closest triangle is trusted
 DISTANCE_FROM_BODY = 0.025  # Default distance along normal of alignment point on avatar
 SEWING_SPACING = 0.01  # Spacing between two points while doing sewing
 SEWING_ADJUSTMENT_STEP = 12  # Maximum distance per second to get closer to sewing adjustment
 WRAP_RADIANS = 0.4  # angle in radians to rotate point when attempting to wrap
+CACHE_DIRECTORY = './.cache'  # Folder to store pre-computed data between runs
+RECORDING_STRIDE = 1  # Number of simulation steps between each recorded frame
+MULTI_RESOLUTIONS = (3, 1)  # Grid resolutions (cm) of multi-resolution mode from coarse to fine
+MULTI_RESOLUTION_STEPS = (120, 30)  # Steps run at each of the multi-resolution grid resolutions
+CONVERGENCE_KINETIC_ENERGY = 5e-4  # Kinetic energy per vertex from motion over the patience steps to count as settled
+CONVERGENCE_DISPLACEMENT = 2e-3  # Largest distance any vertex may move in a step once settled
+CONVERGENCE_SEWING_GAP = 0.02  # Largest distance between sewn vertices once settled
+CONVERGENCE_PATIENCE = 5  # Number of steps in a row all metrics must be settled to stop early
+SLEEP_TILE_SIZE = 8  # Number of grid points along each side of a tile that falls asleep as a whole
+SLEEP_VELOCITY = 0.05  # Speed every vertex of a tile must stay below for the tile to be at rest
+SLEEP_STEPS = 10  # Number of steps in a row a tile must be at rest before it falls asleep
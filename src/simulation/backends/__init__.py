@@ -0,0 +1,3 @@
+from .base import *
+from .numpy_backend import *
+from .registry import *
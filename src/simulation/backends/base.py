@@ -0,0 +1,45 @@
+""" Interface of an engine that owns simulation state and the kernels that step it """
+from abc import ABC, abstractmethod
+from typing import Optional, Tuple
+
+import numpy as np
+
+from src.simulation.mesh import MeshData
+from src.simulation.piece_physics import DynamicPiece
+from src.simulation.sewing_constraints import SewingConstraints
+from src.simulation.collision import BodyBoxHierarchy, SignedDistanceField
+
+
+class ComputeBackend(ABC):
+    """
+        Allocates state arrays and runs the force, integrate, collide and sew kernels of a simulation
+        Arrays are always exposed to the rest of the code as numpy arrays sharing the backend memory
+        Backends missing any kernel cannot be created
+    """
+    name = ''
+
+    @abstractmethod
+    def zeros(self, shape: Tuple[int, ...], dtype: type = np.float32) -> np.ndarray:
+        """ Allocate a zeroed state array """
+
+    @abstractmethod
+    def update_internal_forces(self, piece: DynamicPiece):
+        """ Overwrite acceleration of piece from gravity and internal forces """
+
+    @abstractmethod
+    def update_velocities(self, piece: DynamicPiece, step: int):
+        """ Integrate acceleration into velocity and apply dampening for the step """
+
+    @abstractmethod
+    def update_positions(self, piece: DynamicPiece):
+        """ Integrate velocity into positions and clamp above the floor """
+
+    @abstractmethod
+    def body_collision_adjustment(self, piece: DynamicPiece, body: MeshData,
+                                  broad_phase: Optional[BodyBoxHierarchy] = None,
+                                  body_sdf: Optional[SignedDistanceField] = None):
+        """ Push piece vertices outside body """
+
+    @abstractmethod
+    def apply_sewing_adjustment(self, sewing_constraints: SewingConstraints, packed_mesh: MeshData):
+        """ Move sewn vertices of a packed mesh closer using compiled global sewing indices """
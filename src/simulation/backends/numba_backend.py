@@ -0,0 +1,17 @@
+""" Backend replacing internal forces with fused Numba kernels """
+from src.simulation.piece_physics import DynamicPiece
+from src.simulation.numba_forces import NUMBA_AVAILABLE
+from src.simulation.backends.numpy_backend import NumpyBackend
+
+
+class NumbaBackend(NumpyBackend):
+    """ Compiled parallel internal forces, every other kernel from the numpy reference """
+    name = 'numba'
+
+    def __init__(self):
+        if not NUMBA_AVAILABLE:
+            raise ImportError("Numba is required for the numba backend, install with pip install numba")
+
+    def update_internal_forces(self, piece: DynamicPiece):
+        """ Overwrite acceleration of piece from gravity and internal forces """
+        piece.update_internal_forces_numba()
@@ -0,0 +1,44 @@
+""" Reference backend running the numpy kernels of each piece """
+from typing import Optional, Tuple
+
+import numpy as np
+
+from src.simulation.mesh import MeshData
+from src.simulation.piece_physics import DynamicPiece
+from src.simulation.sewing_constraints import SewingConstraints
+from src.simulation.collision import BodyBoxHierarchy, SignedDistanceField
+from src.simulation.backends.base import ComputeBackend
+
+
+class NumpyBackend(ComputeBackend):
+    """ Vectorized numpy kernels, used as the correctness reference for other backends """
+    name = 'numpy'
+
+    def zeros(self, shape: Tuple[int, ...], dtype: type = np.float32) -> np.ndarray:
+        """ Allocate a zeroed state array """
+        return np.zeros(shape, dtype=dtype)
+
+    def update_internal_forces(self, piece: DynamicPiece):
+        """ Overwrite acceleration of piece from gravity and internal forces """
+        piece.update_internal_forces()
+
+    def update_velocities(self, piece: DynamicPiece, step: int):
+        """ Integrate acceleration into velocity and apply dampening for the step """
+        piece.update_velocities(step)
+
+    def update_positions(self, piece: DynamicPiece):
+        """ Integrate velocity into positions and clamp above the floor """
+        piece.update_positions()
+
+    def body_collision_adjustment(self, piece: DynamicPiece, body: MeshData,
+                                  broad_phase: Optional[BodyBoxHierarchy] = None,
+                                  body_sdf: Optional[SignedDistanceField] = None):
+        """ Push piece vertices outside body with the signed distance field if given else ray casting """
+        if body_sdf is not None:
+            piece.body_sdf_collision_adjustment(body_sdf)
+        else:
+            piece.body_collision_adjustment(body, broad_phase)
+
+    def apply_sewing_adjustment(self, sewing_constraints: SewingConstraints, packed_mesh: MeshData):
+        """ Move sewn vertices of a packed mesh closer using compiled global sewing indices """
+        packed_mesh.offset_vertices(sewing_constraints.get_global_adjustment(packed_mesh.vertices_3d))
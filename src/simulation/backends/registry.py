@@ -0,0 +1,20 @@
+""" Lookup of compute backends by name """
+from importlib import import_module
+from typing import Dict, Tuple
+
+from src.simulation.backends.base import ComputeBackend
+
+# Module and class of each backend, only imported when asked for so optional dependencies are not loaded otherwise
+COMPUTE_BACKENDS: Dict[str, Tuple[str, str]] = {
+    'numpy': ('src.simulation.backends.numpy_backend', 'NumpyBackend'),
+    'numba': ('src.simulation.backends.numba_backend', 'NumbaBackend'),
+    'torch': ('src.simulation.backends.torch_backend', 'TorchBackend'),
+}
+
+
+def get_compute_backend(name: str) -> ComputeBackend:
+    """ Create backend from its name, raises ImportError if its optional dependency is missing """
+    if name not in COMPUTE_BACKENDS:
+        raise ValueError(f"Compute backend {name} not one of {tuple(COMPUTE_BACKENDS)}")
+    module_name, class_name = COMPUTE_BACKENDS[name]
+    return getattr(import_module(module_name), class_name)()
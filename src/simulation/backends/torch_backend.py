@@ -0,0 +1,152 @@
+""" Backend running forces, integration and sewing as PyTorch CPU tensor operations """
+from typing import Dict, Tuple
+import weakref
+
+import numpy as np
+
+try:
+    import torch
+    TORCH_AVAILABLE = True
+except ImportError:
+    TORCH_AVAILABLE = False
+
+from src.simulation.mesh import MeshData
+from src.simulation.piece_physics import DynamicPiece
+from src.simulation.sewing_constraints import SewingConstraints
+from src.simulation.backends.numpy_backend import NumpyBackend
+
+
+class TorchBackend(NumpyBackend):
+    """
+        State arrays are allocated by torch and wrapped without copying, kernels use batched tensor operations
+        Collision stays on the numpy reference as it queries trimesh
+    """
+    name = 'torch'
+
+    def __init__(self):
+        if not TORCH_AVAILABLE:
+            raise ImportError("PyTorch is required for the torch backend, install with pip install torch")
+        self._index_tensors: Dict[int, Tuple[weakref.ref, "torch.Tensor"]] = {}
+
+    def zeros(self, shape: Tuple[int, ...], dtype: type = np.float32) -> np.ndarray:
+        """ Allocate a zeroed state array in torch owned memory """
+        return torch.zeros(shape, dtype=getattr(torch, np.dtype(dtype).name)).numpy()
+
+    def get_index_tensor(self, indices: np.ndarray) -> "torch.Tensor":
+        """
+            Get cached int64 tensor of an index array, arrays are weakly referenced
+            so their tensor is dropped once they are freed and a reused id is never matched to a stale tensor
+        """
+        key = id(indices)
+        cached = self._index_tensors.get(key)
+        if cached is None or cached[0]() is not indices:
+            self._index_tensors[key] = (weakref.ref(indices, self.get_eviction(key)),
+                                        torch.from_numpy(indices.astype(np.int64)))
+        return self._index_tensors[key][1]
+
+    def get_eviction(self, key: int):
+        """ Callback removing cached tensor of key when the array it was made from is freed """
+        index_tensors = self._index_tensors
+
+        def evict(reference: weakref.ref):
+            if key in index_tensors and index_tensors[key][0] is reference:
+                del index_tensors[key]
+        return evict
+
+    def add_pair_forces(self, vertices: "torch.Tensor", relations: "torch.Tensor", resting_length: float,
+                        weighting: float, threshold: float, acceleration: "torch.Tensor"):
+        """ Add force resisting change from resting length between each pair of vertices """
+        vectors = (vertices[relations[:, 1]] - vertices[relations[:, 0]]) / resting_length
+        distances = torch.linalg.norm(vectors, dim=1, keepdim=True)
+        vectors -= vectors / torch.where(distances == 0, 1., distances)
+
+        direction = (distances > 1 + threshold).float() - (distances < 1 - threshold).float()
+        vectors *= direction * weighting
+        acceleration.index_add_(0, relations[:, 0], vectors)
+        acceleration.index_add_(0, relations[:, 1], -vectors)
+
+    def add_bend_forces(self, vertices: "torch.Tensor", relations: "torch.Tensor", weighting: float,
+                        threshold: float, acceleration: "torch.Tensor"):
+        """ Add force pulling the middle vertex of each bend towards the midpoint of its ends """
+        bend_direction = (vertices[relations[:, 0]] + vertices[relations[:, 2]]) * 0.5 - vertices[relations[:, 1]]
+        bend_amount = torch.linalg.norm(bend_direction, dim=1, keepdim=True)
+        bend_direction *= (bend_amount > threshold).float() * weighting
+
+        acceleration.index_add_(0, relations[:, 0], bend_direction * -0.5)
+        acceleration.index_add_(0, relations[:, 1], bend_direction)
+        acceleration.index_add_(0, relations[:, 2], bend_direction * -0.5)
+
+    def update_internal_forces(self, piece: DynamicPiece):
+        """ Overwrite acceleration of piece from gravity and internal forces """
+        vertices = torch.from_numpy(piece.mesh.vertices_3d)
+        velocity = torch.from_numpy(piece.velocity)
+        acceleration = torch.from_numpy(piece.acceleration)
+        relations = piece.active_relations
+        config = piece.config
+
+        acceleration.zero_()
+        acceleration[:, 1] = -config.gravity
+
+        self.add_pair_forces(vertices, self.get_index_tensor(relations.stress_relations), piece.resting_straight_length,
+                             config.stress_weighting, config.stress_threshold, acceleration)
+        self.add_pair_forces(vertices, self.get_index_tensor(relations.shear_relations), piece.resting_diagonal_length,
+                             config.shear_weighting, config.shear_threshold, acceleration)
+        self.add_bend_forces(vertices, self.get_index_tensor(relations.bend_relations),
+                             config.bend_weighting, config.bend_threshold, acceleration)
+        acceleration -= config.friction_constant * velocity
+
+    def update_velocities(self, piece: DynamicPiece, step: int):
+        """ Integrate acceleration into velocity and apply dampening for the step """
+        velocity = torch.from_numpy(piece.velocity)
+        velocity += torch.from_numpy(piece.acceleration) * piece.config.time_delta
+
+        norms = torch.linalg.norm(velocity, dim=1, keepdim=True)
+        velocity *= torch.clamp(piece.config.max_tensile_velocity / norms, max=1.0) * piece.get_dampening(step)
+
+    def update_positions(self, piece: DynamicPiece):
+        """ Integrate velocity into positions and clamp above the floor """
+        vertices = torch.from_numpy(piece.mesh.vertices_3d)
+        vertices += torch.from_numpy(piece.velocity) * piece.config.time_delta
+        vertices[:, 1].clamp_(min=0.)
+
+    def apply_sewing_adjustment(self, sewing_constraints: SewingConstraints, packed_mesh: MeshData):
+        """ Move sewn vertices of a packed mesh closer using compiled global sewing indices """
+        if sewing_constraints.global_indices is None:
+            raise ValueError("Sewing constraints have not been compiled into global indices")
+
+        vertices = torch.from_numpy(packed_mesh.vertices_3d)
+        global_indices = self.get_index_tensor(sewing_constraints.global_indices)
+        from_rows, to_rows = (self.get_index_tensor(rows) for rows in sewing_constraints.global_rows)
+
+        vector = vertices[global_indices[:, 1]] - vertices[global_indices[:, 0]]
+        distance = torch.linalg.norm(vector, dim=1, keepdim=True)
+        vector /= torch.where(distance == 0, 1., distance)
+        vector *= torch.clamp(distance, max=sewing_constraints.config.max_sewing_adjustment) / 2
+
+        vertices.index_add_(0, global_indices[from_rows, 0], vector[from_rows])
+        vertices.index_add_(0, global_indices[to_rows, 1], -vector[to_rows])
+
+
+if __name__ == '__main__':
+    from src.utils.file_io import read_json
+    from src.simulation.setup.extract_clothing_vertex_data import extract_all_piece_vertices
+    from src.simulation.backends.registry import get_compute_backend
+    from src.simulation.packed_pieces import PackedPieces
+
+    clothing_data = read_json('./assets/sewing_shirt.json')
+    results = {}
+
+    for backend_name in ('numpy', 'torch'):
+        backend = get_compute_backend(backend_name)
+        pieces, sewing_constraints = extract_all_piece_vertices(clothing_data)
+        packed = PackedPieces(pieces, allocate=backend.zeros)
+        offsets = {k: piece_slice.start for k, piece_slice in packed.piece_slices.items()}
+        sewing_constraints.compile_global_indices(offsets, packed.mesh.nr_vertices)
+
+        backend.update_internal_forces(packed)
+        backend.update_velocities(packed, 0)
+        backend.update_positions(packed)
+        backend.apply_sewing_adjustment(sewing_constraints, packed.mesh)
+        results[backend_name] = packed.mesh.vertices_3d.copy()
+
+    print(f"Max difference of torch to numpy after one step {np.abs(results['torch'] - results['numpy']).max():.3e}")
@@ -0,0 +1,2 @@
+from .shared_avatar import *
+from .runner import *
@@ -0,0 +1,165 @@
+""" Run a manifest of garment simulations across a pool of processes sharing each avatar """
+from multiprocessing import Pool
+from pathlib import Path
+from time import perf_counter
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import json
+import os
+import sys
+import traceback
+
+import numpy as np
+
+from src.utils.file_io import read_json
+from src.simulation.simulation import FabricSimulation
+from src.simulation.recording import MemoryFrameRecorder
+from src.simulation.config import SimulationConfig
+from src.simulation.setup.extract_clothing_vertex_data import extract_all_piece_vertices
+from src.simulation.batch.shared_avatar import SharedAvatar, SharedAvatarInfo
+
+from src.parameters import NR_STEPS, COLLISION_BACKEND, CACHE_DIRECTORY
+
+BATCH_METRICS_NAME = 'metrics.jsonl'  # File in output directory with one line of metrics per finished job
+
+_worker_avatars: Dict[Tuple[str, str], SharedAvatar] = {}
+
+
+class BatchJob(NamedTuple):
+    """
+        One garment on one avatar, simulation holds keyword arguments of FabricSimulation
+        and config overrides of simulation parameters
+    """
+    name: str
+    pattern: str
+    avatar: str
+    annotations: str
+    nr_steps: int = NR_STEPS
+    until_converged: bool = False
+    simulation: dict = {}
+    config: dict = {}
+
+    @property
+    def avatar_key(self) -> Tuple[str, str]:
+        """ Jobs with the same key share one avatar """
+        return self.avatar, self.annotations
+
+    @property
+    def collision_backend(self) -> str:
+        """ Get collision backend the job simulates with """
+        return self.simulation.get('collision_backend', COLLISION_BACKEND)
+
+
+def read_batch_manifest(path: str) -> Tuple[List[BatchJob], str]:
+    """
+        Read jobs and output directory from a .json manifest of the form
+        {"output_directory": str, "jobs": [{"name", "pattern", "avatar", "annotations", optional "nr_steps",
+        "until_converged", "simulation" and "config"}]}
+    """
+    manifest = read_json(path)
+    jobs = [BatchJob(**job) for job in manifest["jobs"]]
+
+    names = [job.name for job in jobs]
+    if len(set(names)) != len(names):
+        raise ValueError("Job names in batch manifest must be unique")
+
+    return jobs, manifest.get("output_directory", str(Path(CACHE_DIRECTORY) / 'batch'))
+
+
+def attach_worker_avatars(avatar_infos: Dict[Tuple[str, str], SharedAvatarInfo]):
+    """ Pool initializer attaching every shared avatar once per worker process """
+    for key, info in avatar_infos.items():
+        _worker_avatars[key] = SharedAvatar.attach(info)
+
+
+def run_batch_job(job: BatchJob, output_directory: str) -> dict:
+    """ Simulate one job in a worker, write final positions to .npz and return its metrics """
+    metrics = {'name': job.name}
+    try:
+        start = perf_counter()
+        avatar = _worker_avatars[job.avatar_key]
+        config = SimulationConfig.from_dict(job.config)
+        pieces, sewing_constraints = extract_all_piece_vertices(read_json(job.pattern), avatar.mesh, config=config)
+        metrics['setup_seconds'] = perf_counter() - start
+
+        start = perf_counter()
+        simulation = FabricSimulation(avatar.mesh, pieces, sewing_constraints,
+                                      recorder=MemoryFrameRecorder(list(pieces), job.nr_steps),
+                                      body_sdf=avatar.sdf, body_broad_phase=avatar.broad_phase, **job.simulation)
+        if job.until_converged:
+            report = simulation.run_until_converged(job.nr_steps, logging=False)
+            metrics.update(converged=report.converged, nr_steps=report.nr_steps, reason=report.reason)
+        else:
+            simulation.step(job.nr_steps, logging=False)
+            metrics['nr_steps'] = job.nr_steps
+        metrics['simulation_seconds'] = perf_counter() - start
+
+        positions = {key: piece.mesh.vertices_3d for key, piece in pieces.items()}
+        np.savez(Path(output_directory) / f"{job.name}.npz", **positions)
+        metrics['nr_vertices'] = sum(len(vertices) for vertices in positions.values())
+        metrics['max_sewing_gap'] = max((
+            sewing_pair.get_max_gap(positions[sewing_pair.from_piece], positions[sewing_pair.to_piece])
+            for sewing_pair in sewing_constraints
+        ), default=0.)
+    except Exception:  # One failing garment should not stop the rest of the batch
+        metrics['error'] = traceback.format_exc()
+
+    return metrics
+
+
+def run_batch_job_star(arguments: Tuple[BatchJob, str]) -> dict:
+    """ Unpack arguments of run_batch_job for pool map """
+    return run_batch_job(*arguments)
+
+
+def run_batch(jobs: List[BatchJob], output_directory: str, nr_processes: Optional[int] = None) -> List[dict]:
+    """
+        Share each avatar once, simulate jobs in a process pool sized to the cores
+        and append metrics of each job to the metrics file as soon as it finishes
+    """
+    output_folder = Path(output_directory)
+    output_folder.mkdir(parents=True, exist_ok=True)
+
+    # Signed distance field is only shared for avatars used by a job colliding with it
+    avatars = {}
+    for job in jobs:
+        avatars[job.avatar_key] = avatars.get(job.avatar_key, False) or job.collision_backend == 'sdf'
+
+    shared_avatars = {}
+    all_metrics = []
+    try:
+        for (avatar_path, annotation_path), with_sdf in avatars.items():
+            shared_avatars[avatar_path, annotation_path] = SharedAvatar.from_obj(avatar_path, annotation_path, with_sdf)
+        avatar_infos = {key: avatar.info for key, avatar in shared_avatars.items()}
+
+        nr_processes = min(nr_processes or os.cpu_count() or 1, max(len(jobs), 1))
+        with Pool(nr_processes, initializer=attach_worker_avatars, initargs=(avatar_infos,)) as pool, \
+                open(output_folder / BATCH_METRICS_NAME, 'a', encoding='utf-8') as metrics_file:
+            arguments = [(job, str(output_folder)) for job in jobs]
+            for metrics in pool.imap_unordered(run_batch_job_star, arguments):
+                metrics_file.write(json.dumps(metrics) + '\n')
+                metrics_file.flush()
+                all_metrics.append(metrics)
+
+                status = 'failed' if 'error' in metrics else f"{metrics['simulation_seconds']:.3}s"
+                print(f"Finished job {metrics['name']} ({len(all_metrics)}/{len(jobs)}) {status}")
+    finally:
+        for avatar in shared_avatars.values():
+            avatar.close()
+
+    return all_metrics
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        batch_jobs, batch_output_directory = read_batch_manifest(sys.argv[1])
+    else:
+        batch_jobs = [
+            BatchJob(f'shirt_{backend}', './assets/sewing_shirt.json', './assets/BodyMesh.obj',
+                     './assets/BodyAnnotations.json', simulation={'collision_backend': backend})
+            for backend in ('sdf', 'trimesh')
+        ]
+        batch_output_directory = str(Path(CACHE_DIRECTORY) / 'batch')
+
+    start = perf_counter()
+    run_batch(batch_jobs, batch_output_directory)
+    print(f'Time taken to run {len(batch_jobs)} jobs = {perf_counter() - start:.3}')
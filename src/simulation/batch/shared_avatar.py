@@ -0,0 +1,144 @@
+""" Avatar mesh and collision structures placed in shared memory so worker processes do not rebuild them """
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from trimesh import Trimesh
+
+from src.utils.read_obj import parse_obj, get_trimesh_topology
+from src.simulation.mesh import MeshData
+from src.simulation.collision import BodyBoxHierarchy, SignedDistanceField, get_signed_distance_field
+
+from src.parameters import AVATAR_SCALING, SDF_RESOLUTION
+
+
+class SharedArrayInfo(NamedTuple):
+    """ Where to find one array in shared memory """
+    block_name: str
+    shape: Tuple[int, ...]
+    dtype: str
+
+
+class SharedAvatarInfo(NamedTuple):
+    """ Everything a worker needs to attach to a shared avatar, small enough to send to every process """
+    arrays: Dict[str, SharedArrayInfo]
+    texture_data: dict
+    annotations: dict
+    sdf_origin: Optional[Tuple[float, float, float]]
+    sdf_spacing: Optional[float]
+
+
+class SharedAvatar:
+    """
+        Avatar parsed and scaled once, with its processed trimesh topology, face normals,
+        broad phase box hierarchy and optionally signed distance field copied into shared memory blocks
+        The creating process owns the blocks and unlinks them, workers attach to them by name
+        Arrays seen by workers are views of shared memory, only the trimesh ray caster is built per worker
+    """
+    def __init__(self, info: SharedAvatarInfo, blocks: List[SharedMemory], owner: bool):
+        self.info = info
+        self.blocks = blocks
+        self.owner = owner
+        self.arrays = {
+            name: np.ndarray(array_info.shape, dtype=array_info.dtype, buffer=block.buf)
+            for (name, array_info), block in zip(info.arrays.items(), blocks)
+        }
+
+        self._mesh = None
+        self._broad_phase = None
+        self._sdf = None
+
+    @classmethod
+    def create(cls, body: MeshData, with_sdf: bool = False, sdf_spacing: float = SDF_RESOLUTION) -> "SharedAvatar":
+        """ Copy mesh and collision structures of body into new shared memory blocks """
+        topology = body._trimesh_topology
+        if topology is None:
+            topology = get_trimesh_topology(body._vertex_data, body._index_data)
+        if topology is None:
+            raise ValueError("Vertices of processed trimesh of body cannot be matched to its vertex data")
+
+        trimesh = body.trimesh
+        broad_phase = BodyBoxHierarchy.from_trimesh(trimesh)
+        arrays = {
+            'vertex_data': body._vertex_data,
+            'index_data': body._index_data,
+            'trimesh_vertex_ids': topology[0],
+            'trimesh_faces': topology[1],
+            'face_normals': np.asarray(trimesh.face_normals, dtype=np.float64),
+            'box_min': broad_phase.box_min,
+            'box_max': broad_phase.box_max,
+            'box_children': broad_phase.children,
+        }
+        sdf_origin = None
+        if with_sdf:
+            sdf = get_signed_distance_field(body, AVATAR_SCALING, sdf_spacing)
+            arrays['sdf_distances'] = sdf.distances
+            arrays['sdf_gradients'] = sdf.gradients
+            sdf_origin = tuple(float(value) for value in sdf.origin)
+
+        blocks = []
+        array_infos = {}
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            block = SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+            blocks.append(block)
+            array_infos[name] = SharedArrayInfo(block.name, array.shape, array.dtype.str)
+
+        annotations = {name: point.tolist() for name, point in body.annotations.items()}
+        info = SharedAvatarInfo(array_infos, body._texture_data, annotations, sdf_origin,
+                                sdf_spacing if with_sdf else None)
+        return cls(info, blocks, owner=True)
+
+    @classmethod
+    def from_obj(cls, obj_path: str, annotation_path: str, with_sdf: bool = False) -> "SharedAvatar":
+        """ Parse and scale avatar then share it """
+        body = parse_obj(obj_path, annotation_path)
+        body.scale_vertices(AVATAR_SCALING)
+        return cls.create(body, with_sdf)
+
+    @classmethod
+    def attach(cls, info: SharedAvatarInfo) -> "SharedAvatar":
+        """ Open shared avatar created by another process """
+        blocks = [SharedMemory(name=array_info.block_name) for array_info in info.arrays.values()]
+        return cls(info, blocks, owner=False)
+
+    @property
+    def mesh(self) -> MeshData:
+        """ Avatar mesh over shared vertex data with trimesh built from shared topology and normals """
+        if self._mesh is None:
+            annotations = {name: np.array(point) for name, point in self.info.annotations.items()}
+            self._mesh = MeshData(self.arrays['vertex_data'], self.arrays['index_data'], self.info.texture_data,
+                                  annotations=annotations, centre_at_origin=False)
+            self._mesh._trimesh = Trimesh(
+                vertices=self.arrays['vertex_data'][self.arrays['trimesh_vertex_ids'], :3],
+                faces=self.arrays['trimesh_faces'], face_normals=self.arrays['face_normals'], process=False
+            )
+        return self._mesh
+
+    @property
+    def broad_phase(self) -> BodyBoxHierarchy:
+        """ Box hierarchy over shared boxes, hit counts are kept per process """
+        if self._broad_phase is None:
+            self._broad_phase = BodyBoxHierarchy(self.arrays['box_min'], self.arrays['box_max'],
+                                                 self.arrays['box_children'])
+        return self._broad_phase
+
+    @property
+    def sdf(self) -> Optional[SignedDistanceField]:
+        """ Signed distance field over shared grids or None if the avatar was shared without one """
+        if self._sdf is None and self.info.sdf_spacing is not None:
+            self._sdf = SignedDistanceField(self.arrays['sdf_distances'], self.info.sdf_origin,
+                                            self.info.sdf_spacing, self.arrays['sdf_gradients'])
+        return self._sdf
+
+    def close(self):
+        """ Release views and blocks, removing the blocks if this process created them """
+        self._mesh = self._broad_phase = self._sdf = None
+        self.arrays = {}
+        for block in self.blocks:
+            block.close()
+            if self.owner:
+                block.unlink()
+        self.blocks = []
+
@@ -0,0 +1,3 @@
+from .signed_distance import *
+from .broad_phase import *
+from .nearest_cache import *
@@ -0,0 +1,116 @@
+""" Broad phase to cull vertices that cannot be inside the body before exact inside tests """
+from typing import List
+
+import numpy as np
+from trimesh import Trimesh
+
+BROAD_PHASE_MAX_DEPTH = 6  # Number of times the body is split into smaller boxes
+BROAD_PHASE_MIN_FACES = 16  # Stop splitting a box once it contains this few triangles
+
+
+class BodyBoxHierarchy:
+    """
+        Binary tree of axis-aligned boxes over the body split into columns in the x-y plane
+        The z extent of each box comes from triangles overlapping its column so that
+        any point inside the closed body lies inside at least one leaf box
+    """
+    def __init__(self, box_min: np.ndarray, box_max: np.ndarray, children: np.ndarray):
+        self.box_min = box_min
+        self.box_max = box_max
+        self.children = children
+
+        self.nr_tested = 0
+        self.nr_culled = 0
+
+    @classmethod
+    def from_trimesh(cls, trimesh: Trimesh, max_depth: int = BROAD_PHASE_MAX_DEPTH,
+                     min_faces: int = BROAD_PHASE_MIN_FACES) -> "BodyBoxHierarchy":
+        """ Recursively split columns of triangles at their median centroid along the longest side """
+        triangles = trimesh.triangles
+        triangle_min = triangles.min(axis=1)
+        triangle_max = triangles.max(axis=1)
+        centroids = triangles.mean(axis=1)
+
+        box_min, box_max, children = [], [], []
+
+        def add_node(cell_min: np.ndarray, cell_max: np.ndarray, face_ids: np.ndarray, depth: int) -> int:
+            node_min = triangle_min[face_ids].min(axis=0)
+            node_max = triangle_max[face_ids].max(axis=0)
+            node_min[:2] = np.maximum(node_min[:2], cell_min)
+            node_max[:2] = np.minimum(node_max[:2], cell_max)
+
+            node_ind = len(box_min)
+            box_min.append(node_min)
+            box_max.append(node_max)
+            children.append([-1, -1])
+
+            if depth >= max_depth or len(face_ids) <= min_faces:
+                return node_ind
+
+            axis = np.argmax(node_max[:2] - node_min[:2])
+            split = np.median(centroids[face_ids, axis])
+            left_ids = face_ids[triangle_min[face_ids, axis] <= split]
+            right_ids = face_ids[triangle_max[face_ids, axis] >= split]
+            if len(left_ids) == len(face_ids) or len(right_ids) == len(face_ids):
+                return node_ind
+
+            left_max = cell_max.copy()
+            left_max[axis] = split
+            right_min = cell_min.copy()
+            right_min[axis] = split
+
+            children[node_ind] = [
+                add_node(cell_min, left_max, left_ids, depth + 1),
+                add_node(right_min, cell_max, right_ids, depth + 1)
+            ]
+            return node_ind
+
+        all_faces = np.arange(len(triangles))
+        add_node(triangle_min.min(axis=0)[:2], triangle_max.max(axis=0)[:2], all_faces, 0)
+
+        return cls(np.array(box_min, dtype=np.float64), np.array(box_max, dtype=np.float64),
+                   np.array(children, dtype=np.int64))
+
+    @property
+    def nr_boxes(self) -> int:
+        """ Get number of boxes in hierarchy """
+        return len(self.box_min)
+
+    def get_overlapping_leaves(self, query_min: np.ndarray, query_max: np.ndarray) -> List[int]:
+        """ Get leaf boxes overlapping query box by descending only through overlapping boxes """
+        leaves = []
+        stack = [0]
+
+        while stack:
+            node_ind = stack.pop()
+            if np.any(self.box_min[node_ind] > query_max) or np.any(self.box_max[node_ind] < query_min):
+                continue
+
+            left, right = self.children[node_ind]
+            if left == -1:
+                leaves.append(node_ind)
+            else:
+                stack.extend((left, right))
+
+        return leaves
+
+    def get_candidate_mask(self, vertices: np.ndarray) -> np.ndarray:
+        """ Get mask of vertices that could be inside the body and count culled vertices """
+        candidates = np.zeros(len(vertices), dtype=bool)
+        leaves = self.get_overlapping_leaves(vertices.min(axis=0), vertices.max(axis=0))
+
+        if leaves:
+            leaf_min = self.box_min[leaves]
+            leaf_max = self.box_max[leaves]
+            in_leaf = (vertices[:, np.newaxis] >= leaf_min) & (vertices[:, np.newaxis] <= leaf_max)
+            candidates = np.all(in_leaf, axis=2).any(axis=1)
+
+        nr_candidates = np.count_nonzero(candidates)
+        self.nr_tested += nr_candidates
+        self.nr_culled += len(vertices) - nr_candidates
+        return candidates
+
+    def reset_counts(self):
+        """ Reset count of tested and culled vertices """
+        self.nr_tested = 0
+        self.nr_culled = 0
@@ -0,0 +1,59 @@
+""" Nearest triangle queries that first search around the triangle found in the previous step """
+from typing import Tuple
+
+import numpy as np
+from trimesh.triangles import closest_point
+
+from src.simulation.mesh import MeshData
+
+from src.parameters import NEAREST_CACHE_DISTANCE
+
+NEAREST_CACHE_WALK_STEPS = 3  # Number of face rings to walk across before falling back to a full query
+
+
+def search_face_rings(body: MeshData, points: np.ndarray, centre_ids: np.ndarray) -> \
+                      Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ Get closest point, distance and triangle for each point among faces in the ring of its centre face """
+    candidates = body.face_ring[centre_ids]
+    nr_candidates = candidates.shape[1]
+
+    query_points = np.repeat(points, nr_candidates, axis=0)
+    candidate_points = closest_point(body.trimesh.triangles[candidates.flatten()], query_points)
+    candidate_distances = np.linalg.norm(candidate_points - query_points, axis=1).reshape(-1, nr_candidates)
+
+    best = np.argmin(candidate_distances, axis=1)
+    rows = np.arange(len(best))
+    return candidate_points.reshape(-1, nr_candidates, 3)[rows, best], candidate_distances[rows, best], \
+        candidates[rows, best]
+
+
+def get_closest_triangles_near_cache(body: MeshData, points: np.ndarray, cached_triangle_ids: np.ndarray,
+                                     distance_bound: float = NEAREST_CACHE_DISTANCE) -> \
+                                     Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+        Get closest point, distance and triangle on body for each point (same as nearest.on_surface)
+        Points with a cached triangle (not -1) walk across face rings from that triangle until the closest
+        face is the centre of its own ring, falling back to the full tree query if the walk does not settle
+        or the closest face is further than the distance bound
+    """
+    closest_points = np.zeros((len(points), 3), dtype=np.float64)
+    distances = np.full(len(points), np.inf, dtype=np.float64)
+    triangle_ids = cached_triangle_ids.astype(np.int64)
+
+    walking = np.where(triangle_ids >= 0)[0]
+    for _ in range(NEAREST_CACHE_WALK_STEPS):
+        if len(walking) == 0:
+            break
+
+        centre_ids = triangle_ids[walking]
+        closest_points[walking], distances[walking], triangle_ids[walking] = \
+            search_face_rings(body, points[walking], centre_ids)
+        walking = walking[triangle_ids[walking] != centre_ids]
+
+    needs_query = (distances > distance_bound) | (triangle_ids < 0)
+    needs_query[walking] = True
+    if needs_query.any():
+        closest_points[needs_query], distances[needs_query], triangle_ids[needs_query] = \
+            body.trimesh.nearest.on_surface(points[needs_query])
+
+    return closest_points, distances, triangle_ids
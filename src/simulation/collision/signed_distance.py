@@ -0,0 +1,113 @@
+""" Pre-computed signed distance field of a static mesh for fast collision response """
+from itertools import product
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+from trimesh import Trimesh
+
+from src.simulation.mesh import MeshData
+from src.utils.hashing import get_content_hash
+
+from src.parameters import SDF_RESOLUTION, CACHE_DIRECTORY
+
+SDF_PADDING_CELLS = 3  # Number of cells added around the mesh bounds so the surface is always inside the grid
+SDF_CHUNK_SIZE = 50000  # Number of grid points to query against the mesh at once
+
+
+class SignedDistanceField:
+    """
+        Signed distance to a closed mesh sampled on a regular voxel grid, negative inside the mesh
+        Distances and gradients are trilinearly interpolated so a lookup is O(1) per vertex
+        Float32 arrays are used without copying so a field can live in shared memory
+    """
+    def __init__(self, distances: np.ndarray, origin: np.ndarray, spacing: float,
+                 gradients: Optional[np.ndarray] = None):
+        self.distances = np.asarray(distances, dtype=np.float32)
+        self.origin = np.asarray(origin, dtype=np.float32)
+        self.spacing = np.float32(spacing)
+        if gradients is None:
+            gradients = np.stack(np.gradient(self.distances, self.spacing), axis=-1)
+        self.gradients = np.asarray(gradients, dtype=np.float32)
+
+    @classmethod
+    def from_trimesh(cls, trimesh: Trimesh, spacing: float) -> "SignedDistanceField":
+        """ Sample distance to the surface and inside test of mesh on every grid point """
+        min_bound = trimesh.bounds[0] - SDF_PADDING_CELLS * spacing
+        max_bound = trimesh.bounds[1] + SDF_PADDING_CELLS * spacing
+        shape = np.ceil((max_bound - min_bound) / spacing).astype(np.int64) + 1
+
+        axes = [min_bound[i] + np.arange(shape[i]) * spacing for i in range(3)]
+        grid_points = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, 3)
+
+        distances = np.zeros(len(grid_points), dtype=np.float64)
+        for start in range(0, len(grid_points), SDF_CHUNK_SIZE):
+            chunk = grid_points[start:start + SDF_CHUNK_SIZE]
+            _, chunk_distances, _ = trimesh.nearest.on_surface(chunk)
+            is_inside = trimesh.contains(chunk)
+            distances[start:start + SDF_CHUNK_SIZE] = np.where(is_inside, -chunk_distances, chunk_distances)
+
+        return cls(distances.reshape(shape), min_bound, spacing)
+
+    @classmethod
+    def load(cls, path: str) -> "SignedDistanceField":
+        """ Read field from .npz file """
+        data = np.load(path)
+        return cls(data["distances"], data["origin"], float(data["spacing"]))
+
+    def save(self, path: str):
+        """ Write field to .npz file """
+        np.savez(path, distances=self.distances, origin=self.origin, spacing=self.spacing)
+
+    @property
+    def shape(self) -> Tuple[int, int, int]:
+        """ Number of grid points along each axis """
+        return self.distances.shape
+
+    def interpolate(self, values: np.ndarray, points: np.ndarray) -> np.ndarray:
+        """ Trilinear interpolation of values stored on the grid at each point (points clamped to grid) """
+        coords = (points - self.origin) / self.spacing
+        base = np.clip(np.floor(coords).astype(np.int64), 0, np.array(self.shape) - 2)
+        fraction = np.clip(coords - base, 0., 1.)
+
+        output = np.zeros((len(points),) + values.shape[3:], dtype=np.float32)
+        for corner in product((0, 1), repeat=3):
+            weight = np.prod(np.where(corner, fraction, 1. - fraction), axis=1)
+            corner_values = values[base[:, 0] + corner[0], base[:, 1] + corner[1], base[:, 2] + corner[2]]
+            output += weight.reshape((-1,) + (1,) * (values.ndim - 3)) * corner_values
+
+        return output
+
+    def sample(self, points: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """ Get signed distance and outward unit normal at each point, points outside grid are infinitely far """
+        coords = (points - self.origin) / self.spacing
+        in_grid = np.all((coords >= 0) & (coords <= np.array(self.shape) - 1), axis=1)
+
+        distances = np.full(len(points), np.inf, dtype=np.float32)
+        normals = np.zeros((len(points), 3), dtype=np.float32)
+        if not in_grid.any():
+            return distances, normals
+
+        distances[in_grid] = self.interpolate(self.distances, points[in_grid])
+        gradients = self.interpolate(self.gradients, points[in_grid])
+        gradient_norms = np.linalg.norm(gradients, axis=1, keepdims=True)
+        normals[in_grid] = gradients / np.where(gradient_norms == 0, 1, gradient_norms)
+
+        return distances, normals
+
+
+def get_signed_distance_field(body: MeshData, scaling: float, spacing: float = SDF_RESOLUTION,
+                              cache_directory: str = CACHE_DIRECTORY) -> SignedDistanceField:
+    """ Load signed distance field of body from disk cache, building and caching it if not present """
+    trimesh = body.trimesh
+    key = get_content_hash(trimesh.vertices, trimesh.faces, scaling, spacing)
+    cache_path = Path(cache_directory) / f"sdf_{key}.npz"
+
+    if cache_path.exists():
+        return SignedDistanceField.load(str(cache_path))
+
+    print(f"Building signed distance field for body with spacing {spacing}")
+    sdf = SignedDistanceField.from_trimesh(trimesh, spacing)
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    sdf.save(str(cache_path))
+    return sdf
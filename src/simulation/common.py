@@ -16,3 +16,15 @@ class DistanceAdjustment(NamedTuple):
     def __iter__(self) -> Iterable[Tuple[np.ndarray, np.ndarray]]:
         """ Iterate through each adjustment, indices and amounts """
         yield from zip(self.indices, self.amounts)
+
+
+class PieceGrid(NamedTuple):
+    """ Regular grid over bounding box of a piece, inside_mask is indexed [row (y), column (x)] """
+    x_range: np.ndarray
+    y_range: np.ndarray
+    inside_mask: np.ndarray
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        """ Number of rows and columns of grid """
+        return self.inside_mask.shape
@@ -0,0 +1,52 @@
+""" Parameters of one simulation gathered in an immutable object so runs in one process can be configured apart """
+from typing import NamedTuple
+
+from src.parameters import (NR_STEPS, AVATAR_SCALING, VERTEX_RESOLUTION, GRAVITY, MAX_TENSILE_VELOCITY, TIME_DELTA,
+                            STRESS_WEIGHTING, STRESS_THRESHOLD, SHEAR_WEIGHTING, SHEAR_THRESHOLD, BEND_WEIGHTING,
+                            BEND_THRESHOLD, FRICTION_CONSTANT, VELOCITY_DAMPING_START, VELOCITY_DAMPING_END,
+                            RUN_COLLISION_DETECTION, SDF_CONTACT_OFFSET, DISTANCE_FROM_BODY, SEWING_SPACING,
+                            SEWING_ADJUSTMENT_STEP, WRAP_RADIANS)
+
+
+class SimulationConfig(NamedTuple):
+    """
+        Physics and setup parameters, every default comes from src/parameters.py
+        Variations are made with _replace, setup fields only affect pieces extracted with the config
+    """
+    nr_steps: int = NR_STEPS
+    avatar_scaling: float = AVATAR_SCALING
+    vertex_resolution: float = VERTEX_RESOLUTION
+    gravity: float = GRAVITY
+    max_tensile_velocity: float = MAX_TENSILE_VELOCITY
+    time_delta: float = TIME_DELTA
+    stress_weighting: float = STRESS_WEIGHTING
+    stress_threshold: float = STRESS_THRESHOLD
+    shear_weighting: float = SHEAR_WEIGHTING
+    shear_threshold: float = SHEAR_THRESHOLD
+    bend_weighting: float = BEND_WEIGHTING
+    bend_threshold: float = BEND_THRESHOLD
+    friction_constant: float = FRICTION_CONSTANT
+    velocity_damping_start: float = VELOCITY_DAMPING_START
+    velocity_damping_end: float = VELOCITY_DAMPING_END
+    run_collision_detection: bool = RUN_COLLISION_DETECTION
+    sdf_contact_offset: float = SDF_CONTACT_OFFSET
+    distance_from_body: float = DISTANCE_FROM_BODY
+    sewing_spacing: float = SEWING_SPACING
+    sewing_adjustment_step: float = SEWING_ADJUSTMENT_STEP
+    wrap_radians: float = WRAP_RADIANS
+
+    @classmethod
+    def from_dict(cls, values: dict) -> "SimulationConfig":
+        """ Build from a dict of overrides e.g. read from json, parameters not given keep their defaults """
+        unknown = set(values) - set(cls._fields)
+        if unknown:
+            raise ValueError(f"Unknown simulation parameters {sorted(unknown)}, expected some of {list(cls._fields)}")
+        return cls(**values)
+
+    @property
+    def max_sewing_adjustment(self) -> float:
+        """ Largest distance sewn vertices move closer in one step """
+        return self.sewing_adjustment_step * self.time_delta
+
+
+DEFAULT_CONFIG = SimulationConfig()
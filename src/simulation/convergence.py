@@ -0,0 +1,126 @@
+""" Track whether a simulation has settled so runs can stop before their step budget """
+from collections import deque
+from typing import Deque, Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+from src.simulation.piece_physics import DynamicPiece
+from src.simulation.sewing_constraints import SewingConstraints
+
+from src.parameters import (CONVERGENCE_KINETIC_ENERGY, CONVERGENCE_DISPLACEMENT, CONVERGENCE_SEWING_GAP,
+                            CONVERGENCE_PATIENCE)
+
+
+class ConvergenceTolerances(NamedTuple):
+    """ Thresholds every metric has to stay below for patience consecutive steps to count as converged """
+    kinetic_energy: float = CONVERGENCE_KINETIC_ENERGY
+    displacement: float = CONVERGENCE_DISPLACEMENT
+    sewing_gap: float = CONVERGENCE_SEWING_GAP
+    patience: int = CONVERGENCE_PATIENCE
+
+
+class ConvergenceMetrics(NamedTuple):
+    """
+        Measurements of one step, kinetic energy is per unit mass vertex, sewing gap is per sewing pair
+        Kinetic energy comes from how far vertices moved over the last patience steps, as velocity of cloth resting
+        on the body keeps the gravity collision cancels and single steps are dominated by vertices chattering
+    """
+    step: int
+    kinetic_energy: Dict[str, float]
+    displacement: Dict[str, float]
+    sewing_gap: List[float]
+
+    @property
+    def max_kinetic_energy(self) -> float:
+        """ Get largest kinetic energy of any piece """
+        return max(self.kinetic_energy.values(), default=0.)
+
+    @property
+    def max_displacement(self) -> float:
+        """ Get largest distance any vertex moved in the step """
+        return max(self.displacement.values(), default=0.)
+
+    @property
+    def max_sewing_gap(self) -> float:
+        """ Get largest distance between two sewn vertices """
+        return max(self.sewing_gap, default=0.)
+
+    def get_exceeded(self, tolerances: ConvergenceTolerances) -> List[str]:
+        """ Names of metrics above their tolerance """
+        values = {
+            'kinetic_energy': self.max_kinetic_energy,
+            'displacement': self.max_displacement,
+            'sewing_gap': self.max_sewing_gap,
+        }
+        return [name for name, value in values.items() if value > getattr(tolerances, name)]
+
+
+class ConvergenceReport(NamedTuple):
+    """ Outcome of running until converged """
+    converged: bool
+    nr_steps: int
+    reason: str
+    metrics: Optional[ConvergenceMetrics]
+
+
+class ConvergenceMonitor:
+    """
+        Measures kinetic energy and largest vertex displacement of each piece and the gap of each sewing pair
+        after every step, counting how many steps in a row all of them have been within tolerance
+    """
+    def __init__(self, pieces: Dict[str, DynamicPiece], sewing_constraints: SewingConstraints,
+                 tolerances: ConvergenceTolerances = ConvergenceTolerances()):
+        self.pieces = pieces
+        self.sewing_constraints = sewing_constraints
+        self.tolerances = tolerances
+
+        self.history: List[ConvergenceMetrics] = []
+        self.nr_settled_steps = 0
+        self._window_positions: Deque[Dict[str, np.ndarray]] = deque(
+            [{k: piece.mesh.vertices_3d.copy() for k, piece in pieces.items()}], maxlen=max(tolerances.patience, 1)
+        )
+
+    def update(self, step: int) -> ConvergenceMetrics:
+        """ Measure state of pieces after step """
+        kinetic_energy = {}
+        displacement = {}
+        window_start, last_positions = self._window_positions[0], self._window_positions[-1]
+        nr_window_steps = len(self._window_positions)
+        for key, piece in self.pieces.items():
+            vertices = piece.mesh.vertices_3d
+            speeds = np.linalg.norm(vertices - window_start[key], axis=1) / (nr_window_steps * piece.config.time_delta)
+            kinetic_energy[key] = 0.5 * float(np.dot(speeds, speeds)) / max(len(vertices), 1)
+            displacement[key] = float(np.linalg.norm(vertices - last_positions[key], axis=1).max(initial=0.))
+        self._window_positions.append({k: piece.mesh.vertices_3d.copy() for k, piece in self.pieces.items()})
+
+        sewing_gap = [
+            sewing_pair.get_max_gap(self.pieces[sewing_pair.from_piece].mesh.vertices_3d,
+                                    self.pieces[sewing_pair.to_piece].mesh.vertices_3d)
+            for sewing_pair in self.sewing_constraints
+        ]
+
+        metrics = ConvergenceMetrics(step, kinetic_energy, displacement, sewing_gap)
+        self.history.append(metrics)
+        self.nr_settled_steps = 0 if metrics.get_exceeded(self.tolerances) else self.nr_settled_steps + 1
+        return metrics
+
+    @property
+    def converged(self) -> bool:
+        """ Whether all metrics have been within tolerance for enough steps """
+        return self.nr_settled_steps >= self.tolerances.patience
+
+    def get_report(self) -> ConvergenceReport:
+        """ Summarise why the run stopped """
+        if not self.history:
+            return ConvergenceReport(False, 0, "No steps were run", None)
+
+        metrics = self.history[-1]
+        summary = (f"kinetic energy {metrics.max_kinetic_energy:.3g}, displacement {metrics.max_displacement:.3g}, "
+                   f"sewing gap {metrics.max_sewing_gap:.3g}")
+        if self.converged:
+            reason = f"Converged after {len(self.history)} steps with {summary}"
+        else:
+            exceeded = ', '.join(metrics.get_exceeded(self.tolerances)) or 'patience'
+            reason = f"Reached {len(self.history)} steps without converging ({exceeded} not settled) with {summary}"
+
+        return ConvergenceReport(self.converged, len(self.history), reason, metrics)
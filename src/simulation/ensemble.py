@@ -0,0 +1,160 @@
+""" Simulate many parameter variants of one garment at once with a leading variant dimension on the state """
+from typing import Dict, List, NamedTuple
+
+import numpy as np
+
+from src.simulation.mesh import MeshData
+from src.simulation.piece_physics import DynamicPiece, get_pair_accelerations, get_bend_accelerations
+from src.simulation.packed_pieces import PackedPieces
+from src.simulation.sewing_constraints import SewingConstraints
+from src.simulation.config import SimulationConfig, DEFAULT_CONFIG
+
+
+class EnsembleParameters(NamedTuple):
+    """ Value of each fabric parameter for every variant """
+    stress_weighting: np.ndarray
+    shear_weighting: np.ndarray
+    bend_weighting: np.ndarray
+    dampening_start: np.ndarray
+    dampening_end: np.ndarray
+
+    @classmethod
+    def from_variants(cls, variants: List[dict], config: SimulationConfig = DEFAULT_CONFIG) -> "EnsembleParameters":
+        """ Build from one dict of parameter overrides per variant, parameters not given keep values of config """
+        defaults = {
+            'stress_weighting': config.stress_weighting,
+            'shear_weighting': config.shear_weighting,
+            'bend_weighting': config.bend_weighting,
+            'dampening_start': config.velocity_damping_start,
+            'dampening_end': config.velocity_damping_end,
+        }
+        for variant in variants:
+            unknown = set(variant) - set(defaults)
+            if unknown:
+                raise ValueError(f"Unknown ensemble parameters {sorted(unknown)}, expected some of {list(defaults)}")
+
+        # Weightings are float32 and dampening float64 so each variant rounds exactly like a single simulation
+        return cls(*(
+            np.array([variant.get(name, default) for variant in variants],
+                     dtype=np.float64 if name.startswith('dampening') else np.float32)
+            for name, default in defaults.items()
+        ))
+
+    @property
+    def nr_variants(self) -> int:
+        """ Get number of variants """
+        return len(self.stress_weighting)
+
+
+class EnsemblePieces(PackedPieces):
+    """
+        Packed garment repeated once per variant in one vertex buffer of shape (variants x packed vertices)
+        Force, dampening and sewing kernels see the buffer as (variants, packed vertices, 3) and share one set
+        of relation and sewing indices, while integration, floor clamp and collision run over the flat buffer
+        Original pieces keep views into the first variant
+    """
+    def __init__(self, pieces: Dict[str, DynamicPiece], parameters: EnsembleParameters):
+        super().__init__(pieces)
+        nr_variants = parameters.nr_variants
+        nr_vertices = self.mesh.nr_vertices
+
+        index_data = np.concatenate([self.mesh._index_data + i * nr_vertices for i in range(nr_variants)])
+        texture_data = {
+            (0.5, 0.5, 0.5): {'count': len(index_data), 'offset': 0}
+        }
+        self.mesh = MeshData(np.tile(self.mesh._vertex_data, (nr_variants, 1)), index_data, texture_data,
+                             centre_at_origin=False)
+        self.velocity = np.tile(self.velocity, (nr_variants, 1))
+        self.acceleration = np.tile(self.acceleration, (nr_variants, 1))
+        self.nearest_triangle_cache = np.full(self.mesh.nr_vertices, -1, dtype=np.int64)
+
+        self.parameters = parameters
+        self.nr_variants = nr_variants
+        self.stress_weighting = parameters.stress_weighting.reshape(-1, 1, 1)
+        self.shear_weighting = parameters.shear_weighting.reshape(-1, 1, 1)
+        self.bend_weighting = parameters.bend_weighting.reshape(-1, 1, 1)
+        self.dampening_start = parameters.dampening_start.reshape(-1, 1, 1)
+        self.dampening_end = parameters.dampening_end.reshape(-1, 1, 1)
+
+        for key, piece in pieces.items():
+            piece_slice = self.piece_slices[key]
+            piece.mesh._vertex_data = self.mesh._vertex_data[piece_slice]
+            piece.velocity = self.velocity[piece_slice]
+            piece.acceleration = self.acceleration[piece_slice]
+
+    def get_variant_view(self, values: np.ndarray) -> np.ndarray:
+        """ View of a flat per vertex buffer as (variants, packed vertices, 3) """
+        return values.reshape(self.nr_variants, -1, values.shape[-1])
+
+    def get_variant_positions(self, variant: int) -> Dict[str, np.ndarray]:
+        """ Reference to 3d vertices of every piece in one variant """
+        vertices = self.get_variant_view(self.mesh.vertices_3d)[variant]
+        return {key: vertices[piece_slice] for key, piece_slice in self.piece_slices.items()}
+
+    def apply_dampening_to_velocity(self, step: int):
+        """ Apply energy reduction of each variant depending on the step """
+        velocity = self.get_variant_view(self.velocity)
+        norms = np.linalg.norm(velocity, axis=-1, keepdims=True)
+        velocity *= np.minimum(1.0, self.config.max_tensile_velocity / norms) * self.get_dampening(step)
+
+    def apply_stress_force(self):
+        """ Apply stress force of each variant """
+        relations = self.active_relations
+        acceleration = self.get_variant_view(self.acceleration)
+        acceleration += get_pair_accelerations(self.get_variant_view(self.mesh.vertices_3d),
+                                               relations.stress_relations, relations.stress_operator,
+                                               self.resting_straight_length, self.stress_weighting,
+                                               self.config.stress_threshold)
+
+    def apply_shear_force(self):
+        """ Apply shear force of each variant """
+        relations = self.active_relations
+        acceleration = self.get_variant_view(self.acceleration)
+        acceleration += get_pair_accelerations(self.get_variant_view(self.mesh.vertices_3d),
+                                               relations.shear_relations, relations.shear_operator,
+                                               self.resting_diagonal_length, self.shear_weighting,
+                                               self.config.shear_threshold)
+
+    def apply_bend_forces(self):
+        """ Apply bend force of each variant """
+        relations = self.active_relations
+        acceleration = self.get_variant_view(self.acceleration)
+        acceleration += get_bend_accelerations(self.get_variant_view(self.mesh.vertices_3d),
+                                               relations.bend_relations, relations.bend_operator,
+                                               self.bend_weighting, self.config.bend_threshold)
+
+    def apply_sewing_adjustment(self, sewing_constraints: SewingConstraints):
+        """ Move sewn vertices of every variant closer with the compiled global sewing indices """
+        adjustment = sewing_constraints.get_global_adjustment(self.get_variant_view(self.mesh.vertices_3d))
+        self.mesh.offset_vertices(adjustment.reshape(-1, 3))
+
+
+if __name__ == '__main__':
+    from time import perf_counter
+
+    from src.utils.read_obj import parse_obj
+    from src.utils.file_io import read_json
+    from src.simulation.setup.extract_clothing_vertex_data import extract_all_piece_vertices
+    from src.simulation.simulation import FabricSimulation
+    from src.parameters import AVATAR_SCALING
+
+    avatar_mesh = parse_obj('./assets/BodyMesh.obj', './assets/BodyAnnotations.json')
+    avatar_mesh.scale_vertices(AVATAR_SCALING)
+    clothing_data = read_json('./assets/sewing_shirt.json')
+    variants = [{'stress_weighting': weighting} for weighting in np.linspace(300, 900, 8)]
+
+    pieces, sewing_constraints = extract_all_piece_vertices(clothing_data, avatar_mesh)
+    simulation = FabricSimulation(avatar_mesh, pieces, sewing_constraints, collision_backend='sdf',
+                                  ensemble=EnsembleParameters.from_variants(variants))
+    start = perf_counter()
+    simulation.step(50, logging=False)
+    print(f'Time taken to run {len(variants)} variants as an ensemble = {perf_counter() - start:.3}')
+
+    time_taken = 0.
+    for _ in variants:
+        pieces, sewing_constraints = extract_all_piece_vertices(clothing_data, avatar_mesh)
+        simulation = FabricSimulation(avatar_mesh, pieces, sewing_constraints, collision_backend='sdf')
+        start = perf_counter()
+        simulation.step(50, logging=False)
+        time_taken += perf_counter() - start
+    print(f'Time taken to run {len(variants)} variants one by one = {time_taken:.3}')
@@ -1,3 +1,2 @@
 from .mesh import *
-from .display import *
 from .annotation import *
@@ -1,5 +1,5 @@
 """ Container class of mesh visualisation data """
-from typing import Tuple, Union, Optional
+from typing import Dict, Tuple, Union, Optional
 
 import numpy as np
 from trimesh import Trimesh
@@ -12,16 +12,20 @@ class MeshData:
         Texture data indicates where to use in each material in a render pass
     """
     def __init__(self, vertex_data: np.ndarray, index_data: np.ndarray, texture_data: dict,
-                 annotations: Optional[dict] = None, turn_points: Optional[np.ndarray] = None):
+                 annotations: Optional[dict] = None, turn_points: Optional[np.ndarray] = None,
+                 centre_at_origin: bool = True, trimesh_topology: Optional[Tuple[np.ndarray, np.ndarray]] = None):
         self._vertex_data = vertex_data
         self._index_data = index_data
         self._texture_data = texture_data
 
         self._trimesh = None
+        self._trimesh_topology = trimesh_topology
+        self._face_ring = None
+        self._closest_surface_cache: Dict[bytes, Tuple[np.ndarray, np.ndarray]] = {}
         self._annotations = annotations if annotations is not None else {}
         self._turn_points = turn_points
 
-        self.origin_array = self.place_at_origin()
+        self.origin_array = self.place_at_origin() if centre_at_origin else (0., 0., 0.)
 
     @property
     def nr_vertices(self) -> int:
@@ -45,13 +49,60 @@ class MeshData:
 
     @property
     def trimesh(self) -> Trimesh:
-        """ Create compute structure for collision detection """
-        if self._trimesh is None:
+        """
+            Create compute structure for collision detection
+            Known topology (vertex ids into vertex data and faces) of the processed mesh skips processing
+        """
+        if self._trimesh is None and self._trimesh_topology is not None:
+            vertex_ids, faces = self._trimesh_topology
+            self._trimesh = Trimesh(vertices=self._vertex_data[vertex_ids, :3], faces=faces, process=False)
+        elif self._trimesh is None:
             self._trimesh = Trimesh(vertices=self._vertex_data[:, :3],
                                     faces=self._index_data,
                                     process=True, validate=True)
         return self._trimesh
 
+    @property
+    def face_ring(self) -> np.ndarray:
+        """
+            For each face of the trimesh, indices of faces sharing a vertex with it (including itself)
+            Rows are padded with the face's own index so they all have the same length
+        """
+        if self._face_ring is None:
+            faces = self.trimesh.faces
+            ring = self.trimesh.vertex_faces[faces].reshape(len(faces), -1)
+            own_faces = np.broadcast_to(np.arange(len(faces))[:, np.newaxis], ring.shape)
+            self._face_ring = np.where(ring == -1, own_faces, ring)
+        return self._face_ring
+
+    def get_closest_surface(self, points: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+            Closest point on surface and normal of its triangle for each point
+            Results are cached per query point so points resolved in one batch are free to look up again
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        keys = [point.tobytes() for point in points]
+
+        missing = {key: ind for ind, key in enumerate(keys) if key not in self._closest_surface_cache}
+        if missing:
+            closest_points, _, triangle_ids = self.trimesh.nearest.on_surface(points[list(missing.values())])
+            normals = self.trimesh.face_normals[triangle_ids]
+            for key, closest_point, normal in zip(missing.keys(), closest_points, normals):
+                self._closest_surface_cache[key] = (closest_point, normal)
+
+        closest_points = np.array([self._closest_surface_cache[key][0] for key in keys])
+        normals = np.array([self._closest_surface_cache[key][1] for key in keys])
+        return closest_points, normals
+
+    def get_closest_normal(self, query_point: np.ndarray, distance: float = 0.) -> Tuple[np.ndarray, np.ndarray]:
+        """ Get offset by normal to closest point on surface """
+        (closest_point,), (normal_to_surface,) = self.get_closest_surface(query_point)
+        return closest_point + distance * normal_to_surface, normal_to_surface
+
+    def clear_closest_surface_cache(self):
+        """ Forget cached closest surface points, needed whenever the vertices move """
+        self._closest_surface_cache.clear()
+
     @property
     def annotations(self) -> dict:
         """ Get dictionary of named point to location """
@@ -65,6 +116,7 @@ class MeshData:
         origin_array = (x_mean, y_min, z_mean)
 
         self._vertex_data[:, :3] -= origin_array
+        self.clear_closest_surface_cache()
 
         for annotation_point in self._annotations.values():
             annotation_point -= origin_array
@@ -77,6 +129,7 @@ class MeshData:
     def scale_vertices(self, scalar: float):
         """ Scale vertices by a constant """
         self._vertex_data[:, :3] *= scalar
+        self.clear_closest_surface_cache()
 
         for annotation_point in self._annotations.values():
             annotation_point *= scalar
@@ -91,6 +144,7 @@ class MeshData:
             self._vertex_data[:, :3] += offset
         else:
             self._vertex_data[mask, :3] += offset
+        self.clear_closest_surface_cache()
 
         # Once we start running the simulation, stop updating turn-points as they are not phsyical points
         # Another way to handle this is for turn-points ect. to index a vertex
@@ -106,12 +160,14 @@ class MeshData:
     def clamp_above_zero(self):
         """ Ensure y vertices are always above 0 """
         self._vertex_data[:, 1] = np.maximum(self._vertex_data[:, 1], 0.)
+        self.clear_closest_surface_cache()
 
     def flip_x(self):
         """ Flip over x coordinates in place over mean x coordinate """
         mean_x = self._vertex_data[:, 0].mean()
         self._vertex_data[:, 0] *= -1
         self._vertex_data[:, 0] += mean_x * 2
+        self.clear_closest_surface_cache()
 
         for annotation_point in self._annotations.values():
             annotation_point[0] *= -1
@@ -127,6 +183,7 @@ class MeshData:
 
         self._vertex_data[:, :3] @= matrix
         self._vertex_data[:, :3] += offset
+        self.clear_closest_surface_cache()
 
         for annotation_point in self._annotations.values():
             annotation_point @= matrix
@@ -0,0 +1,155 @@
+""" Coarse to fine simulation, most steps run on coarse grids and positions are carried onto finer grids """
+from typing import Dict, Optional, Sequence
+from time import perf_counter
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.spatial import cKDTree
+
+from src.utils.read_obj import parse_obj
+from src.utils.file_io import read_json
+from src.simulation.mesh import MeshData
+from src.simulation.piece_physics import DynamicPiece
+from src.simulation.simulation import FabricSimulation
+from src.simulation.setup.extract_clothing_vertex_data import get_grid_vertex_indices
+from src.simulation.setup.setup_cache import get_all_piece_vertices
+from src.simulation.config import SimulationConfig, DEFAULT_CONFIG
+
+from src.parameters import AVATAR_SCALING, MULTI_RESOLUTIONS, MULTI_RESOLUTION_STEPS
+
+
+EXTRAPOLATION_NEIGHBOURS = 6  # Closest coarse vertices an affine map is fitted to for fine vertices near the contour
+
+
+def get_grid_coordinates(values: np.ndarray, grid_range: np.ndarray) -> np.ndarray:
+    """ Fractional index of values along a uniformly spaced grid axis, extended linearly past its ends """
+    spacing = grid_range[1] - grid_range[0] if len(grid_range) > 1 else 1.
+    return (values - grid_range[0]) / spacing
+
+
+def get_affine_weights(points: np.ndarray, neighbours: np.ndarray) -> np.ndarray:
+    """
+        Weights (points, neighbours) reproducing any affine function of the neighbours at the points,
+        from a least squares fit of an affine map to each point's neighbours (points, neighbours, 2)
+    """
+    basis = np.concatenate([np.ones(neighbours.shape[:2] + (1,)), neighbours], axis=2)
+    return np.einsum('pi,pin->pn', np.concatenate([np.ones((len(points), 1)), points], axis=1),
+                     np.linalg.pinv(basis))
+
+
+def get_prolongation_operator(coarse_piece: DynamicPiece, fine_piece: DynamicPiece) -> csr_matrix:
+    """
+        Sparse (fine vertices, coarse vertices) matrix interpolating coarse values onto fine vertices
+        Fine vertices in a coarse cell with all corners inside the piece are bilinear in coarse grid coordinates,
+        the rest extrapolate an affine map fitted to the closest coarse vertices, so contours keep their shape
+    """
+    coarse_grid = coarse_piece.grid
+    fine_grid = fine_piece.grid
+    if coarse_grid is None or fine_grid is None:
+        raise ValueError("Pieces need the grid they were built from to move between resolutions")
+
+    fine_rows, fine_cols = np.nonzero(fine_grid.inside_mask)
+    coarse_col = get_grid_coordinates(fine_grid.x_range[fine_cols], coarse_grid.x_range)
+    coarse_row = get_grid_coordinates(fine_grid.y_range[fine_rows], coarse_grid.y_range)
+
+    nr_rows, nr_cols = coarse_grid.shape
+    left = np.clip(np.floor(coarse_col).astype(np.int64), 0, max(nr_cols - 2, 0))
+    bottom = np.clip(np.floor(coarse_row).astype(np.int64), 0, max(nr_rows - 2, 0))
+    right = np.minimum(left + 1, nr_cols - 1)
+    top = np.minimum(bottom + 1, nr_rows - 1)
+    col_fraction = coarse_col - left
+    row_fraction = coarse_row - bottom
+
+    coarse_indices = get_grid_vertex_indices(coarse_grid.inside_mask)
+    corners = np.stack([
+        coarse_indices[bottom, left], coarse_indices[bottom, right],
+        coarse_indices[top, left], coarse_indices[top, right]
+    ], axis=1).astype(np.int64) - 1
+    weights = np.stack([
+        (1 - row_fraction) * (1 - col_fraction), (1 - row_fraction) * col_fraction,
+        row_fraction * (1 - col_fraction), row_fraction * col_fraction
+    ], axis=1)
+
+    in_cell = (corners >= 0).all(axis=1) & (col_fraction >= 0) & (col_fraction <= 1) & \
+        (row_fraction >= 0) & (row_fraction <= 1)
+    fine_indices = [np.repeat(np.flatnonzero(in_cell), 4)]
+    coarse_columns = [corners[in_cell].flatten()]
+    values = [weights[in_cell].flatten()]
+
+    if not in_cell.all():
+        coarse_rows, coarse_cols = np.nonzero(coarse_grid.inside_mask)
+        coarse_points = np.stack([coarse_cols, coarse_rows], axis=1).astype(np.float64)
+        points = np.stack([coarse_col[~in_cell], coarse_row[~in_cell]], axis=1)
+
+        nr_neighbours = min(EXTRAPOLATION_NEIGHBOURS, len(coarse_points))
+        _, nearest = cKDTree(coarse_points).query(points, nr_neighbours)
+        nearest = nearest.reshape(len(points), nr_neighbours)
+
+        fine_indices.append(np.repeat(np.flatnonzero(~in_cell), nr_neighbours))
+        coarse_columns.append(nearest.flatten())
+        values.append(get_affine_weights(points, coarse_points[nearest]).flatten())
+
+    fine_indices, coarse_columns, values = (np.concatenate(array) for array in (fine_indices, coarse_columns, values))
+    keep = values != 0
+    return csr_matrix(
+        (values[keep], (fine_indices[keep], coarse_columns[keep])),
+        shape=(len(fine_rows), coarse_piece.mesh.nr_vertices)
+    )
+
+
+def prolong_pieces(coarse_pieces: Dict[str, DynamicPiece], fine_pieces: Dict[str, DynamicPiece]):
+    """ Move positions and velocities of fine pieces onto those interpolated from matching coarse pieces """
+    for key, fine_piece in fine_pieces.items():
+        coarse_piece = coarse_pieces[key]
+        prolongation = get_prolongation_operator(coarse_piece, fine_piece)
+
+        new_positions = (prolongation @ coarse_piece.mesh.vertices_3d).astype(np.float32)
+        fine_piece.mesh.offset_vertices(new_positions - fine_piece.mesh.vertices_3d)
+        fine_piece.velocity[:] = prolongation @ coarse_piece.velocity
+
+
+def run_multi_resolution(body: MeshData, clothing_data: dict,
+                         resolutions: Sequence[float] = MULTI_RESOLUTIONS,
+                         nr_steps: Sequence[int] = MULTI_RESOLUTION_STEPS,
+                         logging: bool = True, config: SimulationConfig = DEFAULT_CONFIG,
+                         **simulation_kwargs) -> Optional[FabricSimulation]:
+    """
+        Build pieces at each resolution (cm) from coarse to fine and run the given number of steps at each,
+        each level starts from the state of the last one and continues its dampening schedule
+        Every level is built and simulated with config
+        Returns simulation of the finest level
+    """
+    if len(resolutions) != len(nr_steps):
+        raise ValueError(f"Got {len(resolutions)} resolutions but {len(nr_steps)} step counts")
+
+    simulation = None
+    first_step = 0
+    for resolution, level_steps in zip(resolutions, nr_steps):
+        pieces, sewing_constraints = get_all_piece_vertices(clothing_data, body, resolution, config=config)
+        if simulation is not None:
+            prolong_pieces(simulation.pieces, pieces)
+
+        simulation = FabricSimulation(body, pieces, sewing_constraints, **simulation_kwargs)
+        if logging:
+            nr_vertices = sum(piece.mesh.nr_vertices for piece in pieces.values())
+            print(f"Resolution {resolution}cm with {nr_vertices} vertices for {level_steps} steps")
+
+        simulation.step(level_steps, logging, first_step)
+        first_step += level_steps
+
+    return simulation
+
+
+if __name__ == '__main__':
+    avatar_mesh = parse_obj('./assets/BodyMesh.obj', './assets/BodyAnnotations.json')
+    avatar_mesh.scale_vertices(AVATAR_SCALING)
+    clothing_data = read_json('./assets/sewing_shirt.json')
+
+    start = perf_counter()
+    run_multi_resolution(avatar_mesh, clothing_data, logging=False)
+    print(f'Time taken multi-resolution {MULTI_RESOLUTIONS} = {perf_counter() - start:.3}')
+
+    start = perf_counter()
+    run_multi_resolution(avatar_mesh, clothing_data, MULTI_RESOLUTIONS[-1:], [sum(MULTI_RESOLUTION_STEPS)],
+                         logging=False)
+    print(f'Time taken at resolution {MULTI_RESOLUTIONS[-1]} = {perf_counter() - start:.3}')
@@ -0,0 +1,127 @@
+""" Numba compiled CPU kernels fusing every internal force of a dynamic piece """
+import numpy as np
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+from src.simulation.config import SimulationConfig, DEFAULT_CONFIG
+
+
+def _pair_forces(vertices, relations, resting_length, weighting, threshold, relation_forces, offset):
+    """ Force on first vertex of each pair resisting change from resting length """
+    for i in prange(len(relations)):
+        start = vertices[relations[i, 0]]
+        end = vertices[relations[i, 1]]
+
+        vx = (end[0] - start[0]) / resting_length
+        vy = (end[1] - start[1]) / resting_length
+        vz = (end[2] - start[2]) / resting_length
+        distance = np.sqrt(vx * vx + vy * vy + vz * vz)
+
+        direction = 0.
+        if distance > 1 + threshold:
+            direction = 1.
+        elif distance < 1 - threshold:
+            direction = -1.
+
+        scale = (1. - 1. / distance) * direction * weighting if distance != 0 else 0.
+        relation_forces[offset + i, 0] = vx * scale
+        relation_forces[offset + i, 1] = vy * scale
+        relation_forces[offset + i, 2] = vz * scale
+
+
+def _bend_forces(vertices, relations, weighting, threshold, relation_forces, offset):
+    """ Force pulling the middle vertex of each bend towards the midpoint of its ends """
+    for i in prange(len(relations)):
+        start = vertices[relations[i, 0]]
+        middle = vertices[relations[i, 1]]
+        end = vertices[relations[i, 2]]
+
+        bx = (start[0] + end[0]) * 0.5 - middle[0]
+        by = (start[1] + end[1]) * 0.5 - middle[1]
+        bz = (start[2] + end[2]) * 0.5 - middle[2]
+
+        scale = weighting if np.sqrt(bx * bx + by * by + bz * bz) > threshold else 0.
+        relation_forces[offset + i, 0] = bx * scale
+        relation_forces[offset + i, 1] = by * scale
+        relation_forces[offset + i, 2] = bz * scale
+
+
+def _relation_forces(vertices, stress_relations, shear_relations, bend_relations,
+                     resting_straight_length, resting_diagonal_length, config, relation_forces):
+    """ Compute force of every relation into one array, ordered stress, shear then bend """
+    _pair_forces(vertices, stress_relations, resting_straight_length,
+                 float(config.stress_weighting), float(config.stress_threshold), relation_forces, 0)
+    _pair_forces(vertices, shear_relations, resting_diagonal_length,
+                 float(config.shear_weighting), float(config.shear_threshold), relation_forces, len(stress_relations))
+    _bend_forces(vertices, bend_relations, float(config.bend_weighting), float(config.bend_threshold),
+                 relation_forces, len(stress_relations) + len(shear_relations))
+
+
+def _gather_vertex_forces(relation_forces, indptr, relation_indices, coefficients, velocity,
+                          gravity, friction_constant, acceleration):
+    """ Sum relation forces touching each vertex with gravity and friction, one thread per vertex """
+    for vertex in prange(len(acceleration)):
+        ax = 0.
+        ay = -gravity
+        az = 0.
+
+        for k in range(indptr[vertex], indptr[vertex + 1]):
+            relation = relation_indices[k]
+            ax += coefficients[k] * relation_forces[relation, 0]
+            ay += coefficients[k] * relation_forces[relation, 1]
+            az += coefficients[k] * relation_forces[relation, 2]
+
+        acceleration[vertex, 0] = ax - friction_constant * velocity[vertex, 0]
+        acceleration[vertex, 1] = ay - friction_constant * velocity[vertex, 1]
+        acceleration[vertex, 2] = az - friction_constant * velocity[vertex, 2]
+
+
+if NUMBA_AVAILABLE:
+    _pair_forces = njit(parallel=True, cache=True)(_pair_forces)
+    _bend_forces = njit(parallel=True, cache=True)(_bend_forces)
+    _gather_vertex_forces = njit(parallel=True, cache=True)(_gather_vertex_forces)
+
+
+def update_internal_forces_numba(vertices: np.ndarray, velocity: np.ndarray, acceleration: np.ndarray,
+                                 vertex_relations, resting_straight_length: float,
+                                 resting_diagonal_length: float, config: SimulationConfig = DEFAULT_CONFIG):
+    """
+        Overwrite acceleration with gravity, stress, shear, bend and friction forces using compiled kernels
+        Parameters of config are passed as arguments so kernels compile once for every config
+    """
+    if not NUMBA_AVAILABLE:
+        raise ImportError("Numba is required for the numba force backend, install with pip install numba")
+
+    operator = vertex_relations.combined_operator
+    relation_forces = np.empty((vertex_relations.nr_relations, 3), dtype=np.float64)
+
+    _relation_forces(np.ascontiguousarray(vertices), vertex_relations.stress_relations,
+                     vertex_relations.shear_relations, vertex_relations.bend_relations,
+                     resting_straight_length, resting_diagonal_length, config, relation_forces)
+    _gather_vertex_forces(relation_forces, operator.indptr, operator.indices, operator.data,
+                          velocity, float(config.gravity), float(config.friction_constant), acceleration)
+
+
+if __name__ == '__main__':
+    from src.utils.file_io import read_json
+    from src.simulation.setup.extract_clothing_vertex_data import extract_all_piece_vertices
+
+    clothing_data = read_json('./assets/sewing_shirt.json')
+    pieces, _ = extract_all_piece_vertices(clothing_data)
+
+    rng = np.random.default_rng(0)
+    for name, piece in pieces.items():
+        piece.mesh.offset_vertices(rng.normal(0, 0.003, piece.mesh.vertices_3d.shape).astype(np.float32))
+        piece.velocity[:] = rng.normal(0, 0.1, piece.velocity.shape)
+
+        piece.update_internal_forces()
+        numpy_acceleration = piece.acceleration.copy()
+        piece.update_internal_forces_numba()
+
+        difference = np.abs(piece.acceleration - numpy_acceleration).max()
+        print(f"{name} max difference to numpy forces {difference:.3e} "
+              f"(max acceleration {np.abs(numpy_acceleration).max():.3e})")
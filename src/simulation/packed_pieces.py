@@ -0,0 +1,61 @@
+""" Simulate every piece of a garment together in one contiguous vertex buffer """
+from typing import Callable, Dict
+
+import numpy as np
+
+from src.simulation.mesh import MeshData
+from src.simulation.piece_physics import DynamicPiece
+from src.simulation.setup.vertex_relationships import VertexRelations
+
+
+class PackedPieces(DynamicPiece):
+    """
+        All pieces joined into a single dynamic piece so that forces, dampening,
+        floor clamp and collision are one vectorized call over the whole garment
+        Each original piece keeps views into the packed vertex, velocity and acceleration buffers
+        Buffers are created with allocate so a compute backend can own their memory
+        Config of the first piece is used for the whole garment
+    """
+    def __init__(self, pieces: Dict[str, DynamicPiece], allocate: Callable[..., np.ndarray] = np.zeros):
+        self.piece_slices = {}
+        offsets = []
+        start = 0
+        for key, piece in pieces.items():
+            offsets.append(start)
+            self.piece_slices[key] = slice(start, start + piece.mesh.nr_vertices)
+            start += piece.mesh.nr_vertices
+
+        all_pieces = list(pieces.values())
+        vertex_data = np.concatenate([piece.mesh._vertex_data for piece in all_pieces])
+        index_data = np.concatenate([
+            piece.mesh._index_data + offset for piece, offset in zip(all_pieces, offsets)
+        ]).astype(np.uint32)
+        texture_data = {
+            (0.5, 0.5, 0.5): {'count': len(index_data), 'offset': 0}
+        }
+
+        mesh = MeshData(vertex_data, index_data, texture_data, centre_at_origin=False)
+        mesh._vertex_data = allocate(vertex_data.shape, dtype=vertex_data.dtype)
+        mesh._vertex_data[:] = vertex_data
+        vertex_relations = VertexRelations.concatenate([piece.vertex_relations for piece in all_pieces], offsets)
+        super().__init__(mesh, vertex_relations, '', '', all_pieces[0].resolution, config=all_pieces[0].config)
+
+        self.velocity = allocate((start, 3), dtype=np.float32)
+        self.acceleration = allocate((start, 3), dtype=np.float32)
+        self.velocity[:] = np.concatenate([piece.velocity for piece in all_pieces])
+        self.acceleration[:] = np.concatenate([piece.acceleration for piece in all_pieces])
+
+        for key, piece in pieces.items():
+            piece_slice = self.piece_slices[key]
+            piece.mesh._vertex_data = self.mesh._vertex_data[piece_slice]
+            piece.velocity = self.velocity[piece_slice]
+            piece.acceleration = self.acceleration[piece_slice]
+
+    @property
+    def nr_pieces(self) -> int:
+        """ Get number of pieces in packed buffer """
+        return len(self.piece_slices)
+
+    def get_piece_vertices(self, name: str) -> np.ndarray:
+        """ Reference to 3d vertices of one piece in the packed buffer """
+        return self.mesh.vertices_3d[self.piece_slices[name]]
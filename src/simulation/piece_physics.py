@@ -1,32 +1,74 @@
 """ Class containing information to simulate a dynamic clothing mesh """
+from typing import Optional, Union
+
 import numpy as np
-from trimesh import Trimesh
+from scipy.sparse import csr_matrix
 
-from src.simulation.common import DistanceAdjustment
+from src.simulation.common import DistanceAdjustment, PieceGrid
 from src.simulation.mesh import MeshData
-from src.simulation.setup.vertex_relationships import VertexRelations
+from src.simulation.collision import SignedDistanceField, BodyBoxHierarchy, get_closest_triangles_near_cache
+from src.simulation.setup.vertex_relationships import VertexRelations, apply_incidence_operator
+from src.simulation.config import SimulationConfig, DEFAULT_CONFIG
+
+from src.parameters import CM_PER_M
+
+
+def get_pair_accelerations(vertices: np.ndarray, relations: np.ndarray, operator: csr_matrix,
+                           resting_length: float, weighting: Union[float, np.ndarray], threshold: float) -> np.ndarray:
+    """
+        Acceleration of every vertex resisting disturbance of pairs from resting length
+        Vertices may have a leading batch dimension, then weighting can be given per batch shaped (batch, 1, 1)
+    """
+    vectors = (vertices[..., relations[:, 1], :] - vertices[..., relations[:, 0], :]) / resting_length
+    distances = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    normed = vectors / np.where(distances == 0, 1, distances)
+    vectors -= normed
+
+    # Stretched relations pull together, compressed relations push apart, others are zeroed
+    direction = (distances > 1 + threshold).astype(np.float32) - (distances < 1 - threshold)
+    vectors *= direction * weighting
+    return apply_incidence_operator(operator, vectors)
 
-from src.parameters import (GRAVITY, VERTEX_RESOLUTION, MAX_TENSILE_VELOCITY,
-                            CM_PER_M, TIME_DELTA, STRESS_WEIGHTING, STRESS_THRESHOLD,
-                            SHEAR_WEIGHTING, SHEAR_THRESHOLD, FRICTION_CONSTANT,
-                            BEND_WEIGHTING, BEND_THRESHOLD,
-                            VELOCITY_DAMPING_START, VELOCITY_DAMPING_END, NR_STEPS)
+
+def get_bend_accelerations(vertices: np.ndarray, relations: np.ndarray, operator: csr_matrix,
+                           weighting: Union[float, np.ndarray], threshold: float) -> np.ndarray:
+    """ Acceleration of every vertex resisting bending of straight lines, batched like get_pair_accelerations """
+    bend_start = vertices[..., relations[:, 0], :]
+    bend_middle = vertices[..., relations[:, 1], :]
+    bend_end = vertices[..., relations[:, 2], :]
+
+    bend_direction = (bend_start + bend_end) * 0.5 - bend_middle
+    bend_amount = np.linalg.norm(bend_direction, axis=-1, keepdims=True)
+
+    bend_direction *= (bend_amount > threshold) * np.float32(weighting)
+    return apply_incidence_operator(operator, bend_direction)
 
 
 class DynamicPiece:
-    """ Simulated with physics helpers """
+    """
+        Simulated with physics helpers, grid the piece was built from is kept to move between resolutions
+        Physics parameters come from config, resolution defaults to the vertex resolution of config
+    """
     def __init__(self, mesh: MeshData, vertex_relations: VertexRelations,
-                 snap_point_name: str, alignment_point_name: str):
+                 snap_point_name: str, alignment_point_name: str,
+                 resolution: Optional[float] = None, grid: Optional[PieceGrid] = None,
+                 config: SimulationConfig = DEFAULT_CONFIG):
         self.mesh = mesh
         self.vertex_relations = vertex_relations
+        self.resolution = config.vertex_resolution if resolution is None else resolution
+        self.grid = grid
+
+        # Vertices that are simulated and the relations touching them, all of them unless some are asleep
+        self.active_mask: Optional[np.ndarray] = None
+        self.active_relations = vertex_relations
 
         self.velocity = np.zeros((self.mesh.nr_vertices, 3), dtype=np.float32)
         self.acceleration = np.zeros((self.mesh.nr_vertices, 3), dtype=np.float32)
-        self.acceleration[:, 1] = -GRAVITY
+        self.nearest_triangle_cache = np.full(self.mesh.nr_vertices, -1, dtype=np.int64)
 
-        self.resting_straight_length = VERTEX_RESOLUTION / CM_PER_M
-        self.resting_diagonal_length = np.sqrt(2) * VERTEX_RESOLUTION / CM_PER_M
-        self.dampening_constant = np.pi / NR_STEPS
+        self.resting_straight_length = self.resolution / CM_PER_M
+        self.resting_diagonal_length = np.sqrt(2) * self.resolution / CM_PER_M
+        self.set_config(config)
 
         self._snap_point_name = snap_point_name
         self._alignment_point_name = alignment_point_name
@@ -57,90 +99,77 @@ class DynamicPiece:
         """ Get alignment vector from snap-point to alignment point """
         return self.alignment_point - self.snap_point
 
+    def set_config(self, config: SimulationConfig):
+        """ Simulate with physics parameters of config from now on, geometry of the piece is kept """
+        self.config = config
+        self.dampening_constant = np.pi / config.nr_steps
+        self.dampening_start = config.velocity_damping_start
+        self.dampening_end = config.velocity_damping_end
+        self.acceleration[:, 1] = -config.gravity
+
+    def set_active_vertices(self, active_mask: Optional[np.ndarray], active_relations: Optional[VertexRelations]):
+        """ Limit simulation to vertices in mask and relations touching them, None simulates every vertex """
+        self.active_mask = active_mask
+        self.active_relations = self.vertex_relations if active_relations is None else active_relations
+
+    def freeze_inactive_vertices(self):
+        """ Stop vertices outside active mask from moving """
+        if self.active_mask is not None:
+            self.velocity[~self.active_mask] = 0.
+
     def update_positions(self):
         """ Update positions from current velocities """
-        self.mesh.offset_vertices(self.velocity * TIME_DELTA)
+        self.mesh.offset_vertices(self.velocity * self.config.time_delta)
         self.mesh.clamp_above_zero()  # floor in y direction should always be positive
 
+    def set_dampening_steps(self, nr_steps: int):
+        """ Stretch dampening schedule so it reaches end dampening after nr_steps """
+        self.dampening_constant = np.pi / nr_steps
+
+    def get_dampening(self, step: int) -> float:
+        """ Get velocity scale at step, easing from start to end dampening """
+        dampening_cosine = 0.5 - 0.5 * np.cos(self.dampening_constant * step)  # Value between 0 and 1
+        return self.dampening_start + (self.dampening_end - self.dampening_start) * dampening_cosine
+
     def apply_dampening_to_velocity(self, step: int):
         """ Apply energy reductiont to the system depending on the step """
         norms = np.linalg.norm(self.velocity, axis=1, keepdims=True)
-        dampening_cosine = 0.5 - 0.5 * np.cos(self.dampening_constant * step)  # Value between 0 and 1
-        dampening = VELOCITY_DAMPING_START + (VELOCITY_DAMPING_END - VELOCITY_DAMPING_START) * dampening_cosine
-
-        scales = np.minimum(1.0, MAX_TENSILE_VELOCITY / norms) * dampening
+        scales = np.minimum(1.0, self.config.max_tensile_velocity / norms) * self.get_dampening(step)
         self.velocity *= scales
 
     def update_velocities(self, step: int):
         """ Update velocities from internal forces within piece """
-        self.velocity += self.acceleration * TIME_DELTA
+        self.velocity += self.acceleration * self.config.time_delta
         self.apply_dampening_to_velocity(step)
 
     def apply_gravity(self):
         """ Apply downward gravity force """
-        self.acceleration[:, 1] = -GRAVITY
+        self.acceleration[:, 1] = -self.config.gravity
 
     def apply_stress_force(self):
         """ Apply resistance to distrubance from resting length in horizontal and vertical direction """
-        vertices = self.mesh.vertices_3d
-        stress_relations = self.vertex_relations.stress_relations
-
-        stress_vectors = (vertices[stress_relations[:, 1]] - vertices[stress_relations[:, 0]]) / self.resting_straight_length
-        stress_distances = np.linalg.norm(stress_vectors, axis=1, keepdims=True)
-        normed_stress = stress_vectors / np.where(stress_distances == 0, 1, stress_distances)
-        stress_vectors -= normed_stress
-
-        has_stress_compress_force = (stress_distances > 1 + STRESS_THRESHOLD).flatten()
-        stress_compress_force_update = stress_vectors[has_stress_compress_force] * STRESS_WEIGHTING
-        np.add.at(self.acceleration, stress_relations[has_stress_compress_force, 1], -stress_compress_force_update)
-        np.add.at(self.acceleration, stress_relations[has_stress_compress_force, 0], stress_compress_force_update)
-
-        has_stress_expand_force = (stress_distances < 1 - STRESS_THRESHOLD).flatten()
-        expand_stress_force_update = stress_vectors[has_stress_expand_force] * STRESS_WEIGHTING
-        np.add.at(self.acceleration, stress_relations[has_stress_expand_force, 1], expand_stress_force_update)
-        np.add.at(self.acceleration, stress_relations[has_stress_expand_force, 0], -expand_stress_force_update)
+        relations = self.active_relations
+        self.acceleration += get_pair_accelerations(self.mesh.vertices_3d, relations.stress_relations,
+                                                    relations.stress_operator, self.resting_straight_length,
+                                                    self.config.stress_weighting, self.config.stress_threshold)
 
     def apply_shear_force(self):
         """ Apply resistance to distrubance from resting length in diagonal directions """
-        vertices = self.mesh.vertices_3d
-        shear_relations = self.vertex_relations.shear_relations
-
-        shear_vectors = (vertices[shear_relations[:, 1]] - vertices[shear_relations[:, 0]]) / self.resting_diagonal_length
-        shear_distances = np.linalg.norm(shear_vectors, axis=1, keepdims=True)
-        normed_shear = shear_vectors / np.where(shear_distances == 0, 1, shear_distances)
-        shear_vectors -= normed_shear
-
-        has_shear_compress_force = (shear_distances > 1 + SHEAR_THRESHOLD).flatten()
-        shear_compress_force_update = shear_vectors[has_shear_compress_force] * SHEAR_WEIGHTING
-        np.add.at(self.acceleration, shear_relations[has_shear_compress_force, 1], -shear_compress_force_update)
-        np.add.at(self.acceleration, shear_relations[has_shear_compress_force, 0], shear_compress_force_update)
-
-        has_shear_expand_force = (shear_distances < 1 - SHEAR_THRESHOLD).flatten()
-        shear_shear_force_update = shear_vectors[has_shear_expand_force] * SHEAR_WEIGHTING
-        np.add.at(self.acceleration, shear_relations[has_shear_expand_force, 1], shear_shear_force_update)
-        np.add.at(self.acceleration, shear_relations[has_shear_expand_force, 0], -shear_shear_force_update)
+        relations = self.active_relations
+        self.acceleration += get_pair_accelerations(self.mesh.vertices_3d, relations.shear_relations,
+                                                    relations.shear_operator, self.resting_diagonal_length,
+                                                    self.config.shear_weighting, self.config.shear_threshold)
 
     def apply_friction(self):
         """ Apply friction in the oposite direction of velocity """
-        self.acceleration -= FRICTION_CONSTANT * self.velocity
+        self.acceleration -= self.config.friction_constant * self.velocity
 
     def apply_bend_forces(self):
         """ Apply resistance to straight lines disturbed from rest """
-        vertices = self.mesh.vertices_3d
-        bend_relations = self.vertex_relations.bend_relations
-
-        bend_start = vertices[bend_relations[:, 0]]
-        bend_middle = vertices[bend_relations[:, 1]]
-        bend_end = vertices[bend_relations[:, 2]]
-
-        bend_direction = (bend_start + bend_end) * 0.5 - bend_middle
-        bend_amount = np.linalg.norm(bend_direction, axis=1)
-        has_bend_force = (bend_amount > BEND_THRESHOLD).flatten()
-
-        bend_force_update = BEND_WEIGHTING * bend_direction[has_bend_force]
-        np.add.at(self.acceleration, bend_relations[has_bend_force, 0], -bend_force_update * 0.5)
-        np.add.at(self.acceleration, bend_relations[has_bend_force, 1], bend_force_update)
-        np.add.at(self.acceleration, bend_relations[has_bend_force, 2], -bend_force_update * 0.5)
+        relations = self.active_relations
+        self.acceleration += get_bend_accelerations(self.mesh.vertices_3d, relations.bend_relations,
+                                                    relations.bend_operator, self.config.bend_weighting,
+                                                    self.config.bend_threshold)
 
     def update_internal_forces(self):
         """ Update forces from internal interactions within piece """
@@ -152,18 +181,53 @@ class DynamicPiece:
         self.apply_bend_forces()
         self.apply_friction()
 
-    def body_collision_adjustment(self, body_trimesh: Trimesh):
-        """ Push vertices outside the body mesh """
+    def update_internal_forces_numba(self):
+        """ Update forces from internal interactions within piece with fused compiled kernels imported on first use """
+        from src.simulation.numba_forces import update_internal_forces_numba
+        update_internal_forces_numba(self.mesh.vertices_3d, self.velocity, self.acceleration, self.active_relations,
+                                     self.resting_straight_length, self.resting_diagonal_length, self.config)
+
+    def body_collision_adjustment(self, body: MeshData, broad_phase: Optional[BodyBoxHierarchy] = None):
+        """ Push active vertices outside the body mesh, only testing vertices the broad phase cannot cull """
         vertices = self.mesh.vertices_3d
+        body_trimesh = body.trimesh
+
+        if broad_phase is None and self.active_mask is None:
+            is_inside_mesh = body_trimesh.contains(vertices)
+        else:
+            is_inside_mesh = np.ones(len(vertices), dtype=bool) if broad_phase is None else \
+                broad_phase.get_candidate_mask(vertices)
+            if self.active_mask is not None:
+                is_inside_mesh &= self.active_mask
+            if is_inside_mesh.any():
+                is_inside_mesh[is_inside_mesh] = body_trimesh.contains(vertices[is_inside_mesh])
 
-        is_inside_mesh = body_trimesh.contains(vertices)
         if not is_inside_mesh.any():
             return
 
-        _, distances, triangle_ids = body_trimesh.nearest.on_surface(vertices[is_inside_mesh])
+        _, distances, triangle_ids = get_closest_triangles_near_cache(
+            body, vertices[is_inside_mesh], self.nearest_triangle_cache[is_inside_mesh]
+        )
+        self.nearest_triangle_cache[is_inside_mesh] = triangle_ids
+
         adjustment = body_trimesh.face_normals[triangle_ids] * distances[:, np.newaxis]
         self.mesh.offset_vertices(adjustment, mask=is_inside_mesh)
 
+    def body_sdf_collision_adjustment(self, body_sdf: SignedDistanceField):
+        """ Push vertices outside the body using a pre-computed signed distance field """
+        distances, normals = body_sdf.sample(self.mesh.vertices_3d)
+
+        # Interpolated surface is approximate so keep a small contact offset from it
+        contact_offset = self.config.sdf_contact_offset
+        is_inside_mesh = distances < contact_offset
+        if self.active_mask is not None:
+            is_inside_mesh &= self.active_mask
+        if not is_inside_mesh.any():
+            return
+
+        adjustment = normals[is_inside_mesh] * (contact_offset - distances[is_inside_mesh, np.newaxis])
+        self.mesh.offset_vertices(adjustment, mask=is_inside_mesh)
+
     def apply_adjustment(self, adjustment: DistanceAdjustment):
         """ Apply a series of vertex adjustments to positions from external source """
         for inds, amount in adjustment:
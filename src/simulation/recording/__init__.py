@@ -0,0 +1,4 @@
+from .base import *
+from .memory_recorder import *
+from .memmap_recorder import *
+from .compressed_recorder import *
@@ -0,0 +1,47 @@
+""" Interface to store piece positions of a simulation run for later playback """
+from abc import ABC, abstractmethod
+from typing import Dict, List
+
+import numpy as np
+
+
+class FrameRecorder(ABC):
+    """
+        Keep positions of every piece at every stride-th call to record
+        Frames are read back by index as a dictionary of piece name to vertices
+    """
+    def __init__(self, piece_names: List[str], stride: int = 1):
+        if stride < 1:
+            raise ValueError(f"Frame stride must be at least 1, got {stride}")
+
+        self.piece_names = list(piece_names)
+        self.stride = stride
+        self.nr_recorded_steps = 0
+
+    def record(self, positions: Dict[str, np.ndarray]):
+        """ Store positions if on a keyframe, positions are copied so can be modified afterwards """
+        if self.nr_recorded_steps % self.stride == 0:
+            self.write_frame(positions)
+        self.nr_recorded_steps += 1
+
+    @abstractmethod
+    def write_frame(self, positions: Dict[str, np.ndarray]):
+        """ Append positions as a new frame """
+
+    @property
+    @abstractmethod
+    def nr_frames(self) -> int:
+        """ Get number of stored frames """
+
+    @abstractmethod
+    def get_frame(self, i: int) -> Dict[str, np.ndarray]:
+        """ Get positions of each piece at frame i """
+
+    def get_step(self, i: int) -> int:
+        """ Get simulation step that frame i was recorded at """
+        return i * self.stride
+
+    def check_frame_index(self, i: int):
+        """ Raise if frame i has not been recorded """
+        if not 0 <= i < self.nr_frames:
+            raise IndexError(f"Frame {i} out of range of {self.nr_frames} recorded frames")
@@ -0,0 +1,154 @@
+""" Recorder storing float32 keyframes and quantized int16 deltas between consecutive frames """
+from bisect import bisect_right
+from typing import Dict, List
+
+import numpy as np
+
+from src.simulation.recording.base import FrameRecorder
+
+COMPRESSED_KEYFRAME_INTERVAL = 32  # Number of frames between float32 keyframes
+QUANTIZATION_LEVELS = 2 ** 12  # Number of quantization steps across largest side of piece bounding box
+INT16_LIMIT = np.iinfo(np.int16).max
+
+
+class CompressedFrameRecorder(FrameRecorder):
+    """
+        Every keyframe_interval frames a float32 keyframe is kept, frames in between are int16 deltas
+        Deltas count quantization steps of size bounding box side / quantization_levels of the piece at its keyframe
+        Deltas are taken from the quantized previous frame so errors do not accumulate,
+        every reconstructed vertex is within half a quantization step (plus float32 rounding) of the recorded position
+    """
+    def __init__(self, piece_names: List[str], stride: int = 1,
+                 keyframe_interval: int = COMPRESSED_KEYFRAME_INTERVAL,
+                 quantization_levels: int = QUANTIZATION_LEVELS):
+        super().__init__(piece_names, stride)
+        if keyframe_interval < 1:
+            raise ValueError(f"Keyframe interval must be at least 1, got {keyframe_interval}")
+
+        self.keyframe_interval = keyframe_interval
+        self.quantization_levels = quantization_levels
+        self.keyframes: List[Dict[str, np.ndarray]] = []
+        self.quantization_steps: List[Dict[str, float]] = []
+        self.deltas: List[Dict[str, np.ndarray]] = []
+        self.keyframe_starts: List[int] = []
+
+        self._quantized_offsets: Dict[str, np.ndarray] = {}
+
+    def write_keyframe(self, positions: Dict[str, np.ndarray]):
+        """ Start a new keyframe from exact positions """
+        keyframe = {k: positions[k].astype(np.float32) for k in self.piece_names}
+        self.keyframes.append(keyframe)
+        self.quantization_steps.append({
+            k: float(max(np.ptp(vertices, axis=0).max(), np.finfo(np.float32).eps)) / self.quantization_levels
+            for k, vertices in keyframe.items()
+        })
+        self.keyframe_starts.append(self.nr_frames)
+        self.deltas.append({k: np.zeros_like(vertices, dtype=np.int16) for k, vertices in keyframe.items()})
+        self._quantized_offsets = {k: np.zeros(vertices.shape, dtype=np.int64) for k, vertices in keyframe.items()}
+
+    def write_frame(self, positions: Dict[str, np.ndarray]):
+        """ Append positions as a delta to the last frame, or as a keyframe when due or when a delta overflows """
+        if not self.keyframes or self.nr_frames - self.keyframe_starts[-1] >= self.keyframe_interval:
+            self.write_keyframe(positions)
+            return
+
+        keyframe = self.keyframes[-1]
+        quantization_steps = self.quantization_steps[-1]
+        quantized_offsets = {}
+        deltas = {}
+        for key in self.piece_names:
+            offsets = np.rint((positions[key] - keyframe[key]) / quantization_steps[key]).astype(np.int64)
+            delta = offsets - self._quantized_offsets[key]
+            if np.abs(delta).max(initial=0) > INT16_LIMIT:
+                self.write_keyframe(positions)
+                return
+
+            quantized_offsets[key] = offsets
+            deltas[key] = delta.astype(np.int16)
+
+        self._quantized_offsets = quantized_offsets
+        self.deltas.append(deltas)
+
+    @property
+    def nr_frames(self) -> int:
+        """ Get number of stored frames """
+        return len(self.deltas)
+
+    @property
+    def error_bound(self) -> float:
+        """ Largest possible distance along any axis between a recorded and reconstructed vertex """
+        return max((step for steps in self.quantization_steps for step in steps.values()), default=0.) / 2
+
+    def get_frame(self, i: int) -> Dict[str, np.ndarray]:
+        """ Reconstruct positions at frame i from its keyframe and the deltas after it """
+        self.check_frame_index(i)
+        keyframe_ind = bisect_right(self.keyframe_starts, i) - 1
+        start = self.keyframe_starts[keyframe_ind]
+
+        frame = {}
+        for key in self.piece_names:
+            offsets = np.sum([self.deltas[j][key] for j in range(start, i + 1)], axis=0, dtype=np.int64)
+            frame[key] = (self.keyframes[keyframe_ind][key] +
+                          offsets * self.quantization_steps[keyframe_ind][key]).astype(np.float32)
+        return frame
+
+    @property
+    def nr_bytes(self) -> int:
+        """ Get number of bytes used by keyframes and deltas before file compression """
+        keyframe_bytes = sum(vertices.nbytes for keyframe in self.keyframes for vertices in keyframe.values())
+        delta_bytes = sum(delta.nbytes for deltas in self.deltas for delta in deltas.values())
+        return keyframe_bytes + delta_bytes
+
+    def save(self, path: str):
+        """ Write recording to compressed .npz file, a recording without frames is saved with empty arrays """
+        arrays = {
+            'stride': self.stride,
+            'keyframe_interval': self.keyframe_interval,
+            'quantization_levels': self.quantization_levels,
+            'nr_recorded_steps': self.nr_recorded_steps,
+            'keyframe_starts': np.array(self.keyframe_starts, dtype=np.int64),
+            'piece_names': np.array(self.piece_names),
+        }
+        for ind, key in enumerate(self.piece_names):
+            arrays[f'keyframes_{ind}'] = np.stack([keyframe[key] for keyframe in self.keyframes]) \
+                if self.keyframes else np.zeros((0, 0, 3), dtype=np.float32)
+            arrays[f'quantization_steps_{ind}'] = np.array([steps[key] for steps in self.quantization_steps],
+                                                           dtype=np.float64)
+            arrays[f'deltas_{ind}'] = np.stack([deltas[key] for deltas in self.deltas]) \
+                if self.deltas else np.zeros((0, 0, 3), dtype=np.int16)
+
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "CompressedFrameRecorder":
+        """ Read recording from .npz file written by save """
+        data = np.load(path)
+        piece_names = [str(name) for name in data['piece_names']]
+        recorder = cls(piece_names, int(data['stride']), int(data['keyframe_interval']),
+                       int(data['quantization_levels']))
+        recorder.nr_recorded_steps = int(data['nr_recorded_steps'])
+        recorder.keyframe_starts = data['keyframe_starts'].tolist()
+
+        keyframes = [data[f'keyframes_{ind}'] for ind in range(len(piece_names))]
+        quantization_steps = [data[f'quantization_steps_{ind}'] for ind in range(len(piece_names))]
+        deltas = [data[f'deltas_{ind}'] for ind in range(len(piece_names))]
+
+        nr_frames = len(deltas[0]) if piece_names else 0
+
+        recorder.keyframes = [
+            {key: keyframes[ind][j] for ind, key in enumerate(piece_names)}
+            for j in range(len(recorder.keyframe_starts))
+        ]
+        recorder.quantization_steps = [
+            {key: float(quantization_steps[ind][j]) for ind, key in enumerate(piece_names)}
+            for j in range(len(recorder.keyframe_starts))
+        ]
+        recorder.deltas = [
+            {key: deltas[ind][j] for ind, key in enumerate(piece_names)} for j in range(nr_frames)
+        ]
+        if recorder.keyframe_starts:
+            recorder._quantized_offsets = {
+                key: deltas[ind][recorder.keyframe_starts[-1]:].sum(axis=0, dtype=np.int64)
+                for ind, key in enumerate(piece_names)
+            }
+        return recorder
@@ -0,0 +1,133 @@
+""" Recorder streaming frames into a memory mapped file so resident memory does not grow with steps """
+from pathlib import Path
+from tempfile import mkstemp
+from typing import Dict, Optional
+import json
+import os
+
+import numpy as np
+
+from src.simulation.recording.base import FrameRecorder
+
+from src.parameters import CACHE_DIRECTORY
+
+MEMMAP_GROWTH_FACTOR = 2  # Multiple to increase frame capacity by when file is full
+
+
+class MemmapFrameRecorder(FrameRecorder):
+    """
+        Frames stored in one float32 file of shape (capacity, nr vertices of all pieces, 3)
+        Pieces are contiguous slices along the vertex axis and metadata is kept in a .json next to the file
+        Reading a frame returns views into the file that are only paged in when used
+        Without a path frames go to a temporary file in the cache directory that close removes,
+        a recording written to a given path belongs to the caller and is kept
+    """
+    def __init__(self, piece_sizes: Dict[str, int], nr_steps: int, stride: int = 1,
+                 path: Optional[str] = None, mode: str = 'w+', nr_frames: int = 0):
+        super().__init__(list(piece_sizes.keys()), stride)
+
+        self.piece_sizes = dict(piece_sizes)
+        self.piece_slices = {}
+        start = 0
+        for key, size in self.piece_sizes.items():
+            self.piece_slices[key] = slice(start, start + size)
+            start += size
+        self.nr_vertices = start
+
+        self.temporary = path is None
+        if self.temporary:
+            Path(CACHE_DIRECTORY).mkdir(parents=True, exist_ok=True)
+            file_descriptor, path = mkstemp(suffix='.frames', dir=CACHE_DIRECTORY)
+            os.close(file_descriptor)
+        self.path = str(path)
+
+        self.read_only = mode == 'r'
+        self._nr_frames = nr_frames
+        capacity = max(nr_frames, nr_steps // stride + 1)
+        self.memmap = np.memmap(self.path, dtype=np.float32, mode=mode, shape=(capacity, self.nr_vertices, 3))
+
+    @classmethod
+    def from_positions(cls, positions: Dict[str, np.ndarray], nr_steps: int, stride: int = 1,
+                       path: Optional[str] = None) -> "MemmapFrameRecorder":
+        """ Create empty recorder sized for pieces with given positions """
+        return cls({k: len(vertices) for k, vertices in positions.items()}, nr_steps, stride, path)
+
+    @classmethod
+    def open(cls, path: str) -> "MemmapFrameRecorder":
+        """ Open recording written to path for reading """
+        with open(cls.get_metadata_path(path), 'r', encoding='utf-8') as f:
+            metadata = json.load(f)
+
+        recorder = cls(metadata['piece_sizes'], 0, metadata['stride'], path, 'r', metadata['nr_frames'])
+        recorder.nr_recorded_steps = metadata['nr_recorded_steps']
+        return recorder
+
+    @staticmethod
+    def get_metadata_path(path: str) -> str:
+        """ Get path of .json holding piece sizes and frame count of a recording """
+        return str(Path(path).with_suffix('.json'))
+
+    @property
+    def capacity(self) -> int:
+        """ Get number of frames file can hold before it needs to grow """
+        return self.memmap.shape[0]
+
+    def grow(self):
+        """ Extend file so it can hold more frames """
+        new_capacity = max(1, self.capacity * MEMMAP_GROWTH_FACTOR)
+        self.memmap.flush()
+        del self.memmap
+
+        with open(self.path, 'r+b') as f:
+            f.truncate(new_capacity * self.nr_vertices * 3 * np.dtype(np.float32).itemsize)
+        self.memmap = np.memmap(self.path, dtype=np.float32, mode='r+', shape=(new_capacity, self.nr_vertices, 3))
+
+    def write_frame(self, positions: Dict[str, np.ndarray]):
+        """ Write positions into next frame of file """
+        if self.read_only:
+            raise ValueError(f"Recording {self.path} was opened read only")
+        if self._nr_frames == self.capacity:
+            self.grow()
+
+        frame = self.memmap[self._nr_frames]
+        for key, piece_slice in self.piece_slices.items():
+            frame[piece_slice] = positions[key]
+        self._nr_frames += 1
+
+    @property
+    def nr_frames(self) -> int:
+        """ Get number of stored frames """
+        return self._nr_frames
+
+    def get_frame(self, i: int) -> Dict[str, np.ndarray]:
+        """ Get views of positions of each piece at frame i """
+        self.check_frame_index(i)
+        frame = self.memmap[i]
+        return {key: frame[piece_slice] for key, piece_slice in self.piece_slices.items()}
+
+    def flush(self):
+        """ Write pending frames and metadata to disk so the recording can be opened later """
+        if self.read_only:
+            return
+
+        self.memmap.flush()
+        metadata = {
+            'piece_sizes': self.piece_sizes,
+            'stride': self.stride,
+            'nr_frames': self._nr_frames,
+            'nr_recorded_steps': self.nr_recorded_steps,
+        }
+        with open(self.get_metadata_path(self.path), 'w', encoding='utf-8') as f:
+            json.dump(metadata, f)
+
+    def close(self):
+        """ Release file, removing it and its metadata if it is a temporary recording """
+        if self.memmap is None:
+            return
+
+        if not self.temporary:
+            self.flush()
+        self.memmap = None
+        if self.temporary:
+            for path in (self.path, self.get_metadata_path(self.path)):
+                Path(path).unlink(missing_ok=True)
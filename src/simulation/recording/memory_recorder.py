@@ -0,0 +1,27 @@
+""" Recorder keeping every frame as copied arrays in memory """
+from typing import Dict, List
+
+import numpy as np
+
+from src.simulation.recording.base import FrameRecorder
+
+
+class MemoryFrameRecorder(FrameRecorder):
+    """ Simple list of frames, memory grows with number of frames times number of vertices """
+    def __init__(self, piece_names: List[str], stride: int = 1):
+        super().__init__(piece_names, stride)
+        self.frames = []
+
+    def write_frame(self, positions: Dict[str, np.ndarray]):
+        """ Append copy of positions as a new frame """
+        self.frames.append({k: positions[k].copy() for k in self.piece_names})
+
+    @property
+    def nr_frames(self) -> int:
+        """ Get number of stored frames """
+        return len(self.frames)
+
+    def get_frame(self, i: int) -> Dict[str, np.ndarray]:
+        """ Get positions of each piece at frame i """
+        self.check_frame_index(i)
+        return self.frames[i]
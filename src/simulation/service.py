@@ -0,0 +1,335 @@
+""" Long running local service keeping avatars and their collision structures loaded between simulation jobs """
+from collections import OrderedDict
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from queue import Queue
+from threading import Event, Lock, Thread
+from time import perf_counter
+from typing import Dict, NamedTuple, Optional, Tuple
+from uuid import uuid4
+import json
+import sys
+import traceback
+
+import numpy as np
+
+from src.utils.read_obj import parse_obj
+from src.simulation.mesh import MeshData
+from src.simulation.collision import BodyBoxHierarchy, SignedDistanceField, get_signed_distance_field
+from src.simulation.simulation import FabricSimulation, COLLISION_BACKENDS
+from src.simulation.backends.registry import COMPUTE_BACKENDS
+from src.simulation.recording import MemoryFrameRecorder
+from src.simulation.config import SimulationConfig
+from src.simulation.setup.setup_cache import get_all_piece_vertices
+
+from src.parameters import AVATAR_SCALING, NR_STEPS, COLLISION_BACKEND
+
+SERVICE_HOST = '127.0.0.1'  # Only listen locally, jobs are trusted input
+SERVICE_PORT = 8765  # Port the service listens on by default
+SERVICE_MAX_RESULTS = 64  # Finished jobs kept for collection, oldest are forgotten first
+NPZ_CONTENT_TYPE = 'application/octet-stream'
+SERVICE_SIMULATION_OPTIONS: Dict[str, tuple] = {  # FabricSimulation keywords a job may set and values they accept
+    'packed': (True, False),
+    'broad_phase': (True, False),
+    'sleeping': (True, False),
+    'collision_backend': COLLISION_BACKENDS,
+    'backend': tuple(COMPUTE_BACKENDS),
+}
+
+
+class ResidentAvatar(NamedTuple):
+    """ Scaled avatar mesh with every structure collision and setup query, built once when the service starts """
+    mesh: MeshData
+    broad_phase: BodyBoxHierarchy
+    sdf: Optional[SignedDistanceField]
+
+    @classmethod
+    def load(cls, obj_path: str, annotation_path: str, with_sdf: bool = True) -> "ResidentAvatar":
+        """ Parse and scale avatar and build its lazy structures so the first job does not pay for them """
+        body = parse_obj(obj_path, annotation_path)
+        body.scale_vertices(AVATAR_SCALING)
+
+        trimesh = body.trimesh
+        trimesh.contains(trimesh.vertices[:1])  # Builds ray caster
+        _ = body.face_ring
+        if body.annotations:
+            body.get_closest_surface(np.array(list(body.annotations.values())))  # Builds nearest query tree
+
+        sdf = get_signed_distance_field(body, AVATAR_SCALING) if with_sdf else None
+        return cls(body, BodyBoxHierarchy.from_trimesh(trimesh), sdf)
+
+
+class ServiceJob(NamedTuple):
+    """ Garment sent to the service, simulation holds keyword arguments of FabricSimulation and config overrides """
+    id: str
+    pattern: dict
+    avatar: str
+    nr_steps: int = NR_STEPS
+    until_converged: bool = False
+    simulation: dict = {}
+    config: dict = {}
+
+    @classmethod
+    def from_request(cls, request: dict, avatars: Dict[str, ResidentAvatar]) -> "ServiceJob":
+        """
+            Read job from a request of the form {"pattern": dict, optional "avatar", "nr_steps", "until_converged",
+            "simulation" and "config"}, avatar can be left out when the service has only one
+        """
+        if not isinstance(request, dict) or not isinstance(request.get("pattern"), dict):
+            raise ValueError("Job needs a pattern object")
+
+        unknown = set(request) - set(cls._fields[1:])
+        if unknown:
+            raise ValueError(f"Unknown job fields {sorted(unknown)}, expected some of {list(cls._fields[1:])}")
+
+        if "avatar" not in request and len(avatars) == 1:
+            request = {**request, "avatar": next(iter(avatars))}
+        if request.get("avatar") not in avatars:
+            raise ValueError(f"Avatar {request.get('avatar')} not one of {list(avatars)}")
+
+        nr_steps = request.get("nr_steps", NR_STEPS)
+        if type(nr_steps) is not int or nr_steps < 1:
+            raise ValueError(f"Number of steps must be a positive integer, got {nr_steps!r}")
+        if type(request.get("until_converged", False)) is not bool:
+            raise ValueError(f"Until converged must be true or false, got {request['until_converged']!r}")
+
+        cls.check_simulation_options(request.get("simulation", {}))
+        if not isinstance(request.get("config", {}), dict):
+            raise ValueError("Config must be an object of simulation parameters")
+        SimulationConfig.from_dict(request.get("config", {}))
+        return cls(uuid4().hex, **request)
+
+    @staticmethod
+    def check_simulation_options(simulation: dict):
+        """ Raise ValueError unless every option is a FabricSimulation keyword jobs may set with an accepted value """
+        if not isinstance(simulation, dict):
+            raise ValueError("Simulation must be an object of FabricSimulation options")
+
+        unknown = set(simulation) - set(SERVICE_SIMULATION_OPTIONS)
+        if unknown:
+            raise ValueError(f"Unknown simulation options {sorted(unknown)}, "
+                             f"expected some of {list(SERVICE_SIMULATION_OPTIONS)}")
+
+        for key, value in simulation.items():
+            options = SERVICE_SIMULATION_OPTIONS[key]
+            if type(value) is not type(options[0]) or value not in options:
+                raise ValueError(f"Simulation option {key} must be one of {list(options)}, got {value!r}")
+
+    @property
+    def collision_backend(self) -> str:
+        """ Get collision backend the job simulates with """
+        return self.simulation.get('collision_backend', COLLISION_BACKEND)
+
+
+class JobRecord:
+    """ State of a job from queued to finished, done is set once positions or an error are available """
+    def __init__(self, job: ServiceJob):
+        self.job = job
+        self.status = 'queued'
+        self.metrics: dict = {'id': job.id}
+        self.positions: Optional[Dict[str, np.ndarray]] = None
+        self.done = Event()
+
+    def to_dict(self) -> dict:
+        """ Status and metrics of job that can be sent as json """
+        return {**self.metrics, 'status': self.status}
+
+
+def run_service_job(job: ServiceJob, avatar: ResidentAvatar) -> Tuple[Dict[str, np.ndarray], dict]:
+    """
+        Simulate job on a resident avatar and return final positions of every piece and metrics
+        Pieces come from the setup cache, so repeated previews of a garment skip extraction
+    """
+    metrics = {}
+    start = perf_counter()
+    config = SimulationConfig.from_dict(job.config)
+    pieces, sewing_constraints = get_all_piece_vertices(job.pattern, avatar.mesh, config=config)
+    metrics['setup_seconds'] = perf_counter() - start
+
+    if job.collision_backend == 'sdf' and avatar.sdf is None:
+        raise ValueError(f"Avatar {job.avatar} was loaded without a signed distance field")
+
+    start = perf_counter()
+    simulation = FabricSimulation(avatar.mesh, pieces, sewing_constraints,
+                                  recorder=MemoryFrameRecorder(list(pieces), job.nr_steps),
+                                  body_sdf=avatar.sdf, body_broad_phase=avatar.broad_phase, **job.simulation)
+    if job.until_converged:
+        report = simulation.run_until_converged(job.nr_steps, logging=False)
+        metrics.update(converged=report.converged, nr_steps=report.nr_steps, reason=report.reason)
+    else:
+        simulation.step(job.nr_steps, logging=False)
+        metrics['nr_steps'] = job.nr_steps
+    metrics['simulation_seconds'] = perf_counter() - start
+
+    positions = {key: piece.mesh.vertices_3d.copy() for key, piece in pieces.items()}
+    metrics['nr_vertices'] = sum(len(vertices) for vertices in positions.values())
+    metrics['max_sewing_gap'] = max((
+        sewing_pair.get_max_gap(positions[sewing_pair.from_piece], positions[sewing_pair.to_piece])
+        for sewing_pair in sewing_constraints
+    ), default=0.)
+    return positions, metrics
+
+
+def encode_positions(positions: Dict[str, np.ndarray]) -> bytes:
+    """ Final vertices of every piece as an uncompressed .npz archive, readable with np.load """
+    buffer = BytesIO()
+    np.savez(buffer, **positions)
+    return buffer.getvalue()
+
+
+class SimulationService:
+    """
+        Holds resident avatars and a queue of jobs run one at a time by a worker thread,
+        so jobs never share avatar caches and requests only wait on their own job
+        Finished jobs are kept until SERVICE_MAX_RESULTS newer ones have finished
+    """
+    def __init__(self, avatars: Dict[str, ResidentAvatar], max_results: int = SERVICE_MAX_RESULTS):
+        self.avatars = avatars
+        self.max_results = max_results
+        self.queue: "Queue[Optional[JobRecord]]" = Queue()
+        self.records: "OrderedDict[str, JobRecord]" = OrderedDict()
+        self.lock = Lock()
+        self.worker = Thread(target=self.run_worker, daemon=True)
+        self.worker.start()
+
+    def submit(self, request: dict) -> JobRecord:
+        """ Validate and queue a job, raises ValueError for a malformed request """
+        record = JobRecord(ServiceJob.from_request(request, self.avatars))
+        with self.lock:
+            self.records[record.job.id] = record
+        self.queue.put(record)
+        return record
+
+    def get_record(self, job_id: str) -> Optional[JobRecord]:
+        """ Get job by id or None if unknown or forgotten """
+        with self.lock:
+            return self.records.get(job_id)
+
+    def forget_old_records(self):
+        """ Drop oldest finished jobs above the number of results kept """
+        with self.lock:
+            finished = [job_id for job_id, record in self.records.items() if record.done.is_set()]
+            for job_id in finished[:max(len(finished) - self.max_results, 0)]:
+                del self.records[job_id]
+
+    def run_worker(self):
+        """ Run queued jobs in order until None is queued """
+        while (record := self.queue.get()) is not None:
+            record.status = 'running'
+            try:
+                record.positions, metrics = run_service_job(record.job, self.avatars[record.job.avatar])
+                record.metrics.update(metrics)
+                record.status = 'done'
+            except Exception:  # One failing garment should not stop the service
+                record.metrics['error'] = traceback.format_exc()
+                record.status = 'failed'
+            record.done.set()
+
+            status = 'failed' if record.status == 'failed' else f"{record.metrics['simulation_seconds']:.3}s"
+            print(f"Finished job {record.job.id} {status}")
+            self.forget_old_records()
+
+    def stop(self):
+        """ Let worker finish queued jobs and exit """
+        self.queue.put(None)
+        self.worker.join()
+
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    """
+        GET /avatars lists avatar names
+        POST /jobs queues a job and returns its id, GET /jobs/<id> returns its status and metrics
+        GET /jobs/<id>/vertices returns final vertices as .npz once done
+        POST /simulate queues a job and waits for it, returning .npz vertices with metrics in a header
+    """
+    service: SimulationService
+
+    def send_json(self, status: HTTPStatus, body: dict):
+        """ Reply with a json body """
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_positions(self, record: JobRecord):
+        """ Reply with .npz vertices of a finished job, or its error if it failed """
+        if record.status == 'failed':
+            self.send_json(HTTPStatus.INTERNAL_SERVER_ERROR, record.to_dict())
+            return
+
+        data = encode_positions(record.positions)
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', NPZ_CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('X-Simulation-Metrics', json.dumps(record.to_dict()))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_job(self) -> Optional[JobRecord]:
+        """ Queue job in request body, replying with an error and returning None if it is malformed """
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            return self.service.submit(json.loads(self.rfile.read(length)))
+        except ValueError as error:  # Includes json decode errors
+            self.send_json(HTTPStatus.BAD_REQUEST, {'error': str(error)})
+            return None
+
+    def do_GET(self):
+        """ Get avatars, job status or job vertices """
+        parts = self.path.strip('/').split('/')
+        if parts == ['avatars']:
+            self.send_json(HTTPStatus.OK, {'avatars': list(self.service.avatars)})
+            return
+
+        record = self.service.get_record(parts[1]) if len(parts) in (2, 3) and parts[0] == 'jobs' else None
+        if record is None or (len(parts) == 3 and parts[2] != 'vertices'):
+            self.send_json(HTTPStatus.NOT_FOUND, {'error': f"Unknown path {self.path}"})
+        elif len(parts) == 2:
+            self.send_json(HTTPStatus.OK, record.to_dict())
+        elif not record.done.is_set():
+            self.send_json(HTTPStatus.CONFLICT, record.to_dict())
+        else:
+            self.send_positions(record)
+
+    def do_POST(self):
+        """ Queue a job, waiting for it when simulating """
+        if self.path not in ('/jobs', '/simulate'):
+            self.send_json(HTTPStatus.NOT_FOUND, {'error': f"Unknown path {self.path}"})
+            return
+
+        if (record := self.read_job()) is None:
+            return
+
+        if self.path == '/jobs':
+            self.send_json(HTTPStatus.ACCEPTED, record.to_dict())
+        else:
+            record.done.wait()
+            self.send_positions(record)
+
+    def log_message(self, *args):
+        """ Keep request logging off the console, jobs are reported by the worker """
+
+
+def serve(avatars: Dict[str, ResidentAvatar], host: str = SERVICE_HOST, port: int = SERVICE_PORT):
+    """ Serve jobs on avatars until interrupted """
+    service = SimulationService(avatars)
+    handler = type('Handler', (ServiceRequestHandler,), {'service': service})
+
+    with ThreadingHTTPServer((host, port), handler) as server:
+        print(f"Simulation service listening on http://{host}:{port} with avatars {list(avatars)}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            service.stop()
+
+
+if __name__ == '__main__':
+    start = perf_counter()
+    resident_avatars = {'default': ResidentAvatar.load('./assets/BodyMesh.obj', './assets/BodyAnnotations.json')}
+    print(f'Time taken to load avatars = {perf_counter() - start:.3}')
+    serve(resident_avatars, port=int(sys.argv[1]) if len(sys.argv) > 1 else SERVICE_PORT)
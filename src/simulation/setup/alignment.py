@@ -1,17 +1,18 @@
 """ Functions that deal with aligning a mesh to target points on another mesh """
-from typing import Optional
+from typing import Dict, Optional
 
 import numpy as np
 
 from src.simulation.piece_physics import DynamicPiece
 from src.simulation.mesh import MeshData
-from src.utils.geometry import get_alignment_matrix, get_closest_normal_on_mesh
+from src.utils.geometry import get_alignment_matrix
 
 from src.parameters import DISTANCE_FROM_BODY
 Z_VECTOR = np.array([0, 0, 1], dtype=np.float64)  # Always normal to 2d piece
 
 
-def offset_piece_to_snap_point(piece: DynamicPiece, body_mesh: MeshData) -> Optional[np.ndarray]:
+def offset_piece_to_snap_point(piece: DynamicPiece, body_mesh: MeshData,
+                               distance_from_body: float = DISTANCE_FROM_BODY) -> Optional[np.ndarray]:
     """ Move piece snap-point to body snap-point, return None if snap point undefined """
     snap_point_name = piece.snap_point_name
     piece_snap_point = piece.snap_point
@@ -21,8 +22,7 @@ def offset_piece_to_snap_point(piece: DynamicPiece, body_mesh: MeshData) -> Opti
         print(f"Body does not contain snap-point {snap_point_name}")
         return None
 
-    offset_target, _ = get_closest_normal_on_mesh(body_mesh.trimesh, body_snap_point,
-                                                  DISTANCE_FROM_BODY)
+    offset_target, _ = body_mesh.get_closest_normal(body_snap_point, distance_from_body)
 
     offset = offset_target - piece_snap_point
     piece.mesh.offset_vertices(offset)
@@ -31,7 +31,8 @@ def offset_piece_to_snap_point(piece: DynamicPiece, body_mesh: MeshData) -> Opti
 
 
 def rotate_point_to_alignment(piece: DynamicPiece, body_mesh: MeshData,
-                              snap_point: np.ndarray) -> Optional[np.ndarray]:
+                              snap_point: np.ndarray,
+                              distance_from_body: float = DISTANCE_FROM_BODY) -> Optional[np.ndarray]:
     """ Use alignment points to rotate alignment """
     align_point_name = piece.alignment_point_name
     piece_align_point = piece.alignment_point
@@ -41,8 +42,7 @@ def rotate_point_to_alignment(piece: DynamicPiece, body_mesh: MeshData,
         print(f"Body does not contain align-point {align_point_name}")
         return None
 
-    align_target, normal_to_surface = get_closest_normal_on_mesh(body_mesh.trimesh, body_align_point,
-                                                                 DISTANCE_FROM_BODY)
+    align_target, normal_to_surface = body_mesh.get_closest_normal(body_align_point, distance_from_body)
     body_align_vector = align_target - snap_point
     if np.linalg.norm(body_align_vector) == 0.:
         print(f"Alignment vector has zero distance {align_point_name}")
@@ -59,9 +59,25 @@ def rotate_point_to_alignment(piece: DynamicPiece, body_mesh: MeshData,
     return rotation_matrix
 
 
-def snap_and_align_piece_to_body(piece: DynamicPiece, body_mesh: MeshData):
+def snap_and_align_piece_to_body(piece: DynamicPiece, body_mesh: MeshData,
+                                 distance_from_body: float = DISTANCE_FROM_BODY):
     """ Snap piece so that piece point matches body plus some buffer zone """
-    if (snap_point := offset_piece_to_snap_point(piece, body_mesh)) is None:
+    if (snap_point := offset_piece_to_snap_point(piece, body_mesh, distance_from_body)) is None:
         return
 
-    rotate_point_to_alignment(piece, body_mesh, snap_point)
+    rotate_point_to_alignment(piece, body_mesh, snap_point, distance_from_body)
+
+
+def align_all_pieces_to_body(pieces: Dict[str, DynamicPiece], body_mesh: MeshData,
+                             distance_from_body: float = DISTANCE_FROM_BODY):
+    """ Resolve body surface at every snap and alignment point in one query, then snap and align each piece """
+    body_points = [
+        body_mesh.get_annotation(name) for piece in pieces.values()
+        for name in (piece.snap_point_name, piece.alignment_point_name)
+        if body_mesh.get_annotation(name) is not None
+    ]
+    if body_points:
+        body_mesh.get_closest_surface(np.array(body_points))
+
+    for piece in pieces.values():
+        snap_and_align_piece_to_body(piece, body_mesh, distance_from_body)
@@ -5,9 +5,9 @@ import numpy as np
 
 from src.simulation.piece_physics import DynamicPiece
 from src.simulation.mesh import MeshData
-from src.utils.geometry import (get_closest_normal_on_mesh, get_each_point_distance_to_3d_line,
+from src.utils.geometry import (get_each_point_distance_to_3d_line,
                                 get_closest_line_origin_for_each_point, get_projections_onto_line_origins,
-                                RotationPlaneData, get_bend_round_line_adjustment)
+                                RotationPlaneData, get_bend_round_line_adjustments)
 
 from src.parameters import WRAP_RADIANS
 
@@ -15,7 +15,7 @@ from src.parameters import WRAP_RADIANS
 def get_perpedicular_alignment_along_piece(body_mesh: MeshData, piece: DynamicPiece,
                                            align_vector: np.ndarray) -> Optional[np.ndarray]:
     """ Get vector perpendicular to alignment and normal on body at snap-point """
-    _, normal_at_snap = get_closest_normal_on_mesh(body_mesh.trimesh, piece.snap_point)
+    _, normal_at_snap = body_mesh.get_closest_normal(piece.snap_point)
     vector_along_piece = np.cross(normal_at_snap, align_vector)
     vector_along_distance = np.linalg.norm(vector_along_piece)
 
@@ -68,22 +68,49 @@ def get_positive_and_negative_bend_indices(
     return postive_sorted_query_inds, negative_sorted_query_inds
 
 
-def rotate_query_points_on_plane(origin_point: np.ndarray, query_inds: np.ndarray,
-                                 vertices_3d: np.ndarray, rotate_calculate: RotationPlaneData):
-    """ Rotate each point (operation done in place) on line on plane preserving distance """
-    running_total_adjustment = np.zeros(3, dtype=np.float64)
-    last_point = origin_point
-    for query_ind in query_inds:
-        vertices_3d[query_ind] += running_total_adjustment
-        adjustment = get_bend_round_line_adjustment(
-            vertices_3d[query_ind], last_point, rotate_calculate
+def get_chains_of_points(origin_inds: np.ndarray, sorted_query_inds: np.ndarray) -> np.ndarray:
+    """
+        Group query indices (already in bend order) by their line origin into rows of a padded matrix
+        Row i is the chain of points bent from origin i, padded with -1 after its last point
+    """
+    nr_origins = int(origin_inds.max(initial=-1)) + 1
+    chain_order = np.argsort(origin_inds, kind='stable')
+    chain_origins = origin_inds[chain_order]
+
+    chain_lengths = np.bincount(chain_origins, minlength=nr_origins)
+    chain_starts = np.cumsum(chain_lengths) - chain_lengths
+    positions_in_chain = np.arange(len(chain_origins)) - chain_starts[chain_origins]
+
+    chains = np.full((nr_origins, chain_lengths.max(initial=0)), -1, dtype=np.int64)
+    chains[chain_origins, positions_in_chain] = sorted_query_inds[chain_order]
+    return chains
+
+
+def rotate_chains_on_plane(origin_points: np.ndarray, chains: np.ndarray,
+                           vertices_3d: np.ndarray, theta: float, line_vector: np.ndarray):
+    """
+        Rotate each point of every chain (operation done in place) on plane preserving distance to previous point
+        Points are dependent along a chain so one step moves the next point of every chain at once
+    """
+    running_total_adjustment = np.zeros((len(chains), 3), dtype=np.float64)
+    last_points = origin_points.copy()
+
+    for step_inds in chains.T:
+        is_active = step_inds >= 0
+        query_inds = step_inds[is_active]
+
+        vertices_3d[query_inds] += running_total_adjustment[is_active]
+        rotate_calculate = RotationPlaneData(np.cos(theta), np.sin(theta), origin_points[is_active], line_vector)
+        adjustments = get_bend_round_line_adjustments(
+            vertices_3d[query_inds], last_points[is_active], rotate_calculate
         )
-        vertices_3d[query_ind] += adjustment
-        running_total_adjustment += adjustment
-        last_point = vertices_3d[query_ind]
+        vertices_3d[query_inds] += adjustments
+        running_total_adjustment[is_active] += adjustments
+        last_points[is_active] = vertices_3d[query_inds]
 
 
-def bend_piece_over_body(piece: DynamicPiece, body_mesh: MeshData, threshold: float) -> np.ndarray:
+def bend_piece_over_body(piece: DynamicPiece, body_mesh: MeshData, threshold: float,
+                         wrap_radians: float = WRAP_RADIANS) -> np.ndarray:
     """
         Use closest point on body and gravity to get a better initialisation for sleeve
         Generic way of doing this is to associate each point with a bone line
@@ -122,19 +149,13 @@ def bend_piece_over_body(piece: DynamicPiece, body_mesh: MeshData, threshold: fl
             on_line_mask, bend_projections_sort_inds, bend_positive_postive_ind
         )
 
-    for i, origin_point in enumerate(line_points):
-        query_points_mask = bend_to_line_point_inds_sorted[bend_positive_postive_ind:] == i
-        query_inds_to_adjust = postive_sorted_query_inds[query_points_mask]
-        rotate_calculate = RotationPlaneData(np.cos(-WRAP_RADIANS), np.sin(-WRAP_RADIANS),
-                                             origin_point, align_vector)
-
-        rotate_query_points_on_plane(origin_point, query_inds_to_adjust,
-                                     vertices_3d, rotate_calculate)
-
-        query_points_mask = bend_to_line_point_inds_sorted[:bend_positive_postive_ind] == i
-        query_inds_to_adjust = negative_sorted_query_inds[query_points_mask]
-        rotate_calculate = RotationPlaneData(np.cos(WRAP_RADIANS), np.sin(WRAP_RADIANS),
-                                             origin_point, align_vector)
+    positive_chains = get_chains_of_points(bend_to_line_point_inds_sorted[bend_positive_postive_ind:],
+                                           postive_sorted_query_inds)
+    rotate_chains_on_plane(line_points[:len(positive_chains)], positive_chains,
+                           vertices_3d, -wrap_radians, align_vector)
 
-        rotate_query_points_on_plane(origin_point, query_inds_to_adjust[::-1],
-                                     vertices_3d, rotate_calculate)
+    # Negative side bends outwards from the line so in order of decreasing projection
+    negative_chains = get_chains_of_points(bend_to_line_point_inds_sorted[:bend_positive_postive_ind][::-1],
+                                           negative_sorted_query_inds[::-1])
+    rotate_chains_on_plane(line_points[:len(negative_chains)], negative_chains,
+                           vertices_3d, wrap_radians, align_vector)
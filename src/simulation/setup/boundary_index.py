@@ -0,0 +1,39 @@
+""" Index of vertices on the boundary of a piece grid for fast lookup of points on its contour """
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+class BoundaryIndex:
+    """
+        Vertices of a piece with at least one grid neighbour (including diagonals) outside the contour
+        with a KD-tree over their positions, so closest boundary vertices are O(log n) lookups
+    """
+    def __init__(self, vertex_ids: np.ndarray, positions: np.ndarray):
+        self.vertex_ids = vertex_ids
+        self.positions = positions
+        self.tree = cKDTree(self.positions)
+
+    @classmethod
+    def from_grid(cls, grid_indices: np.ndarray, vertices_2d: np.ndarray) -> "BoundaryIndex":
+        """ Find boundary of grid of 1-based vertex indices (0 outside) """
+        padded = np.pad(grid_indices, 1)
+        nr_rows, nr_cols = grid_indices.shape
+        all_neighbours_inside = np.ones(grid_indices.shape, dtype=bool)
+        for row_offset in (-1, 0, 1):
+            for col_offset in (-1, 0, 1):
+                neighbour = padded[1 + row_offset:1 + row_offset + nr_rows, 1 + col_offset:1 + col_offset + nr_cols]
+                all_neighbours_inside &= neighbour > 0
+
+        is_boundary = (grid_indices > 0) & ~all_neighbours_inside
+        vertex_ids = grid_indices[is_boundary].astype(np.int64) - 1
+        return cls(vertex_ids, vertices_2d[vertex_ids].astype(np.float64))
+
+    @property
+    def nr_vertices(self) -> int:
+        """ Get number of boundary vertices """
+        return len(self.vertex_ids)
+
+    def get_closest_vertices(self, points: np.ndarray) -> np.ndarray:
+        """ Vertex index of the closest boundary vertex to each 2d point """
+        _, nearest = self.tree.query(points)
+        return self.vertex_ids[nearest].astype(np.uint32)
@@ -1,83 +1,94 @@
 """ Convert contours of clothing to grid of points """
-from typing import List, Optional, Dict, Tuple
+from typing import Optional, Dict, Tuple
 
 import numpy as np
-from shapely.geometry import Polygon, Point
+import shapely
+from shapely.geometry import Polygon
 
 from src.utils.file_io import read_json
 from src.utils.geometry import length_along_contour, points_along_contour
 from src.utils.read_obj import parse_obj
 
+from src.simulation.common import PieceGrid
 from src.simulation.mesh import MeshData, get_annotation_dict_from_piece_data
-from src.simulation.setup.alignment import snap_and_align_piece_to_body
+from src.simulation.setup.alignment import align_all_pieces_to_body
 from src.simulation.setup.vertex_relationships import VertexRelations
+from src.simulation.setup.boundary_index import BoundaryIndex
 from src.simulation.setup.bend_piece_over_body import bend_piece_over_body
 from src.simulation.piece_physics import DynamicPiece
 from src.simulation.sewing_constraints import SewingPairRelations, SewingConstraints
+from src.simulation.config import SimulationConfig, DEFAULT_CONFIG
 
 from src.parameters import VERTEX_RESOLUTION, CM_PER_M, SEWING_SPACING, AVATAR_SCALING
 
 
-def extract_grid(piece_data: dict) -> List[List[Optional[np.ndarray]]]:
-    """ Extract all points of inside shape contour in a grid, non-existent points are None """
+def extract_grid(piece_data: dict, resolution: float = VERTEX_RESOLUTION) -> PieceGrid:
+    """ Extract grid coordinates and mask of points inside shape contour """
     (min_x, min_y), (max_x, max_y) = piece_data["bounding_box"]
-    x_range = np.linspace(min_x, max_x, int(np.ceil((max_x - min_x) / VERTEX_RESOLUTION)))
-    y_range = np.linspace(min_y, max_y, int(np.ceil((max_x - min_x) / VERTEX_RESOLUTION)))
-    all_rows = []
+    x_range = np.linspace(min_x, max_x, int(np.ceil((max_x - min_x) / resolution)))
+    y_range = np.linspace(min_y, max_y, int(np.ceil((max_x - min_x) / resolution)))
 
     polygon = Polygon(piece_data["contour"])
+    shapely.prepare(polygon)
+    grid_x, grid_y = np.meshgrid(x_range, y_range)
+    inside_mask = shapely.contains_xy(polygon, grid_x, grid_y)
 
-    for y in y_range:
-        row = []
+    return PieceGrid(x_range, y_range, inside_mask)
 
-        for x in x_range:
-            point = Point(x, y)
-            if polygon.contains(point):
-                row.append(np.array([x, y], dtype=np.float32))
-            else:
-                row.append(None)
 
-        all_rows.append(row)
+def get_grid_vertex_indices(inside_mask: np.ndarray) -> np.ndarray:
+    """ Number points inside mask from 1 in row-major order, points outside are 0 """
+    vertex_indices = np.zeros(inside_mask.shape, dtype=np.int32)
+    vertex_indices[inside_mask] = np.arange(1, np.count_nonzero(inside_mask) + 1, dtype=np.int32)
+    return vertex_indices
 
-    return all_rows
 
+def get_neighbour_indices(grid_indices: np.ndarray, row_offset: int, col_offset: int) -> np.ndarray:
+    """ Grid index of neighbour at offset of every grid point, 0 where neighbour is outside grid """
+    nr_rows, nr_cols = grid_indices.shape
+    padded = np.pad(grid_indices, 1)
+    return padded[1 + row_offset:1 + row_offset + nr_rows, 1 + col_offset:1 + col_offset + nr_cols]
 
-def convert_rows_of_vertices_into_triangles(vertices_by_line: List[List[Optional[np.ndarray]]],
-                                            piece_data: dict) -> Tuple[MeshData, np.ndarray]:
+
+def select_grid_relations(candidates: list, exists: list) -> np.ndarray:
+    """
+        Stack candidate relations of every grid point and keep the ones that exist
+        Order is row-major over grid points, then order of candidates at each point
+    """
+    stacked_candidates = np.stack([np.stack(candidate, axis=-1) for candidate in candidates], axis=2)
+    return (stacked_candidates[np.stack(exists, axis=2)] - 1).astype(np.uint32)
+
+
+def convert_rows_of_vertices_into_triangles(grid: PieceGrid, piece_data: dict) -> Tuple[MeshData, np.ndarray]:
     """
         Get 3d drawing information from a grid of points inside the contour\
         Return a mesh and the index relationship between a piece and its
     """
-    vertex_data = []
-    faces = []
-    # ToDo - Extract getting vertex indices into its own method
-    next_vertex_data_ind = np.int32(0)
-    vertex_indices = np.zeros((len(vertices_by_line), len(vertices_by_line[0])), dtype=np.int32)
+    vertex_indices = get_grid_vertex_indices(grid.inside_mask)
+    rows, cols = np.nonzero(grid.inside_mask)
 
     (min_x, min_y), (max_x, max_y) = piece_data["bounding_box"]
     width = max_x - min_x
     height = max_y - min_y
 
-    for i, row in enumerate(vertices_by_line):
-        for j, vertex in enumerate(row):
-            if vertex is None:
-                continue
-            vertex_row = [vertex[0], vertex[1], 0., vertex[0] / width, vertex[1] / height, 0., 0., 1.]
-
-            next_vertex_data_ind += 1
-            vertex_data.append(vertex_row)
-            vertex_indices[i][j] = next_vertex_data_ind
-
-            if i > 0 and j > 0:
-                lower_left = vertex_indices[i - 1, j - 1]
-                lower_right = vertex_indices[i - 1, j]
-                upper_left = vertex_indices[i, j - 1]
-
-                if lower_left and upper_left:
-                    faces.append([next_vertex_data_ind - 1, upper_left - 1, lower_left - 1])
-
-                if lower_left and lower_right:
-                    faces.append([lower_right - 1, next_vertex_data_ind - 1, lower_left - 1])
+    x = grid.x_range.astype(np.float32)[cols]
+    y = grid.y_range.astype(np.float32)[rows]
+    vertex_data = np.zeros((len(x), 8), dtype=np.float32)
+    vertex_data[:, 0] = x
+    vertex_data[:, 1] = y
+    vertex_data[:, 3] = x / width
+    vertex_data[:, 4] = y / height
+    vertex_data[:, 7] = 1.
+
+    current = vertex_indices
+    lower_left = get_neighbour_indices(vertex_indices, -1, -1)
+    lower_right = get_neighbour_indices(vertex_indices, -1, 0)
+    upper_left = get_neighbour_indices(vertex_indices, 0, -1)
+
+    faces = select_grid_relations(
+        [(current, upper_left, lower_left), (lower_right, current, lower_left)],
+        [(current > 0) & (lower_left > 0) & (upper_left > 0), (current > 0) & (lower_left > 0) & (lower_right > 0)]
+    )
 
     # Material data is just a single color for now
     texture_data = {
@@ -89,8 +100,8 @@ def convert_rows_of_vertices_into_triangles(vertices_by_line: List[List[Optional
     )
 
     mesh = MeshData(
-        np.array(vertex_data, dtype=np.float32) / CM_PER_M,
-        np.array(faces, dtype=np.uint32),
+        vertex_data / CM_PER_M,
+        faces,
         texture_data,
         annotations=get_annotation_dict_from_piece_data(piece_data),
         turn_points=turn_points / CM_PER_M
@@ -101,50 +112,34 @@ def convert_rows_of_vertices_into_triangles(vertices_by_line: List[List[Optional
     return mesh, vertex_indices
 
 
-def get_all_vertex_relationships(vertices_by_line: List[List[Optional[np.ndarray]]],
-                                 grid_indices: np.ndarray) -> VertexRelations:
+def get_all_vertex_relationships(grid: PieceGrid, grid_indices: np.ndarray) -> VertexRelations:
     """ Extract relationships between vertices  """
-    stress_relations = []
-    shear_relations = []
-    bend_relations = []
-
-    nr_rows = len(vertices_by_line)
-    nr_cols = len(vertices_by_line[0])
-
-    for i in range(nr_rows):
-        for j in range(nr_cols):
-            current_ind = grid_indices[i, j]
-            lower_left = grid_indices[i - 1, j - 1] if i > 0 and j > 0 else None
-            lower_middle = grid_indices[i - 1, j] if i > 0 else None
-            middle_left = grid_indices[i, j - 1] if j > 0 else None
-            upper_middle = grid_indices[i + 1, j] if i < nr_rows - 1 else None
-            middle_right = grid_indices[i, j + 1] if j < nr_cols - 1 else None
-
-            if current_ind:
-                if lower_middle:
-                    stress_relations.append([current_ind - 1, lower_middle - 1])
-
-                    if upper_middle:
-                        bend_relations.append([upper_middle - 1, current_ind - 1, lower_middle - 1])
-
-                if middle_left:
-                    stress_relations.append([current_ind - 1, middle_left - 1])
-
-                    if middle_right:
-                        bend_relations.append([middle_right - 1, current_ind - 1, middle_left - 1])
-
-                if lower_left:
-                    shear_relations.append([current_ind - 1, lower_left - 1])
-
-            if lower_middle and middle_left:
-                shear_relations.append([lower_middle - 1, middle_left - 1])
-
-    return VertexRelations(
-        np.array(stress_relations, dtype=np.uint32),
-        np.array(shear_relations, dtype=np.uint32),
-        np.array(bend_relations, dtype=np.uint32),
+    current = grid_indices
+    lower_left = get_neighbour_indices(grid_indices, -1, -1)
+    lower_middle = get_neighbour_indices(grid_indices, -1, 0)
+    middle_left = get_neighbour_indices(grid_indices, 0, -1)
+    upper_middle = get_neighbour_indices(grid_indices, 1, 0)
+    middle_right = get_neighbour_indices(grid_indices, 0, 1)
+
+    has_current = current > 0
+    has_lower_middle = lower_middle > 0
+    has_middle_left = middle_left > 0
+
+    stress_relations = select_grid_relations(
+        [(current, lower_middle), (current, middle_left)],
+        [has_current & has_lower_middle, has_current & has_middle_left]
+    )
+    shear_relations = select_grid_relations(
+        [(current, lower_left), (lower_middle, middle_left)],
+        [has_current & (lower_left > 0), has_lower_middle & has_middle_left]
+    )
+    bend_relations = select_grid_relations(
+        [(upper_middle, current, lower_middle), (middle_right, current, middle_left)],
+        [has_current & has_lower_middle & (upper_middle > 0), has_current & has_middle_left & (middle_right > 0)]
     )
 
+    return VertexRelations(stress_relations, shear_relations, bend_relations, int(grid_indices.max()))
+
 
 def get_sewing_range(piece_mesh: MeshData, sewing_entry: dict) -> \
                      Tuple[np.ndarray, np.ndarray, float, float]:
@@ -161,19 +156,9 @@ def get_offset_contour_3d(piece_mesh: MeshData, piece_data: dict) -> np.ndarray:
     return Polygon(contour).exterior
 
 
-def get_indices_of_closest_points_in_mesh(piece_mesh: MeshData, sewing_points: np.ndarray) -> np.ndarray:
-    """ Given 2d sewing points find the indices in the mesh of the closest vertices (assumes mesh has z=0) """
-    # ToDo - when optimising figure out contour indices at the beginning will make this O(n) search in terms of resolution
-    vertices = piece_mesh.vertices_2d
-    output = []
-    for pt in sewing_points:
-        output.append(np.linalg.norm(vertices - pt, axis=1).argmin())
-
-    return np.array(output, dtype=np.uint32)
-
-
-def get_indices_for_one_sewing_pair(sewing_pair: dict, pieces: Dict[str, DynamicPiece],
-                                    clothing_data: dict) -> SewingPairRelations:
+def get_indices_for_one_sewing_pair(sewing_pair: dict, pieces: Dict[str, DynamicPiece], clothing_data: dict,
+                                    boundary_indices: Dict[str, BoundaryIndex],
+                                    sewing_spacing: float = SEWING_SPACING) -> SewingPairRelations:
     """ Extract sewing pair of interacting vertices for one sewing entry """
     from_piece_name = sewing_pair["from"]["piece"]
     from_piece_mesh = pieces[from_piece_name].mesh
@@ -189,45 +174,61 @@ def get_indices_for_one_sewing_pair(sewing_pair: dict, pieces: Dict[str, Dynamic
 
     average_length = (to_sewing_length + from_sewing_length) / 2
 
-    nr_sewing_points = int(average_length / SEWING_SPACING)
+    nr_sewing_points = int(average_length / sewing_spacing)
 
     from_points = points_along_contour(from_contour, *from_range, nr_sewing_points)
     from_points_2d = np.array([[p.x, p.y] for p in from_points], dtype=np.float32)
-    from_sewing_indices = get_indices_of_closest_points_in_mesh(from_piece_mesh, from_points_2d)
+    from_sewing_indices = boundary_indices[from_piece_name].get_closest_vertices(from_points_2d)
 
     to_points = points_along_contour(to_contour, *to_range, nr_sewing_points)
     to_points_2d = np.array([[p.x, p.y] for p in to_points], dtype=np.float32)
-    to_sewing_indices = get_indices_of_closest_points_in_mesh(to_piece_mesh, to_points_2d)
+    to_sewing_indices = boundary_indices[to_piece_name].get_closest_vertices(to_points_2d)
 
     return SewingPairRelations(from_piece_name, from_sewing_indices, to_piece_name, to_sewing_indices)
 
 
-def extract_all_piece_vertices(clothing_data: dict,
-                               body_mesh: Optional[MeshData] = None) -> Tuple[Dict[str, DynamicPiece], SewingConstraints]:
-    """ Get piece simulation and display data from every piece in clothing data """
+def extract_all_piece_vertices(clothing_data: dict, body_mesh: Optional[MeshData] = None,
+                               resolution: Optional[float] = None, config: SimulationConfig = DEFAULT_CONFIG) -> \
+                               Tuple[Dict[str, DynamicPiece], SewingConstraints]:
+    """
+        Get piece simulation and display data from every piece in clothing data at grid resolution (cm)
+        Setup uses parameters of config, which pieces and sewing constraints keep for simulation
+        Resolution defaults to the vertex resolution of config
+    """
+    resolution = config.vertex_resolution if resolution is None else resolution
     output = {}
+    boundary_indices = {}
 
     for key, piece_data in clothing_data["pieces"].items():
-        vertices_by_line = extract_grid(piece_data)
-        mesh, grid_indices = convert_rows_of_vertices_into_triangles(vertices_by_line, piece_data)
-        vertex_relations = get_all_vertex_relationships(vertices_by_line, grid_indices)
+        grid = extract_grid(piece_data, resolution)
+        mesh, grid_indices = convert_rows_of_vertices_into_triangles(grid, piece_data)
+        vertex_relations = get_all_vertex_relationships(grid, grid_indices)
+        boundary_indices[key] = BoundaryIndex.from_grid(grid_indices, mesh.vertices_2d)
         output[key] = DynamicPiece(mesh, vertex_relations,
                                    piece_data["body_points"]["snap"]["name"],
-                                   piece_data["body_points"]["alignment"]["name"])
+                                   piece_data["body_points"]["alignment"]["name"], resolution, grid, config)
 
     all_sewing = [
-        get_indices_for_one_sewing_pair(sew_pair, output, clothing_data) for sew_pair in clothing_data["sewing"]
+        get_indices_for_one_sewing_pair(sew_pair, output, clothing_data, boundary_indices, config.sewing_spacing)
+        for sew_pair in clothing_data["sewing"]
     ]
-    sewing_constraints = SewingConstraints(all_sewing)
+    sewing_constraints = SewingConstraints(all_sewing, config)
 
     if body_mesh is not None:
-        for key, new_piece in output.items():
-            snap_and_align_piece_to_body(new_piece, body_mesh)
+        align_all_pieces_to_body(output, body_mesh, config.distance_from_body)
+
+        # Resolve body normal at the snap point of every wrapping piece in one query
+        wrap_snap_points = [
+            piece.snap_point for key, piece in output.items() if clothing_data["pieces"][key].get("wraps_around_body")
+        ]
+        if wrap_snap_points:
+            body_mesh.get_closest_surface(np.array(wrap_snap_points))
 
+        for key, new_piece in output.items():
             if clothing_data["pieces"][key].get("wraps_around_body"):
-                bend_piece_over_body(new_piece, body_mesh, VERTEX_RESOLUTION / CM_PER_M)
+                bend_piece_over_body(new_piece, body_mesh, resolution / CM_PER_M, config.wrap_radians)
 
-            new_piece.body_collision_adjustment(body_mesh.trimesh)
+            new_piece.body_collision_adjustment(body_mesh)
 
     return output, sewing_constraints
 
@@ -0,0 +1,173 @@
+""" On-disk cache of pieces and sewing constraints built from a garment so repeated runs skip setup """
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+import json
+import shutil
+
+import numpy as np
+
+from src.utils.file_io import read_json
+from src.utils.hashing import get_content_hash
+from src.simulation.common import PieceGrid
+from src.simulation.mesh import MeshData
+from src.simulation.piece_physics import DynamicPiece
+from src.simulation.sewing_constraints import SewingPairRelations, SewingConstraints
+from src.simulation.setup.vertex_relationships import VertexRelations
+from src.simulation.setup.extract_clothing_vertex_data import extract_all_piece_vertices
+from src.simulation.config import SimulationConfig, DEFAULT_CONFIG
+
+from src.parameters import CM_PER_M, CACHE_DIRECTORY
+
+SETUP_CACHE_FOLDER = 'setup'  # Sub-folder of cache directory holding one folder per cached garment
+SETUP_CACHE_MAX_BYTES = 512 * 1024 ** 2  # Least recently used garments are removed above this total size
+SETUP_CACHE_VERSION = 1  # Increment when the layout of cached pieces or sewing changes, old entries are then missed
+MANIFEST_NAME = 'manifest.json'
+
+
+def get_setup_cache_key(clothing_data: dict, body_mesh: Optional[MeshData], resolution: Optional[float] = None,
+                        config: SimulationConfig = DEFAULT_CONFIG) -> str:
+    """
+        Hash of everything setup output depends on, the garment, setup parameters and the body
+        Physics parameters of config are left out so garments are shared by configs only differing in them
+    """
+    parameters = {
+        'SETUP_CACHE_VERSION': SETUP_CACHE_VERSION,
+        'VERTEX_RESOLUTION': config.vertex_resolution if resolution is None else resolution,
+        'CM_PER_M': CM_PER_M,
+        'SEWING_SPACING': config.sewing_spacing,
+        'AVATAR_SCALING': config.avatar_scaling,
+        'WRAP_RADIANS': config.wrap_radians,
+        'DISTANCE_FROM_BODY': config.distance_from_body,
+    }
+    if body_mesh is None:
+        return get_content_hash(clothing_data, parameters, None)
+
+    annotations = {name: point.tolist() for name, point in body_mesh.annotations.items()}
+    return get_content_hash(clothing_data, parameters, body_mesh.vertices_3d, body_mesh._index_data, annotations)
+
+
+def save_piece(path: Path, piece: DynamicPiece):
+    """ Write mesh, relations and collision cache of piece to .npz file """
+    mesh = piece.mesh
+    annotation_names = list(mesh.annotations.keys())
+    np.savez(
+        path,
+        vertex_data=mesh._vertex_data,
+        index_data=mesh._index_data,
+        turn_points=mesh._turn_points,
+        origin_array=np.array(mesh.origin_array, dtype=np.float64),
+        annotation_names=np.array(annotation_names),
+        annotation_points=np.array([mesh.annotations[name] for name in annotation_names], dtype=np.float64),
+        stress_relations=piece.vertex_relations.stress_relations,
+        shear_relations=piece.vertex_relations.shear_relations,
+        bend_relations=piece.vertex_relations.bend_relations,
+        nr_vertices=piece.vertex_relations.nr_vertices,
+        nearest_triangle_cache=piece.nearest_triangle_cache,
+        resolution=piece.resolution,
+        grid_x_range=piece.grid.x_range,
+        grid_y_range=piece.grid.y_range,
+        grid_inside_mask=piece.grid.inside_mask,
+    )
+
+
+def load_piece(path: Path, snap_point_name: str, alignment_point_name: str,
+               config: SimulationConfig = DEFAULT_CONFIG) -> DynamicPiece:
+    """ Read piece written by save_piece to simulate with config """
+    data = np.load(path)
+    annotations = {
+        str(name): point.copy() for name, point in zip(data["annotation_names"], data["annotation_points"])
+    }
+    texture_data = {
+        (0.5, 0.5, 0.5): {'count': len(data["index_data"]), 'offset': 0}
+    }
+
+    mesh = MeshData(data["vertex_data"], data["index_data"], texture_data, annotations=annotations,
+                    turn_points=data["turn_points"], centre_at_origin=False)
+    mesh.origin_array = tuple(data["origin_array"])
+
+    vertex_relations = VertexRelations(data["stress_relations"], data["shear_relations"],
+                                       data["bend_relations"], int(data["nr_vertices"]))
+    grid = PieceGrid(data["grid_x_range"], data["grid_y_range"], data["grid_inside_mask"])
+    piece = DynamicPiece(mesh, vertex_relations, snap_point_name, alignment_point_name,
+                         float(data["resolution"]), grid, config)
+    piece.nearest_triangle_cache[:] = data["nearest_triangle_cache"]
+    return piece
+
+
+def save_setup(folder: Path, pieces: Dict[str, DynamicPiece], sewing_constraints: SewingConstraints):
+    """ Write every piece, sewing indices and a manifest describing them into folder """
+    folder.mkdir(parents=True, exist_ok=True)
+    manifest = {'pieces': [], 'sewing': []}
+
+    for ind, (key, piece) in enumerate(pieces.items()):
+        file_name = f"piece_{ind}.npz"
+        save_piece(folder / file_name, piece)
+        manifest['pieces'].append({
+            'name': key, 'file': file_name,
+            'snap': piece.snap_point_name, 'alignment': piece.alignment_point_name
+        })
+
+    sewing_arrays = {}
+    for ind, relation in enumerate(sewing_constraints):
+        sewing_arrays[f"indices_{ind}"] = relation.indices
+        manifest['sewing'].append({'from': relation.from_piece, 'to': relation.to_piece})
+    np.savez(folder / "sewing.npz", **sewing_arrays)
+
+    # Manifest is written last so a folder with a manifest is always complete
+    with open(folder / MANIFEST_NAME, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+
+
+def load_setup(folder: Path, config: SimulationConfig = DEFAULT_CONFIG) -> \
+               Tuple[Dict[str, DynamicPiece], SewingConstraints]:
+    """ Read pieces and sewing constraints written by save_setup to simulate with config """
+    manifest = read_json(str(folder / MANIFEST_NAME))
+
+    pieces = {
+        entry['name']: load_piece(folder / entry['file'], entry['snap'], entry['alignment'], config)
+        for entry in manifest['pieces']
+    }
+
+    sewing_arrays = np.load(folder / "sewing.npz")
+    all_sewing = []
+    for ind, entry in enumerate(manifest['sewing']):
+        indices = sewing_arrays[f"indices_{ind}"].reshape(-1, 2)
+        all_sewing.append(SewingPairRelations(entry['from'], indices[:, 0], entry['to'], indices[:, 1]))
+
+    return pieces, SewingConstraints(all_sewing, config)
+
+
+def get_folder_size(folder: Path) -> int:
+    """ Get total bytes of files in folder """
+    return sum(path.stat().st_size for path in folder.iterdir() if path.is_file())
+
+
+def evict_setup_cache(cache_folder: Path, max_bytes: int = SETUP_CACHE_MAX_BYTES):
+    """ Remove least recently used garments until cache is within max_bytes """
+    entries = [folder for folder in cache_folder.iterdir() if (folder / MANIFEST_NAME).exists()]
+    entries.sort(key=lambda folder: (folder / MANIFEST_NAME).stat().st_mtime, reverse=True)
+
+    total_bytes = 0
+    for folder in entries:
+        total_bytes += get_folder_size(folder)
+        if total_bytes > max_bytes:
+            shutil.rmtree(folder, ignore_errors=True)
+
+
+def get_all_piece_vertices(clothing_data: dict, body_mesh: Optional[MeshData] = None,
+                           resolution: Optional[float] = None, cache_directory: str = CACHE_DIRECTORY,
+                           max_bytes: int = SETUP_CACHE_MAX_BYTES, config: SimulationConfig = DEFAULT_CONFIG) -> \
+                           Tuple[Dict[str, DynamicPiece], SewingConstraints]:
+    """ Load pieces and sewing constraints of garment from disk cache, extracting and caching them if not present """
+    cache_folder = Path(cache_directory) / SETUP_CACHE_FOLDER
+    folder = cache_folder / get_setup_cache_key(clothing_data, body_mesh, resolution, config)
+    manifest_path = folder / MANIFEST_NAME
+
+    if manifest_path.exists():
+        manifest_path.touch()  # Mark as recently used
+        return load_setup(folder, config)
+
+    pieces, sewing_constraints = extract_all_piece_vertices(clothing_data, body_mesh, resolution, config)
+    save_setup(folder, pieces, sewing_constraints)
+    evict_setup_cache(cache_folder, max_bytes)
+    return pieces, sewing_constraints
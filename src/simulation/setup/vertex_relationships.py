@@ -1,6 +1,44 @@
 """ Module that contains relationships between vertices of a clothing piece """
+from typing import List, Optional, Tuple, TYPE_CHECKING
+
 import numpy as np
-from matplotlib.collections import LineCollection
+from scipy.sparse import csr_matrix, hstack
+
+if TYPE_CHECKING:
+    from matplotlib.collections import LineCollection
+
+
+def build_incidence_operator(relations: np.ndarray, coefficients: Tuple[float, ...],
+                             nr_vertices: int, entries: Optional[np.ndarray] = None) -> csr_matrix:
+    """
+        Sparse (vertices x relations) matrix that sums a value per relation onto each of its vertices
+        scaled by the coefficient of the vertex position within the relation
+        Entries is an optional (relations x positions) mask of which vertex of each relation receives its value
+    """
+    nr_relations = len(relations)
+    rows = relations.T.flatten()
+    columns = np.tile(np.arange(nr_relations), len(coefficients))
+    data = np.repeat(np.array(coefficients, dtype=np.float32), nr_relations)
+    if entries is not None:
+        keep = entries.T.flatten()
+        rows, columns, data = rows[keep], columns[keep], data[keep]
+    return csr_matrix((data, (rows, columns)), shape=(nr_vertices, nr_relations), dtype=np.float32)
+
+
+def create_line_collection(lines: np.ndarray, **kwargs) -> "LineCollection":
+    """ Create matplotlib line collection, matplotlib is only imported when relations are drawn """
+    from matplotlib.collections import LineCollection
+    return LineCollection(lines, **kwargs)
+
+
+def apply_incidence_operator(operator: csr_matrix, values: np.ndarray) -> np.ndarray:
+    """ Sum per relation values onto vertices, values may have a leading batch dimension sharing the operator """
+    if values.ndim == 2:
+        return operator @ values
+
+    nr_batch, nr_relations, nr_dims = values.shape
+    summed = operator @ values.transpose(1, 0, 2).reshape(nr_relations, nr_batch * nr_dims)
+    return summed.reshape(-1, nr_batch, nr_dims).transpose(1, 0, 2)
 
 
 class VertexRelations:
@@ -11,36 +49,72 @@ class VertexRelations:
         3. Bend: horizontal and vertical vertices between two neighbours
 
         Data contains integers references of vertex data
+        Incidence operators accumulate per-relation forces onto vertices with one sparse product
     """
     def __init__(self, stress_relations: np.ndarray,
-                 shear_relations: np.ndarray, bend_relations: np.ndarray):
+                 shear_relations: np.ndarray, bend_relations: np.ndarray, nr_vertices: int):
         self.stress_relations = stress_relations
         self.shear_relations = shear_relations
         self.bend_relations = bend_relations
+        self.nr_vertices = nr_vertices
+
+        # Force on a pair acts positively on the first vertex and negatively on the second
+        self.stress_operator = build_incidence_operator(stress_relations, (1., -1.), nr_vertices)
+        self.shear_operator = build_incidence_operator(shear_relations, (1., -1.), nr_vertices)
+        # Bend force pulls the middle vertex and pushes half back on each end
+        self.bend_operator = build_incidence_operator(bend_relations, (-0.5, 1., -0.5), nr_vertices)
+        self._combined_operator = None
+
+    @property
+    def nr_relations(self) -> int:
+        """ Get total number of stress, shear and bend relations """
+        return len(self.stress_relations) + len(self.shear_relations) + len(self.bend_relations)
+
+    @property
+    def combined_operator(self) -> csr_matrix:
+        """
+            Incidence of all relations ordered stress, shear then bend as one CSR matrix
+            Row i lists every relation touching vertex i, which allows a race free per vertex gather
+        """
+        if self._combined_operator is None:
+            self._combined_operator = hstack(
+                [self.stress_operator, self.shear_operator, self.bend_operator], format='csr'
+            )
+        return self._combined_operator
+
+    @classmethod
+    def concatenate(cls, all_relations: List["VertexRelations"], offsets: List[int]) -> "VertexRelations":
+        """ Join relations of several pieces into one, shifting indices by each piece vertex offset """
+        return cls(
+            np.concatenate([r.stress_relations + o for r, o in zip(all_relations, offsets)]).astype(np.uint32),
+            np.concatenate([r.shear_relations + o for r, o in zip(all_relations, offsets)]).astype(np.uint32),
+            np.concatenate([r.bend_relations + o for r, o in zip(all_relations, offsets)]).astype(np.uint32),
+            sum(r.nr_vertices for r in all_relations)
+        )
 
-    def stress_line_collection(self, vertices: np.ndarray, **kwargs) -> LineCollection:
+    def stress_line_collection(self, vertices: np.ndarray, **kwargs) -> "LineCollection":
         """ Create matplotlib line collection of all stress relationships """
         lines = np.stack([
             vertices[self.stress_relations[:, 0]],
             vertices[self.stress_relations[:, 1]]
         ], axis=1)
 
-        return LineCollection(lines, **kwargs)
+        return create_line_collection(lines, **kwargs)
 
-    def shear_line_collection(self, vertices: np.ndarray, **kwargs) -> LineCollection:
+    def shear_line_collection(self, vertices: np.ndarray, **kwargs) -> "LineCollection":
         """ Create matplotlib line collection of all shear relationships """
         lines = np.stack([
             vertices[self.shear_relations[:, 0]],
             vertices[self.shear_relations[:, 1]]
         ], axis=1)
 
-        return LineCollection(lines, **kwargs)
+        return create_line_collection(lines, **kwargs)
 
-    def bend_line_collection(self, vertices: np.ndarray, **kwargs) -> LineCollection:
+    def bend_line_collection(self, vertices: np.ndarray, **kwargs) -> "LineCollection":
         """ Create matplotlib line collection of all bend relationships """
         lines = np.stack([
             vertices[self.bend_relations[:, 0]],
             vertices[self.bend_relations[:, 2]]
         ], axis=1)
 
-        return LineCollection(lines, **kwargs)
+        return create_line_collection(lines, **kwargs)
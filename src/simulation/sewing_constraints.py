@@ -1,12 +1,21 @@
 ''' Handles calculation of sewing forces between pieces '''
-from typing import List, Iterator, Dict
+from typing import List, Iterator, Dict, Optional, Tuple
 
 import numpy as np
+from scipy.sparse import csr_matrix
 
 from src.simulation.common import DistanceAdjustment
 from src.simulation.piece_physics import DynamicPiece
+from src.simulation.setup.vertex_relationships import build_incidence_operator, apply_incidence_operator
+from src.simulation.config import SimulationConfig, DEFAULT_CONFIG
 
-from src.parameters import SEWING_ADJUSTMENT_STEP, TIME_DELTA
+
+def get_last_occurrences(indices: np.ndarray) -> np.ndarray:
+    """ Mask of the last occurrence of every value in an index array """
+    _, reversed_first = np.unique(indices[::-1], return_index=True)
+    mask = np.zeros(len(indices), dtype=bool)
+    mask[len(indices) - 1 - reversed_first] = True
+    return mask
 
 
 class SewingPairRelations:
@@ -22,10 +31,11 @@ class SewingPairRelations:
         self.indices = np.array(list(zip(from_indices, to_indices)), dtype=np.uint32)
         self.adjustment = np.zeros((len(self.indices), 3), dtype=np.float64)  # applied in direction from to
 
-    def recalculate_adjustment(self, all_from_vertices: np.ndarray, all_to_vertices: np.ndarray):
+    def recalculate_adjustment(self, all_from_vertices: np.ndarray, all_to_vertices: np.ndarray,
+                               max_adjustment: float = DEFAULT_CONFIG.max_sewing_adjustment):
         """
             Give vertices of two pieces involved find the adjustment to move vertices closer
-            The adjustment amount is capped at SEWING_ADJUSTMENT_STEP in magnitude
+            The adjustment amount is capped at max_adjustment in magnitude
         """
         # ToDo - target for optimising if using references to store relations instead
         self.adjustment *= 0
@@ -36,22 +46,76 @@ class SewingPairRelations:
         vector = to_vertices - from_vertices
         distance = np.linalg.norm(vector, axis=1, keepdims=True)
         vector /= np.where(distance == 0, 1, distance)
-        adjustment_amount = np.minimum(SEWING_ADJUSTMENT_STEP * TIME_DELTA, distance) / 2
+        adjustment_amount = np.minimum(max_adjustment, distance) / 2
 
         self.adjustment += vector * adjustment_amount
 
+    def get_max_gap(self, all_from_vertices: np.ndarray, all_to_vertices: np.ndarray) -> float:
+        """ Largest distance between two vertices sewn together """
+        vector = all_to_vertices[self.indices[:, 1]] - all_from_vertices[self.indices[:, 0]]
+        return float(np.linalg.norm(vector, axis=1).max(initial=0.))
+
 
 class SewingConstraints:
-    """ Calculates resultant adjustment for a piece resulting from sewing """
-    def __init__(self, relations: List[SewingPairRelations]):
+    """
+        Calculates resultant adjustment for a piece resulting from sewing
+        Can be compiled into one global index table to solve all seams at once on packed vertices
+        How far sewn vertices move each step comes from config
+    """
+    def __init__(self, relations: List[SewingPairRelations], config: SimulationConfig = DEFAULT_CONFIG):
         self.relations = relations
+        self.config = config
+
+        self.global_indices: Optional[np.ndarray] = None
+        self.global_rows: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        self.global_operator: Optional[csr_matrix] = None
+
+    def compile_global_indices(self, piece_offsets: Dict[str, int], nr_vertices: int):
+        """
+            Convert every sewing pair into global vertex indices of a packed buffer
+            A vertex repeated on one side of a pair only receives the adjustment of its last occurrence,
+            as when each pair is written back to its piece, so global rows holds the relations applied per side
+        """
+        self.global_indices = np.concatenate([
+            sewing_pair.indices.astype(np.int64) + [piece_offsets[sewing_pair.from_piece],
+                                                    piece_offsets[sewing_pair.to_piece]]
+            for sewing_pair in self
+        ]) if len(self) else np.zeros((0, 2), dtype=np.int64)
+        entries = np.concatenate([
+            np.stack([get_last_occurrences(sewing_pair.indices[:, 0]),
+                      get_last_occurrences(sewing_pair.indices[:, 1])], axis=1)
+            for sewing_pair in self
+        ]) if len(self) else np.zeros((0, 2), dtype=bool)
+        self.global_rows = (np.flatnonzero(entries[:, 0]), np.flatnonzero(entries[:, 1]))
+
+        # Adjustment moves from vertex towards to vertex and the to vertex back by the same amount
+        self.global_operator = build_incidence_operator(self.global_indices, (1., -1.), nr_vertices, entries)
+
+    def get_global_adjustment(self, vertices: np.ndarray) -> np.ndarray:
+        """
+            Get adjustment of every vertex in a packed buffer from all seams in one gather and scatter
+            Contributions to vertices shared by several sewing pairs are summed, each pair counts a vertex once
+            Vertices may have a leading batch dimension, every batch is sewn with the same indices
+        """
+        if self.global_indices is None:
+            raise ValueError("Sewing constraints have not been compiled into global indices")
+
+        from_vertices = vertices[..., self.global_indices[:, 0], :]
+        to_vertices = vertices[..., self.global_indices[:, 1], :]
+
+        vector = to_vertices - from_vertices
+        distance = np.linalg.norm(vector, axis=-1, keepdims=True)
+        vector /= np.where(distance == 0, 1, distance)
+        vector *= np.minimum(self.config.max_sewing_adjustment, distance) / 2
+
+        return apply_incidence_operator(self.global_operator, vector)
 
     def recalculate_adjustment(self, dynamic_pieces: Dict[str, DynamicPiece]):
         """ Calculate in place to position adjustments for each sewing pair """
         for sewing_pair in self:
             from_vertices = dynamic_pieces[sewing_pair.from_piece].mesh.vertices_3d
             to_vertices = dynamic_pieces[sewing_pair.to_piece].mesh.vertices_3d
-            sewing_pair.recalculate_adjustment(from_vertices, to_vertices)
+            sewing_pair.recalculate_adjustment(from_vertices, to_vertices, self.config.max_sewing_adjustment)
 
     def get_adjustment_for_piece(self, piece_name: str) -> DistanceAdjustment:
         indices, amounts = [], []
@@ -1,69 +1,195 @@
 """ Controller of a simulation run """
-from typing import Dict
+from typing import Dict, List, Optional, TYPE_CHECKING
 from time import perf_counter
 
-import plotly.graph_objects as go
-
-from src.display.common import get_hsv_colors, float_rgb_to_str
 from src.utils.read_obj import parse_obj
 from src.utils.file_io import read_json
-from src.simulation.mesh import MeshData, create_mesh_scatter_plot
+from src.simulation.mesh import MeshData
 from src.simulation.piece_physics import DynamicPiece
+from src.simulation.packed_pieces import PackedPieces
 from src.simulation.sewing_constraints import SewingConstraints
+from src.simulation.collision import get_signed_distance_field, BodyBoxHierarchy, SignedDistanceField
+from src.simulation.backends import get_compute_backend
+from src.simulation.recording import FrameRecorder, MemoryFrameRecorder
+from src.simulation.sleep import TileSleepState
+from src.simulation.ensemble import EnsembleParameters, EnsemblePieces
+from src.simulation.convergence import ConvergenceMonitor, ConvergenceTolerances, ConvergenceReport
+from src.simulation.config import SimulationConfig
 from src.simulation.setup.extract_clothing_vertex_data import extract_all_piece_vertices
 
 
-from src.parameters import AVATAR_SCALING, NR_STEPS, RUN_COLLISION_DETECTION
+from src.parameters import AVATAR_SCALING, NR_STEPS, COLLISION_BACKEND, COMPUTE_BACKEND, RECORDING_STRIDE
+
+if TYPE_CHECKING:
+    import plotly.graph_objects as go
+
+COLLISION_BACKENDS = ('trimesh', 'sdf')
 
 
 class FabricSimulation:
-    """ Run a fabric simulation and keep track of piece positions """
-    def __init__(self, body: MeshData, pieces: Dict[str, DynamicPiece], sewing_constraints: SewingConstraints):
+    """
+        Run a fabric simulation and keep track of piece positions
+        In packed mode all pieces share one vertex buffer and are stepped with single calls
+        Kernels and state memory come from the compute backend selected by name
+        Positions are stored by a frame recorder, in memory unless another recorder is given
+        With sleeping, tiles of the piece grids that have come to rest are frozen until something moves them
+        Collision structures of the body are built here unless already built ones are given
+        Given ensemble parameters, every variant of the garment is stepped together in one packed buffer
+        and pieces show the first variant
+        Parameters are those of the config pieces were extracted with unless another config is given
+        Plotting libraries are only imported once frames are displayed
+    """
+    def __init__(self, body: MeshData, pieces: Dict[str, DynamicPiece], sewing_constraints: SewingConstraints,
+                 packed: bool = True, collision_backend: str = COLLISION_BACKEND, broad_phase: bool = True,
+                 backend: str = COMPUTE_BACKEND, recorder: Optional[FrameRecorder] = None, sleeping: bool = False,
+                 body_sdf: Optional[SignedDistanceField] = None, body_broad_phase: Optional[BodyBoxHierarchy] = None,
+                 ensemble: Optional[EnsembleParameters] = None, config: Optional[SimulationConfig] = None):
+        if collision_backend not in COLLISION_BACKENDS:
+            raise ValueError(f"Collision backend {collision_backend} not one of {COLLISION_BACKENDS}")
+
+        if config is not None:
+            for piece in pieces.values():
+                piece.set_config(config)
+            sewing_constraints.config = config
+        self.config = next(iter(pieces.values())).config if config is None else config
+
         self.body = body
         self.pieces = pieces
         self.sewing_constraints = sewing_constraints
-
-        self.frames = []
+        self.backend = get_compute_backend(backend)
+        self.ensemble = ensemble
+        if ensemble is not None and (not packed or sleeping or self.backend.name != 'numpy'):
+            raise ValueError("Ensemble mode needs packed pieces, the numpy backend and sleeping turned off")
+
+        if ensemble is not None:
+            self.packed_pieces = EnsemblePieces(pieces, ensemble)
+        else:
+            self.packed_pieces = PackedPieces(pieces, allocate=self.backend.zeros) if packed else None
+        self.simulated_pieces = [self.packed_pieces] if packed else list(pieces.values())
+        if packed:
+            piece_offsets = {k: piece_slice.start for k, piece_slice in self.packed_pieces.piece_slices.items()}
+            self.sewing_constraints.compile_global_indices(piece_offsets,
+                                                           self.packed_pieces.vertex_relations.nr_vertices)
+
+        self.sleep_states = []
+        if sleeping and packed:
+            self.sleep_states = [TileSleepState.from_pieces(self.packed_pieces, list(pieces.values()),
+                                                            self.sewing_constraints.global_indices)]
+        elif sleeping:
+            self.sleep_states = [TileSleepState.from_pieces(piece, [piece]) for piece in pieces.values()]
+
+        self.body_sdf = None
+        if self.config.run_collision_detection and collision_backend == 'sdf':
+            self.body_sdf = get_signed_distance_field(body, self.config.avatar_scaling) if body_sdf is None \
+                else body_sdf
+
+        self.body_broad_phase = None
+        if self.config.run_collision_detection and collision_backend == 'trimesh' and broad_phase:
+            self.body_broad_phase = BodyBoxHierarchy.from_trimesh(body.trimesh) if body_broad_phase is None \
+                else body_broad_phase
+
+        self.recorder = MemoryFrameRecorder(list(pieces), RECORDING_STRIDE) if recorder is None else recorder
         self.add_vertices_to_frames()
 
-        self.body_scatter_plot = create_mesh_scatter_plot(self.body, marker=dict(color='grey', size=6),
-                                                          name='Body')
-        self.colors = [float_rgb_to_str(c) for c in get_hsv_colors(len(self.pieces))]
+        self._body_scatter_plot = None
 
     def add_vertices_to_frames(self):
         """ Update stored positions in animation buffer """
-        self.frames.append({k: piece.mesh.vertices_3d.copy() for k, piece in self.pieces.items()})
+        self.recorder.record({k: piece.mesh.vertices_3d for k, piece in self.pieces.items()})
+
+    def step(self, nr_steps: int = 1, logging: bool = True, first_step: int = 0):
+        ''' Run simulation for a number of steps, first step sets where the dampening schedule continues from '''
+        for step in range(first_step, first_step + nr_steps):
+            if self.body_broad_phase is not None:
+                self.body_broad_phase.reset_counts()
 
-    def step(self, nr_steps: int = 1, logging: bool = True):
-        ''' Run simulation for a number of steps '''
-        for step in range(nr_steps):
-            for piece in self.pieces.values():
-                piece.update_internal_forces()
+            for piece in self.simulated_pieces:
+                self.backend.update_internal_forces(piece)
 
-            for piece in self.pieces.values():
-                piece.update_velocities(step)
-                piece.update_positions()
-                if RUN_COLLISION_DETECTION:
-                    piece.body_collision_adjustment(self.body.trimesh)
+            for piece in self.simulated_pieces:
+                self.backend.update_velocities(piece, step)
+                piece.freeze_inactive_vertices()
+                self.backend.update_positions(piece)
+                if self.config.run_collision_detection:
+                    self.backend.body_collision_adjustment(piece, self.body, self.body_broad_phase, self.body_sdf)
 
-            self.sewing_constraints.recalculate_adjustment(self.pieces)
-            for piece_key, piece in self.pieces.items():
-                adjustment = self.sewing_constraints.get_adjustment_for_piece(piece_key)
-                piece.apply_adjustment(adjustment)
+            self.apply_sewing_adjustment()
+            for sleep_state in self.sleep_states:
+                sleep_state.update()
 
             self.add_vertices_to_frames()
             if logging:
-                print(f"Running step {step + 1}/{nr_steps}")
+                print(f"Running step {step + 1}/{first_step + nr_steps}")
+                if self.body_broad_phase is not None:
+                    print(f"Collision broad phase tested {self.body_broad_phase.nr_tested} "
+                          f"culled {self.body_broad_phase.nr_culled} vertices")
+
+    def run_until_converged(self, max_steps: Optional[int] = None,
+                            tolerances: ConvergenceTolerances = ConvergenceTolerances(),
+                            logging: bool = True) -> ConvergenceReport:
+        """
+            Step until kinetic energy, displacement and sewing gaps have settled or max_steps is reached
+            Dampening schedule is stretched over max_steps so runs that do not settle end fully dampened
+            Max steps defaults to number of steps of config
+        """
+        max_steps = self.config.nr_steps if max_steps is None else max_steps
+        for piece in self.simulated_pieces:
+            piece.set_dampening_steps(max_steps)
+
+        monitor = ConvergenceMonitor(self.pieces, self.sewing_constraints, tolerances)
+        for step in range(max_steps):
+            self.step(1, logging=False, first_step=step)
+            monitor.update(step)
+            if monitor.converged:
+                break
+
+        report = monitor.get_report()
+        if logging:
+            print(report.reason)
+        return report
+
+    def apply_sewing_adjustment(self):
+        """ Move sewn vertices closer, as one global solve when pieces are packed """
+        if self.ensemble is not None:
+            self.packed_pieces.apply_sewing_adjustment(self.sewing_constraints)
+            return
+
+        if self.packed_pieces is not None:
+            self.backend.apply_sewing_adjustment(self.sewing_constraints, self.packed_pieces.mesh)
+            return
+
+        self.sewing_constraints.recalculate_adjustment(self.pieces)
+        for piece_key, piece in self.pieces.items():
+            adjustment = self.sewing_constraints.get_adjustment_for_piece(piece_key)
+            piece.apply_adjustment(adjustment)
 
     @property
     def nr_frames(self) -> int:
         """ Get total number of frames to display """
-        return len(self.frames)
+        return self.recorder.nr_frames
 
-    def get_scatter_at_frame(self, i: int) -> go.Frame:
+    @property
+    def body_scatter_plot(self) -> "go.Scatter3d":
+        """ Scatter plot of body shown in every frame """
+        if self._body_scatter_plot is None:
+            from src.simulation.mesh.display import create_mesh_scatter_plot
+            self._body_scatter_plot = create_mesh_scatter_plot(self.body, marker=dict(color='grey', size=6),
+                                                               name='Body')
+        return self._body_scatter_plot
+
+    @property
+    def colors(self) -> List[str]:
+        """ Display color of each piece """
+        from src.display.common import get_hsv_colors, float_rgb_to_str
+        return [float_rgb_to_str(c) for c in get_hsv_colors(len(self.pieces))]
+
+    def get_scatter_at_frame(self, i: int) -> "go.Frame":
         """ Return snapshot of simulation as series of scatter plots """
+        import plotly.graph_objects as go
+
+        colors = self.colors
         data = [self.body_scatter_plot]
-        frame_positions = self.frames[i]
+        frame_positions = self.recorder.get_frame(i)
 
         for j, (piece_name, vertices_3d) in enumerate(frame_positions.items()):
             data.append(go.Scatter3d(
@@ -71,7 +197,7 @@ class FabricSimulation:
                 y=vertices_3d[:, 2],
                 z=vertices_3d[:, 1],
                 mode='markers',
-                marker=dict(color=self.colors[j], size=6),
+                marker=dict(color=colors[j], size=6),
                 name=piece_name
             ))
 
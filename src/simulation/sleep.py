@@ -0,0 +1,114 @@
+""" Put tiles of the piece grids that have come to rest to sleep so they skip force, integration and collision work """
+from typing import List, Optional
+
+import numpy as np
+from scipy.sparse import csr_matrix, identity
+
+from src.simulation.piece_physics import DynamicPiece
+from src.simulation.setup.vertex_relationships import VertexRelations
+
+from src.parameters import SLEEP_TILE_SIZE, SLEEP_VELOCITY, SLEEP_STEPS
+
+
+def get_vertex_tiles(pieces: List[DynamicPiece], tile_size: int = SLEEP_TILE_SIZE) -> np.ndarray:
+    """ Tile of every vertex of pieces in order, tiles are tile_size squares of each grid numbered from 0 """
+    all_tiles = []
+    nr_tiles = 0
+    for piece in pieces:
+        if piece.grid is None:
+            raise ValueError("Pieces need the grid they were built from to be split into sleep tiles")
+
+        rows, cols = np.nonzero(piece.grid.inside_mask)
+        nr_tile_cols = -(-piece.grid.shape[1] // tile_size)
+        _, tiles = np.unique((rows // tile_size) * nr_tile_cols + cols // tile_size, return_inverse=True)
+        all_tiles.append(tiles.reshape(-1) + nr_tiles)
+        nr_tiles += int(tiles.max(initial=-1)) + 1
+
+    return np.concatenate(all_tiles).astype(np.int64) if all_tiles else np.zeros(0, dtype=np.int64)
+
+
+def get_tile_adjacency(vertex_tiles: np.ndarray, vertex_pairs: List[np.ndarray]) -> csr_matrix:
+    """ Boolean (tiles x tiles) matrix of tiles connected by any pair of vertices, including each tile itself """
+    nr_tiles = int(vertex_tiles.max(initial=-1)) + 1
+    pairs = np.concatenate([pairs.reshape(-1, 2) for pairs in vertex_pairs]).astype(np.int64)
+    tile_pairs = vertex_tiles[pairs]
+    adjacency = csr_matrix(
+        (np.ones(len(tile_pairs), dtype=bool), (tile_pairs[:, 0], tile_pairs[:, 1])), shape=(nr_tiles, nr_tiles)
+    )
+    return ((adjacency + adjacency.T + identity(nr_tiles, dtype=bool, format='csr')) > 0).tocsr()
+
+
+class TileSleepState:
+    """
+        A tile falls asleep once no vertex in it has moved faster than sleep_velocity for sleep_steps steps
+        Vertices of awake tiles and tiles connected to them by a relation or seam stay active,
+        only active vertices have forces, integration and collision, the rest are frozen in place
+        A sleeping tile wakes as soon as any of its vertices moves, e.g. pulled by an active neighbour or a seam
+    """
+    def __init__(self, piece: DynamicPiece, vertex_tiles: np.ndarray, sewing_indices: Optional[np.ndarray] = None,
+                 sleep_velocity: float = SLEEP_VELOCITY, sleep_steps: int = SLEEP_STEPS):
+        self.piece = piece
+        self.vertex_tiles = vertex_tiles
+        self.sleep_velocity = sleep_velocity
+        self.sleep_steps = sleep_steps
+
+        relations = piece.vertex_relations
+        vertex_pairs = [relations.stress_relations, relations.shear_relations,
+                        relations.bend_relations[:, :2], relations.bend_relations[:, 1:]]
+        if sewing_indices is not None:
+            vertex_pairs.append(sewing_indices)
+        self.tile_adjacency = get_tile_adjacency(vertex_tiles, vertex_pairs)
+
+        self.nr_tiles = self.tile_adjacency.shape[0]
+        self.rest_counts = np.zeros(self.nr_tiles, dtype=np.int64)
+        self.active_tiles = np.ones(self.nr_tiles, dtype=bool)
+
+        self._tile_order = np.argsort(vertex_tiles, kind='stable')
+        self._tile_starts = np.searchsorted(vertex_tiles[self._tile_order], np.arange(self.nr_tiles))
+        self._last_positions = piece.mesh.vertices_3d.copy()
+
+    @classmethod
+    def from_pieces(cls, packed_piece: DynamicPiece, pieces: List[DynamicPiece],
+                    sewing_indices: Optional[np.ndarray] = None,
+                    tile_size: int = SLEEP_TILE_SIZE) -> "TileSleepState":
+        """ Sleep state of a piece made of the vertices of pieces in order, which is the piece itself if unpacked """
+        return cls(packed_piece, get_vertex_tiles(pieces, tile_size), sewing_indices)
+
+    @property
+    def nr_sleeping_tiles(self) -> int:
+        """ Get number of tiles that are asleep """
+        return int(np.count_nonzero(self.rest_counts >= self.sleep_steps))
+
+    def get_tile_speeds(self) -> np.ndarray:
+        """ Fastest speed of any vertex in each tile since last update """
+        vertices = self.piece.mesh.vertices_3d
+        speeds = np.linalg.norm(vertices - self._last_positions, axis=1) / self.piece.config.time_delta
+        self._last_positions[:] = vertices
+        return np.maximum.reduceat(speeds[self._tile_order], self._tile_starts)
+
+    def update(self):
+        """ Count steps each tile has been at rest and activate vertices of awake tiles and their neighbours """
+        if self.nr_tiles == 0:
+            return
+
+        is_moving = self.get_tile_speeds() > self.sleep_velocity
+        self.rest_counts = np.where(is_moving, 0, self.rest_counts + 1)
+        is_awake = self.rest_counts < self.sleep_steps
+
+        active_tiles = (self.tile_adjacency @ is_awake) > 0
+        if np.array_equal(active_tiles, self.active_tiles):
+            return
+
+        self.active_tiles = active_tiles
+        if active_tiles.all():
+            self.piece.set_active_vertices(None, None)
+            return
+
+        active_mask = active_tiles[self.vertex_tiles]
+        relations = self.piece.vertex_relations
+        self.piece.set_active_vertices(active_mask, VertexRelations(
+            relations.stress_relations[active_mask[relations.stress_relations].any(axis=1)],
+            relations.shear_relations[active_mask[relations.shear_relations].any(axis=1)],
+            relations.bend_relations[active_mask[relations.bend_relations].any(axis=1)],
+            relations.nr_vertices
+        ))
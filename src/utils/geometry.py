@@ -2,6 +2,7 @@
 from typing import List, Tuple, NamedTuple
 
 import numpy as np
+from scipy.spatial import cKDTree
 from trimesh import Trimesh
 from shapely.geometry import LineString, Point
 
@@ -102,11 +103,23 @@ def get_each_point_distance_to_3d_line(points: np.ndarray, vector: np.ndarray,
 
 def get_closest_line_origin_for_each_point(points: np.ndarray,
                                            line_origins: np.ndarray, line_vector: np.ndarray):
-    """ Return the index of the closest line starting at origin for each query point """
-    distances = np.array([
-        get_each_point_distance_to_3d_line(points, line_vector, origin) for origin in line_origins
-    ], dtype=np.float64)
-    return np.argmin(distances, axis=0)
+    """
+        Return the index of the closest line starting at origin for each query point
+        Lines are parallel so distance to a line is distance between points projected onto the plane
+        perpendicular to the lines, which is searched with a KD-tree instead of every point line pair
+    """
+    unit_vector = line_vector / np.linalg.norm(line_vector)
+    basis = orthonormal_basis(unit_vector, get_any_perpendicular_vector(unit_vector))[:, 1:]
+
+    _, closest_origins = cKDTree(line_origins @ basis).query(points @ basis)
+    return closest_origins
+
+
+def get_any_perpendicular_vector(vector: np.ndarray) -> np.ndarray:
+    """ Get a vector perpendicular to vector by crossing it with the least aligned axis """
+    axis = np.zeros(3, dtype=np.float64)
+    axis[np.argmin(np.abs(vector))] = 1.
+    return np.cross(vector, axis)
 
 
 def get_projections_onto_line_origins(points: np.ndarray, line_origins: np.ndarray,
@@ -118,39 +131,41 @@ def get_projections_onto_line_origins(points: np.ndarray, line_origins: np.ndarr
     return np.dot(offset_points, line_vector)
 
 
-def rotate_point_in_3d_plane(point: np.ndarray, plane: RotationPlaneData):
-    """ Rotate a point on plane perpendicular to 3d line using Rodrigues rotation formula """
-    point_vector = point - plane.line_origin
+def rotate_points_in_3d_plane(points: np.ndarray, plane: RotationPlaneData) -> np.ndarray:
+    """
+        Rotate each point on plane perpendicular to 3d line using Rodrigues rotation formula
+        Line origin is either one point or one origin per point
+    """
+    point_vectors = points - plane.line_origin
 
-    rotated_current_point = point_vector * plane.cos_theta
-    rotated_current_point += plane.sin_theta * np.cross(plane.line_vector, point_vector)
-    rotated_current_point += plane.line_vector * np.dot(plane.line_vector, point_vector) * (1 - plane.cos_theta)
+    rotated_points = point_vectors * plane.cos_theta
+    rotated_points += plane.sin_theta * np.cross(plane.line_vector, point_vectors)
+    rotated_points += np.outer(point_vectors @ plane.line_vector, plane.line_vector) * (1 - plane.cos_theta)
 
-    return plane.line_origin + rotated_current_point
+    return plane.line_origin + rotated_points
 
 
-def get_bend_round_line_adjustment(current_point: np.ndarray, prev_point: np.ndarray,
-                                   rotate_plane_data: RotationPlaneData):
+def get_bend_round_line_adjustments(current_points: np.ndarray, prev_points: np.ndarray,
+                                    rotate_plane_data: RotationPlaneData) -> np.ndarray:
     """
-        Return adjustment amount for point to rotate in plane perpendicular to line
-        On failure, zero adjustment is returned
+        Return adjustment amount for each point to rotate in plane perpendicular to line
+        keeping its distance to the previous point, on failure zero adjustment is returned
     """
-    vector = current_point - prev_point
-
-    point_distance = np.linalg.norm(vector)
-    if point_distance == 0.:
-        print("Warning!: Two points on mesh appear at same location")
-        return np.zeros(3, dtype=np.float64)
+    vectors = current_points - prev_points
+    point_distances = np.linalg.norm(vectors, axis=1, keepdims=True)
 
-    target_point = rotate_point_in_3d_plane(current_point, rotate_plane_data)
-    target_point_vector = target_point - prev_point
+    target_points = rotate_points_in_3d_plane(current_points, rotate_plane_data)
+    target_point_vectors = target_points - prev_points
+    target_point_vector_norms = np.linalg.norm(target_point_vectors, axis=1, keepdims=True)
 
-    target_point_vector_norm = np.linalg.norm(target_point_vector)
-    if target_point_vector_norm == 0.:
-        print("Warning!: Adusting point parallel to norm")
-        return np.zeros(3, dtype=np.float64)
+    if nr_same := np.count_nonzero(point_distances == 0.):
+        print(f"Warning!: {nr_same} points on mesh appear at same location as previous point")
+    if nr_parallel := np.count_nonzero((target_point_vector_norms == 0.) & (point_distances != 0.)):
+        print(f"Warning!: Adusting {nr_parallel} points parallel to norm")
 
-    return target_point_vector / target_point_vector_norm * point_distance
+    is_valid = (point_distances != 0.) & (target_point_vector_norms != 0.)
+    adjustments = target_point_vectors / np.where(is_valid, target_point_vector_norms, 1.) * point_distances
+    return np.where(is_valid, adjustments, 0.)
 
 
 if __name__ == '__main__':
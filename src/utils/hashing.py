@@ -0,0 +1,22 @@
+""" Content hashing helpers to key cached data on disk """
+import hashlib
+import json
+
+import numpy as np
+
+
+def get_content_hash(*parts) -> str:
+    """ Hash arrays, dictionaries and plain values into a short hex digest """
+    hasher = hashlib.sha1()
+
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            hasher.update(str(part.dtype).encode())
+            hasher.update(str(part.shape).encode())
+            hasher.update(np.ascontiguousarray(part).tobytes())
+        elif isinstance(part, dict):
+            hasher.update(json.dumps(part, sort_keys=True).encode())
+        else:
+            hasher.update(repr(part).encode())
+
+    return hasher.hexdigest()[:16]
@@ -1,117 +1,223 @@
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import json
+import re
 
 import numpy as np
+from trimesh import Trimesh
 
-from src.utils.file_io import read_json
-from src.utils.read_mtl import parse_mtl, parse_vertex
+from src.utils.file_io import read_json, check_mtl_file_exists
+from src.utils.read_mtl import parse_mtl
 from src.simulation.mesh import MeshData, get_annotated_locations_from_dict
 
+OBJ_CACHE_SUFFIX = '.cache.npz'  # Sidecar file next to the .obj holding parsed arrays
+OBJ_CACHE_VERSION = 1  # Increment when the layout of the sidecar cache changes
+OBJ_RECORD_PATTERN = re.compile(r'^[ \t]*(v|vt|vn|f|usemtl)[ \t]+(.*?)[ \t]*$', re.MULTILINE)
 
-def parse_texture_coord(line):
-    ''' Parse value of the form texture coordinares, e.g. 0.491723 -0.123703 '''
-    vertex = [float(x) for x in line.split(' ')]
 
-    if len(vertex) != 2:
-        raise ValueError(f'Texture Coord {line} is wrong length.')
+def parse_float_records(lines: List[str], record_length: int, name: str) -> np.ndarray:
+    ''' Parse lines of space separated floats e.g. -5.490000 20.340000 4.410002 into one array '''
+    values = np.array(' '.join(lines).split(), dtype=np.float64)
 
-    v_original = vertex[0]
-    vertex[0] = -vertex[1]
-    vertex[1] = v_original
+    if len(values) != record_length * len(lines):
+        raise ValueError(f'{name} records are not all of length {record_length}.')
 
-    return vertex
+    return values.reshape(-1, record_length)
 
 
-def parse_face(line):
+def parse_texture_coords(lines: List[str]) -> np.ndarray:
+    ''' Parse texture coordinares, e.g. 0.491723 -0.123703 and rotate them into (-v, u) '''
+    coords = parse_float_records(lines, 2, 'Texture Coord')
+    return np.stack([-coords[:, 1], coords[:, 0]], axis=1)
+
+
+def parse_faces(lines: List[str]) -> np.ndarray:
     '''
-        parse face coordinates e.g. 4/4/4 5/5/5 6/6/6,
-        expect all three vertex, texture and normal coordinates to be present
+        Parse face coordinates e.g. 4/4/4 5/5/5 6/6/6 into (triangles, corner, [vertex, texture, normal]),
+        expect all three vertex, texture and normal coordinates to be present, quads are split in two
     '''
-    face = [[int(x) for x in f.split('/')] for f in line.split(' ')]
+    if not lines:
+        return np.zeros((0, 3, 3), dtype=np.int64)
+
+    nr_corners = np.array([len(line.split()) for line in lines])
+    if np.any((nr_corners != 3) & (nr_corners != 4)):
+        bad_line = lines[int(np.argmax((nr_corners != 3) & (nr_corners != 4)))]
+        raise ValueError(f'Face {bad_line} is not a triangle or quad.')
+
+    corners = np.array(' '.join(lines).replace('/', ' ').split(), dtype=np.int64)
+    if len(corners) != 3 * nr_corners.sum():
+        raise ValueError('Faces do not all have vertex, texture and normal coordinates.')
+    corners = corners.reshape(-1, 3)
+
+    # Second triangle of a quad is corners 2, 3, 0, only kept for quads so triangles stay in file order
+    starts = np.cumsum(nr_corners) - nr_corners
+    triangle_corners = np.stack([
+        starts[:, np.newaxis] + [0, 1, 2],
+        starts[:, np.newaxis] + [2, 3, 0]
+    ], axis=1)
+    has_triangle = np.stack([np.ones(len(lines), dtype=bool), nr_corners == 4], axis=1)
 
-    if len(face) not in [3, 4]:
-        raise ValueError(f'Face {line} is not a triangle or quad.')
+    return corners[triangle_corners[has_triangle]]
 
-    output = []
 
-    if len(face) == 3:
-        output.append(face)
-    elif len(face) == 4:
-        output.append(face[:3])
-        output.append(face[2:] + [face[0]])
+def deduplicate_corners(corners: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    ''' Get unique (vertex, texture, normal) corners in order first seen and index of each corner into them '''
+    unique_corners, first_seen, inverse = np.unique(corners, axis=0, return_index=True, return_inverse=True)
 
-    return output
+    order = np.argsort(first_seen)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
 
+    return unique_corners[order], rank[inverse.reshape(-1)]
 
-def convert_parsed_data_to_numpy(faces, vertices, textures, normals):
+
+def convert_parsed_data_to_numpy(faces: Dict[object, np.ndarray], vertices: np.ndarray,
+                                 textures: np.ndarray, normals: np.ndarray):
     ''' Create an array of all vertices to draw in triplets for every face. '''
-    texture_data = {
-        path: {'count': 0, 'offset': 0} for path in faces.keys()
+    texture_data = {}
+    offset = 0
+    for path, face_array in faces.items():
+        texture_data[path] = {'count': len(face_array), 'offset': offset}
+        offset += len(face_array)
+
+    all_faces = np.concatenate(list(faces.values())) if faces else np.zeros((0, 3, 3), dtype=np.int64)
+    unique_corners, corner_inds = deduplicate_corners(all_faces.reshape(-1, 3))
+
+    vertex_data = np.concatenate([
+        vertices[unique_corners[:, 0] - 1],
+        textures[unique_corners[:, 1] - 1],
+        normals[unique_corners[:, 2] - 1]
+    ], axis=1)
+
+    return vertex_data.astype(np.float32), corner_inds.reshape(-1, 3).astype(np.int32), texture_data
+
+
+def read_obj_records(file_path: str, mtl_dict: dict):
+    ''' Collect lines of each record type of an .obj file and parse each type in bulk '''
+    with open(file_path, 'r') as f:
+        content = f.read()
+
+    lines = {'v': [], 'vt': [], 'vn': []}
+    face_lines = {}
+    current_face_lines = None
+
+    for flag, line_content in OBJ_RECORD_PATTERN.findall(content):
+        if flag == 'f':
+            current_face_lines.append(line_content)
+        elif flag == 'usemtl':
+            current_face_lines = face_lines.setdefault(mtl_dict[line_content]['texture'], [])
+        else:
+            lines[flag].append(line_content)
+
+    faces = {texture: parse_faces(texture_lines) for texture, texture_lines in face_lines.items()}
+    vertices = parse_float_records(lines['v'], 3, 'Vertex')
+    textures = parse_texture_coords(lines['vt'])
+    normals = parse_float_records(lines['vn'], 3, 'Normal')
+
+    return faces, vertices, textures, normals
+
+
+def get_obj_cache_path(file_path: str) -> Path:
+    ''' Path of sidecar cache of an .obj file '''
+    file_path = Path(file_path)
+    return file_path.parent / (file_path.stem + OBJ_CACHE_SUFFIX)
+
+
+def get_obj_source_stamp(file_path: str) -> Tuple[List[int], str]:
+    ''' Modification times and content hash of .obj and its .mtl '''
+    source_paths = [Path(file_path), Path(check_mtl_file_exists(file_path))]
+    hasher = hashlib.sha1()
+    for path in source_paths:
+        hasher.update(path.read_bytes())
+
+    return [path.stat().st_mtime_ns for path in source_paths], hasher.hexdigest()
+
+
+def get_trimesh_topology(vertex_data: np.ndarray, index_data: np.ndarray) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    ''' Index of processed trimesh vertices in vertex data and trimesh faces, None if vertices cannot be matched '''
+    vertex_ids = {}
+    for ind, row in enumerate(vertex_data[:, :3]):
+        vertex_ids.setdefault(row.tobytes(), ind)
+
+    trimesh = Trimesh(vertices=vertex_data[:, :3], faces=index_data, process=True, validate=True)
+    ids = [vertex_ids.get(row.tobytes()) for row in trimesh.vertices.astype(np.float32)]
+    if any(ind is None for ind in ids):
+        return None
+
+    return np.array(ids, dtype=np.int64), np.array(trimesh.faces, dtype=np.int64)
+
+
+def save_obj_cache(file_path: str, vertex_data: np.ndarray, index_data: np.ndarray, texture_data: dict,
+                   trimesh_topology: Optional[Tuple[np.ndarray, np.ndarray]]):
+    ''' Write parsed .obj arrays, processed trimesh topology and source stamp to sidecar file '''
+    mtimes, content_hash = get_obj_source_stamp(file_path)
+    textures = [[list(path) if isinstance(path, tuple) else path, data['count'], data['offset']]
+                for path, data in texture_data.items()]
+    arrays = {
+        'version': OBJ_CACHE_VERSION,
+        'mtimes': np.array(mtimes, dtype=np.int64),
+        'content_hash': content_hash,
+        'texture_data': json.dumps(textures),
+        'vertex_data': vertex_data,
+        'index_data': index_data,
     }
+    if trimesh_topology is not None:
+        arrays['trimesh_vertex_ids'], arrays['trimesh_faces'] = trimesh_topology
 
-    vertex_data = []
-    index_data = []
+    np.savez(get_obj_cache_path(file_path), **arrays)
 
-    ind = 0
-    seen_faces = []
-    for path, face_list in faces.items():
-        texture_data[path]['offset'] = len(index_data)
 
-        for face in face_list:
-            face_inds = []
+def load_obj_cache(file_path: str):
+    ''' Read sidecar cache of .obj if it is still valid for the .obj and .mtl else None '''
+    cache_path = get_obj_cache_path(file_path)
+    if not cache_path.exists():
+        return None
 
-            for vert_ind, tex_ind, normal_ind in face:
-                vertex_tuple = (vert_ind, tex_ind, normal_ind)
-                if vertex_tuple in seen_faces:
-                    face_inds.append(seen_faces.index(vertex_tuple))
-                else:
-                    seen_faces.append(vertex_tuple)
-                    vertex_data.append(vertices[vert_ind - 1] + textures[tex_ind - 1] + normals[normal_ind - 1])
-                    face_inds.append(ind)
-                    ind += 1
+    data = np.load(cache_path)
+    if int(data['version']) != OBJ_CACHE_VERSION:
+        return None
 
-            index_data.append(face_inds)
+    mtl_path = Path(check_mtl_file_exists(file_path))
+    mtimes = [Path(file_path).stat().st_mtime_ns, mtl_path.stat().st_mtime_ns]
+    if mtimes != data['mtimes'].tolist() and get_obj_source_stamp(file_path)[1] != str(data['content_hash']):
+        return None
 
-        texture_data[path]['count'] = len(index_data) - texture_data[path]['offset']
+    texture_data = {
+        tuple(path) if isinstance(path, list) else path: {'count': count, 'offset': offset}
+        for path, count, offset in json.loads(str(data['texture_data']))
+    }
+    trimesh_topology = None
+    if 'trimesh_faces' in data:
+        trimesh_topology = (data['trimesh_vertex_ids'], data['trimesh_faces'])
 
-    return np.array(vertex_data, dtype=np.float32), np.array(index_data, dtype=np.int32), texture_data
+    return data['vertex_data'], data['index_data'], texture_data, trimesh_topology
 
 
-def parse_obj(file_path: str, annotation_path: str):
-    ''' Parse every line of an .obj file into material dict and vertex numpy array '''
-    mtl_dict = parse_mtl(file_path)
+def parse_obj(file_path: str, annotation_path: str, use_cache: bool = True):
+    ''' Parse an .obj file into material dict and vertex numpy array, reusing sidecar cache when valid '''
     annotations = read_json(annotation_path)
 
-    faces = {}
-    current_texture = ''
-
-    vertices = []
-    textures = []
-    normals = []
-    with open(file_path, 'r') as f:
-        while line := f.readline():
-            line = line.strip()
-            flag = line[:line.find(' ')]
-            line_content = line[len(flag) + 1:]
-
-            if flag == 'usemtl':
-                current_texture = mtl_dict[line_content]['texture']
-                if current_texture not in faces:
-                    faces[current_texture] = []
-            elif flag == 'v':
-                vertices.append(parse_vertex(line_content))
-            elif flag == 'vt':
-                textures.append(parse_texture_coord(line_content))
-            elif flag == 'vn':
-                normals.append(parse_vertex(line_content))
-            elif flag == 'f':
-                faces[current_texture].extend(parse_face(line_content))
+    cached = load_obj_cache(file_path) if use_cache else None
+    if cached is not None:
+        vertex_data, index_data, texture_data, trimesh_topology = cached
+        return MeshData(vertex_data, index_data, texture_data,
+                        annotations=get_annotated_locations_from_dict(annotations),
+                        trimesh_topology=trimesh_topology)
 
+    mtl_dict = parse_mtl(file_path)
+    faces, vertices, textures, normals = read_obj_records(file_path, mtl_dict)
     vertex_data, index_data, texture_data = convert_parsed_data_to_numpy(
         faces, vertices, textures, normals
     )
 
-    mesh = MeshData(vertex_data, index_data, texture_data,
+    mesh = MeshData(vertex_data.copy(), index_data, texture_data,
                     annotations=get_annotated_locations_from_dict(annotations))
 
+    if use_cache:
+        trimesh_topology = get_trimesh_topology(vertex_data, index_data)
+        save_obj_cache(file_path, vertex_data, index_data, texture_data, trimesh_topology)
+
     return mesh
 
 